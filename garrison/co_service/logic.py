@@ -83,7 +83,8 @@ class COLogic:
 
     def get_order_snapshot(self, order_id: str) -> Optional[Dict[str, Any]]:
         try:
-            resp = requests.get(f"{self.ledger_url}/orders/{order_id}", timeout=5)
+            # The ledger stores large fields (the model answer) out of line; inline them.
+            resp = requests.get(f"{self.ledger_url}/orders/{order_id}", params={"expand": "answer"}, timeout=5)
             if resp.status_code == 200:
                 return resp.json()
         except:
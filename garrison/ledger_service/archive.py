@@ -0,0 +1,245 @@
+import argparse
+import json
+import os
+import threading
+import zlib
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import database
+from database import read_db, write_db
+
+# Cold storage for the event log. Events of runs that ended more than
+# LEDGER_ARCHIVE_AGE_DAYS ago move out of the `events` table into immutable segment
+# files next to the database (<db>.archive/):
+# - NNNNNNNN.seg: one zlib-compressed block of JSON lines per run
+# - NNNNNNNN.idx.json: the segment's index (run -> block offset/length, order -> run)
+# The archive_segments / archived_runs / archived_orders tables (migration 7) say which
+# segments hold a run or order. Segments are written and fsynced before the catalog rows
+# are committed and the hot rows deleted, so a crash leaves at worst an unreferenced file.
+# Snapshots are not touched; rebuild_snapshots() replays archived runs from their segments.
+# Archived event_ids are kept in archived_event_ids (migration 11), written in the same
+# transaction as the delete, so a retried or re-imported event is still a duplicate.
+ARCHIVE_AGE_DAYS = float(os.environ.get("LEDGER_ARCHIVE_AGE_DAYS", 30))
+ARCHIVE_SEGMENT_EVENTS = int(os.environ.get("LEDGER_ARCHIVE_SEGMENT_EVENTS", 100000))
+ARCHIVE_INTERVAL_SECONDS = float(os.environ.get("LEDGER_ARCHIVE_INTERVAL_SECONDS", 0))
+TERMINAL_STATUSES = ("completed", "failed")
+CANDIDATE_BATCH = 500
+LOOKUP_CHUNK = 900
+
+EVENT_COLUMNS = ("id", "event_id", "ts", "run_id", "order_id", "event_type", "payload")
+# Generated columns of `events` (migration 5), recomputed for archived rows.
+HOT_FIELDS = ("status", "theater", "attempt", "stage", "model_id")
+
+_archive_lock = threading.Lock()
+_indexes = OrderedDict()
+INDEX_CACHE_SIZE = 256
+
+def archive_dir(path=None) -> Path:
+    db = Path(path or database.DB_PATH)
+    return db.with_name(db.stem + ".archive")
+
+def _fsync_dir(directory: Path):
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def _write_file(path: Path, data: bytes):
+    tmp = path.with_name(path.name + ".tmp")
+    with tmp.open("wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+def write_segment(directory: Path, segment: int, runs: Dict[str, list]) -> dict:
+    # runs: run_id -> event rows (EVENT_COLUMNS tuples, id order)
+    blocks = []
+    index = {"format": 1, "segment": segment, "events": 0, "first_id": None, "last_id": None,
+             "runs": {}, "orders": {}}
+    offset = 0
+    for run_id, rows in runs.items():
+        block = zlib.compress("\n".join(json.dumps(list(row)) for row in rows).encode())
+        index["runs"][run_id] = [offset, len(block), len(rows)]
+        offset += len(block)
+        blocks.append(block)
+        for row in rows:
+            if row[4]:
+                index["orders"][row[4]] = run_id
+        index["events"] += len(rows)
+    ids = [row[0] for rows in runs.values() for row in rows]
+    index["first_id"], index["last_id"] = min(ids), max(ids)
+    index["bytes"] = offset
+    directory.mkdir(parents=True, exist_ok=True)
+    _write_file(directory / f"{segment:08d}.seg", b"".join(blocks))
+    _write_file(directory / f"{segment:08d}.idx.json", json.dumps(index).encode())
+    _fsync_dir(directory)
+    return index
+
+def load_index(directory: Path, segment: int) -> dict:
+    # Segments are immutable, so their indexes can be cached indefinitely.
+    key = (str(directory), segment)
+    index = _indexes.get(key)
+    if index is None:
+        index = json.loads((directory / f"{segment:08d}.idx.json").read_bytes())
+        _indexes[key] = index
+        if len(_indexes) > INDEX_CACHE_SIZE:
+            _indexes.popitem(last=False)
+    else:
+        _indexes.move_to_end(key)
+    return index
+
+def read_run_block(directory: Path, segment: int, run_id: str) -> List[list]:
+    entry = load_index(directory, segment)["runs"].get(run_id)
+    if entry is None:
+        return []
+    offset, length, _ = entry
+    with (directory / f"{segment:08d}.seg").open("rb") as f:
+        f.seek(offset)
+        block = f.read(length)
+    return [json.loads(line) for line in zlib.decompress(block).decode().split("\n")]
+
+def _extract(value):
+    # Same values json_extract() yields for the generated columns.
+    if isinstance(value, bool):
+        return int(value)
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, separators=(",", ":"))
+    return value
+
+def to_event_row(values: list) -> dict:
+    row = dict(zip(EVENT_COLUMNS, values))
+    try:
+        payload = json.loads(row["payload"])
+    except ValueError:
+        payload = None
+    for field in HOT_FIELDS:
+        row[field] = _extract(payload.get(field)) if isinstance(payload, dict) else None
+    return row
+
+def cold_events(path=None, run_id: Optional[str] = None, order_id: Optional[str] = None) -> List[dict]:
+    # Archived events of one run and/or order, shaped like `SELECT * FROM events` rows.
+    if not run_id and not order_id:
+        return []
+    with read_db(path) as conn:
+        if run_id:
+            blocks = [(row["segment"], run_id) for row in conn.execute(
+                "SELECT segment FROM archived_runs WHERE run_id = ?", (run_id,))]
+        else:
+            blocks = [(row["segment"], row["run_id"]) for row in conn.execute(
+                "SELECT segment, run_id FROM archived_orders WHERE order_id = ?", (order_id,))]
+    directory = archive_dir(path)
+    rows = []
+    for segment, rid in blocks:
+        for values in read_run_block(directory, segment, rid):
+            if order_id and values[4] != order_id:
+                continue
+            rows.append(to_event_row(values))
+    rows.sort(key=lambda row: row["id"])
+    return rows
+
+def archived_ids(conn, event_ids) -> set:
+    # The given event_ids that are archived (deduplication against the whole ledger).
+    event_ids = list(event_ids)
+    found = set()
+    for i in range(0, len(event_ids), LOOKUP_CHUNK):
+        chunk = event_ids[i:i + LOOKUP_CHUNK]
+        found.update(row[0] for row in conn.execute(
+            f"SELECT event_id FROM archived_event_ids WHERE event_id IN ({', '.join('?' * len(chunk))})", chunk))
+    return found
+
+def index_archived_ids(conn):
+    # Migration 11: archived_event_ids for segments written before it existed.
+    directory = archive_dir(conn.execute("PRAGMA database_list").fetchone()["file"])
+    segments = [row[0] for row in conn.execute("SELECT segment FROM archive_segments WHERE segment > 0 ORDER BY segment")]
+    for segment in segments:
+        for run_id in load_index(directory, segment)["runs"]:
+            conn.executemany("INSERT OR IGNORE INTO archived_event_ids (event_id, id) VALUES (?, ?)",
+                             [(values[1], values[0]) for values in read_run_block(directory, segment, run_id)])
+
+def iter_cold_events(path=None):
+    # Every archived event (EVENT_COLUMNS lists), segment by segment; used by rebuilds.
+    with read_db(path) as conn:
+        segments = [row[0] for row in conn.execute("SELECT segment FROM archive_segments WHERE segment > 0 ORDER BY segment")]
+    directory = archive_dir(path)
+    for segment in segments:
+        for run_id in load_index(directory, segment)["runs"]:
+            yield from read_run_block(directory, segment, run_id)
+
+def archive_runs(path=None, age_days: float = ARCHIVE_AGE_DAYS, segment_events: int = ARCHIVE_SEGMENT_EVENTS) -> dict:
+    # Moves the hot events of every run that ended before the cutoff into new segments.
+    # Holds the projection rebuild lock: a rebuild must not see events mid-move.
+    cutoff = (datetime.now(timezone.utc) - timedelta(days=age_days)).isoformat()
+    directory = archive_dir(path)
+    stats = {"segments": 0, "runs": 0, "events": 0}
+    with _archive_lock, database._rebuild_lock(database._key(path)):
+        while True:
+            runs = _collect_runs(path, cutoff, segment_events)
+            if not runs:
+                break
+            with read_db(path) as conn:
+                segment = conn.execute("SELECT COALESCE(MAX(segment), 0) + 1 FROM archive_segments").fetchone()[0]
+            index = write_segment(directory, segment, runs)
+            with write_db(path) as conn:
+                conn.execute("""
+                INSERT INTO archive_segments (segment, first_id, last_id, events, runs, bytes, created_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                """, (segment, index["first_id"], index["last_id"], index["events"], len(runs), index["bytes"],
+                      datetime.now(timezone.utc).isoformat()))
+                conn.executemany("INSERT OR IGNORE INTO archived_runs (run_id, segment) VALUES (?, ?)",
+                                 [(run_id, segment) for run_id in runs])
+                conn.executemany("INSERT OR IGNORE INTO archived_orders (order_id, run_id, segment) VALUES (?, ?, ?)",
+                                 [(oid, run_id, segment) for oid, run_id in index["orders"].items()])
+                conn.executemany("INSERT OR IGNORE INTO archived_event_ids (event_id, id) VALUES (?, ?)",
+                                 [(row[1], row[0]) for rows in runs.values() for row in rows])
+                # Events committed after we read the run stay hot.
+                conn.executemany("DELETE FROM events WHERE run_id = ? AND id <= ?",
+                                 [(run_id, rows[-1][0]) for run_id, rows in runs.items()])
+            stats["segments"] += 1
+            stats["runs"] += len(runs)
+            stats["events"] += index["events"]
+    return stats
+
+def _collect_runs(path, cutoff: str, segment_events: int) -> Dict[str, list]:
+    runs = {}
+    total = 0
+    with read_db(path) as conn:
+        candidates = conn.execute(f"""
+        SELECT run_id FROM runs_snapshot r
+        WHERE updated_at < ? AND (status IN ({', '.join('?' * len(TERMINAL_STATUSES))}) OR ended_at IS NOT NULL)
+          AND EXISTS (SELECT 1 FROM events e WHERE e.run_id = r.run_id)
+        ORDER BY updated_at LIMIT ?
+        """, (cutoff, *TERMINAL_STATUSES, CANDIDATE_BATCH)).fetchall()
+        for candidate in candidates:
+            rows = [tuple(row) for row in conn.execute(
+                f"SELECT {', '.join(EVENT_COLUMNS)} FROM events WHERE run_id = ? ORDER BY id", (candidate["run_id"],))]
+            if not rows:
+                continue
+            runs[candidate["run_id"]] = rows
+            total += len(rows)
+            if total >= segment_events:
+                break
+    return runs
+
+def archive_status(path=None) -> dict:
+    with read_db(path) as conn:
+        row = conn.execute("""
+        SELECT COUNT(*) AS segments, COALESCE(SUM(events), 0) AS events, COALESCE(SUM(bytes), 0) AS bytes,
+               COALESCE(MAX(last_id), 0) AS last_id
+        FROM archive_segments
+        """).fetchone()
+    return dict(row)
+
+if __name__ == "__main__":
+    from shards import router
+    parser = argparse.ArgumentParser(description="Move events of finished runs into compressed cold segments")
+    parser.add_argument("--age-days", type=float, default=ARCHIVE_AGE_DAYS, help="Archive runs without events for this long")
+    parser.add_argument("--segment-events", type=int, default=ARCHIVE_SEGMENT_EVENTS)
+    args = parser.parse_args()
+    router.open(background=False)
+    for name, db_path in router.paths.items():
+        print(f"{name}: {archive_runs(db_path, args.age_days, args.segment_events)}")
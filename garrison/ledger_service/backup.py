@@ -0,0 +1,182 @@
+import argparse
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, Optional
+
+import database
+from database import init_db, write_db, project_pending, rebuild_snapshots, get_projection_state, max_event_id
+from archive import archive_dir, _fsync_dir
+from blobs import refs
+
+# Hot backups and point-in-time restore.
+# backup_all() copies every ledger file with SQLite's online backup API into
+# LEDGER_BACKUP_DIR/<UTC timestamp>/<shard>.db (plus the archive segments it references and
+# a manifest.json). The copy runs inside one read transaction on its own connection, so it
+# is a consistent snapshot; in WAL mode that never blocks the writer, and copying
+# LEDGER_BACKUP_PAGES pages per step with a short sleep keeps the service responsive.
+# restore() starts from a backup and replays events from a newer ledger file (e.g. the
+# damaged ledger.db or a follower copy) up to an event id or timestamp.
+BACKUP_DIR = os.environ.get("LEDGER_BACKUP_DIR")  # Default: backups/ next to ledger.db
+BACKUP_PAGES = int(os.environ.get("LEDGER_BACKUP_PAGES", 1024))
+BACKUP_SLEEP_MS = float(os.environ.get("LEDGER_BACKUP_SLEEP_MS", 1))
+REPLAY_CHUNK = 5000
+
+_backup_lock = threading.Lock()
+
+def backup_root() -> Path:
+    return Path(BACKUP_DIR) if BACKUP_DIR else database.DB_PATH.parent / "backups"
+
+def backup_db(path, dest: Path) -> dict:
+    src = database._connect(readonly=True, path=path)
+    tmp = dest.with_name(dest.name + ".tmp")
+    tmp.unlink(missing_ok=True)
+    dst = sqlite3.connect(tmp)
+    try:
+        src.execute("BEGIN")
+        _, last_id = get_projection_state(src)
+        max_id = max_event_id(src)
+        segments = [row[0] for row in src.execute("SELECT segment FROM archive_segments")]
+        started = time.perf_counter()
+        src.backup(dst, pages=BACKUP_PAGES, sleep=BACKUP_SLEEP_MS / 1000)
+        elapsed = time.perf_counter() - started
+        src.execute("COMMIT")
+    finally:
+        dst.close()
+        src.close()
+    with tmp.open("rb+") as f:
+        os.fsync(f.fileno())
+    os.replace(tmp, dest)
+    # Segments are immutable; copy the ones the snapshot's catalog references.
+    if segments:
+        source_dir, target_dir = archive_dir(path), archive_dir(dest)
+        target_dir.mkdir(exist_ok=True)
+        for segment in segments:
+            for name in (f"{segment:08d}.seg", f"{segment:08d}.idx.json"):
+                shutil.copy2(source_dir / name, target_dir / name)
+        _fsync_dir(target_dir)
+    return {"file": dest.name, "last_event_id": last_id, "max_event_id": max_id, "bytes": dest.stat().st_size,
+            "segments": len(segments), "seconds": round(elapsed, 3)}
+
+def backup_all(paths: Dict[str, str]) -> dict:
+    # One backup directory per call; shards are copied one after another.
+    with _backup_lock:
+        created = datetime.now(timezone.utc)
+        directory = backup_root() / created.strftime("%Y%m%dT%H%M%S%fZ")
+        directory.mkdir(parents=True)
+        shards = {name: backup_db(path, directory / f"{name}.db") for name, path in paths.items()}
+        manifest = {"format": 1, "created_at": created.isoformat(), "path": str(directory), "shards": shards}
+        (directory / "manifest.json").write_text(json.dumps(manifest, indent=2))
+        _fsync_dir(directory)
+        return manifest
+
+def find_backup(root: Path, shard: str, until_id: Optional[int] = None) -> Path:
+    # A backup directory, or the newest backup under root not past until_id.
+    if (root / "manifest.json").exists():
+        return root
+    best = None
+    for manifest_path in sorted(root.glob("*/manifest.json")):
+        entry = json.loads(manifest_path.read_text())["shards"].get(shard)
+        if entry and (until_id is None or entry["max_event_id"] <= until_id):
+            best = manifest_path.parent
+    if best is None:
+        raise SystemExit(f"No backup of shard {shard!r} under {root}" + (f" at or before event {until_id}" if until_id else ""))
+    return best
+
+def resolve_ts(source: Path, until_ts: str) -> int:
+    # Point in time -> log position: the last event stamped at or before until_ts.
+    conn = database._connect(readonly=True, path=source)
+    try:
+        return conn.execute("SELECT COALESCE(MAX(id), 0) FROM events WHERE ts <= ?", (until_ts,)).fetchone()[0]
+    finally:
+        conn.close()
+
+def replay(source: Path, target: Path, after_id: int, until_id: Optional[int]) -> int:
+    # Copies events (and the blobs they reference) after after_id from source, projecting
+    # each chunk in the same transaction.
+    src = database._connect(readonly=True, path=source)
+    replayed = 0
+    try:
+        while True:
+            rows = src.execute("""
+            SELECT id, event_id, ts, run_id, order_id, event_type, payload FROM events
+            WHERE id > ? AND id <= ? ORDER BY id LIMIT ?
+            """, (after_id, until_id if until_id is not None else 2 ** 63 - 1, REPLAY_CHUNK)).fetchall()
+            if not rows:
+                return replayed
+            digests = {digest for row in rows for digest in refs(row["payload"])}
+            with write_db(target) as conn:
+                for digest in digests:
+                    blob = src.execute("SELECT bytes, data FROM blobs WHERE hash = ?", (digest,)).fetchone()
+                    if blob:
+                        conn.execute("INSERT OR IGNORE INTO blobs (hash, bytes, data) VALUES (?, ?, ?)",
+                                     (digest, blob["bytes"], blob["data"]))
+                conn.executemany("""
+                INSERT INTO events (id, event_id, ts, run_id, order_id, event_type, payload)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (event_id) DO NOTHING
+                """, [tuple(row) for row in rows])
+                project_pending(conn)
+            replayed += len(rows)
+            after_id = rows[-1]["id"]
+    finally:
+        src.close()
+
+def restore(backup: Path, target: Path, shard: str = "default", source: Optional[Path] = None,
+            until_id: Optional[int] = None, until_ts: Optional[str] = None, force: bool = False) -> dict:
+    if until_ts:
+        until_id = resolve_ts(source or (find_backup(backup, shard) / f"{shard}.db"), until_ts)
+    directory = find_backup(backup, shard, until_id)
+    entry = json.loads((directory / "manifest.json").read_text())["shards"][shard]
+    if target.exists() and not force:
+        raise SystemExit(f"{target} exists; pass --force to overwrite it")
+    for suffix in ("", "-wal", "-shm"):
+        Path(f"{target}{suffix}").unlink(missing_ok=True)
+    shutil.copy2(directory / entry["file"], target)
+    if archive_dir(directory / entry["file"]).exists():
+        shutil.rmtree(archive_dir(target), ignore_errors=True)
+        shutil.copytree(archive_dir(directory / entry["file"]), archive_dir(target))
+    init_db(target)
+
+    base = entry["max_event_id"]
+    trimmed = replayed = 0
+    if until_id is not None and until_id < base:
+        # The backup is already past the target point: drop the later events and re-project.
+        with write_db(target) as conn:
+            trimmed = conn.execute("DELETE FROM events WHERE id > ?", (until_id,)).rowcount
+            conn.execute("DELETE FROM snapshot_checkpoints WHERE event_id > ?", (until_id,))
+        rebuild_snapshots(path=target)
+    elif source:
+        replayed = replay(source, target, base, until_id)
+    with write_db(target) as conn:
+        last_id = max_event_id(conn)
+    return {"backup": str(directory), "backup_event_id": base, "replayed": replayed, "trimmed": trimmed,
+            "last_event_id": last_id}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Back up the ledger or restore it to a point in time")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("backup", help="Online backup of every shard into LEDGER_BACKUP_DIR")
+    p = sub.add_parser("restore", help="Restore a backup, replaying newer events from --source")
+    p.add_argument("backup", type=Path, help="A backup directory, or the backup root to pick from")
+    p.add_argument("target", type=Path, help="Ledger file to write")
+    p.add_argument("--shard", default="default")
+    p.add_argument("--source", type=Path, help="Newer ledger file to replay events from")
+    group = p.add_mutually_exclusive_group()
+    group.add_argument("--until-id", type=int, help="Last event id to include")
+    group.add_argument("--until-ts", help="Include events up to this ISO timestamp")
+    p.add_argument("--force", action="store_true", help="Overwrite target")
+    args = parser.parse_args()
+    if args.command == "backup":
+        from shards import router
+        router.open(background=False)
+        print(json.dumps(backup_all(router.paths), indent=2))
+    else:
+        print(json.dumps(restore(args.backup, args.target, args.shard, args.source, args.until_id, args.until_ts,
+                                 args.force), indent=2))
+    database.close_db()
@@ -0,0 +1,99 @@
+import hashlib
+import json
+import os
+import zlib
+from typing import Iterable, List, Optional, Set
+
+from database import ORDER_RESERVED_KEYS
+
+# Out-of-line storage for large payload fields (e.g. the model `answer` of ORDER_COMPLETED).
+# On ingest, every top-level payload field whose JSON encoding exceeds
+# LEDGER_BLOB_THRESHOLD_BYTES is stored once, zlib-compressed, in the `blobs` table
+# (migration 8) keyed by the SHA-256 of its encoding, and replaced in the payload by a
+# reference:
+#   {"$blob": "<sha256 hex>", "bytes": <uncompressed size>}
+# The events table, orders_snapshot.extra and every rebuild then only carry the reference.
+# Reads return references unless the field is named in ?expand= (or expand=*).
+# Fields the projection or the generated columns look at are never moved.
+BLOB_THRESHOLD_BYTES = int(os.environ.get("LEDGER_BLOB_THRESHOLD_BYTES", 4096))
+BLOB_KEY = "$blob"
+PINNED_KEYS = ORDER_RESERVED_KEYS | {"theater", "attempt", "stage", "model_id"}
+
+def is_ref(value) -> bool:
+    return isinstance(value, dict) and BLOB_KEY in value
+
+def store_blob(conn, digest: str, encoded: bytes):
+    conn.execute("INSERT OR IGNORE INTO blobs (hash, bytes, data) VALUES (?, ?, ?)",
+                 (digest, len(encoded), zlib.compress(encoded)))
+
+def refs(payload: str) -> List[str]:
+    # Blob hashes referenced by a stored payload.
+    if f'"{BLOB_KEY}"' not in payload:
+        return []
+    data = json.loads(payload)
+    return [value[BLOB_KEY] for value in data.values() if is_ref(value)] if isinstance(data, dict) else []
+
+def externalize(conn, payload: str) -> str:
+    # Returns the payload JSON with large fields replaced by references; stores the blobs
+    # on conn (inside the caller's transaction). Cheap for small payloads: no parsing.
+    if BLOB_THRESHOLD_BYTES <= 0 or len(payload) <= BLOB_THRESHOLD_BYTES:
+        return payload
+    data = json.loads(payload)
+    if not isinstance(data, dict):
+        return payload
+    moved = False
+    for key, value in data.items():
+        if key in PINNED_KEYS or is_ref(value):
+            continue
+        encoded = json.dumps(value).encode()
+        if len(encoded) <= BLOB_THRESHOLD_BYTES:
+            continue
+        digest = hashlib.sha256(encoded).hexdigest()
+        store_blob(conn, digest, encoded)
+        data[key] = {BLOB_KEY: digest, "bytes": len(encoded)}
+        moved = True
+    return json.dumps(data) if moved else payload
+
+def parse_expand(expand: Optional[str]) -> Optional[Set[str]]:
+    # ?expand=answer,artifacts -> {"answer", "artifacts"}; "*" expands every field.
+    if not expand:
+        return None
+    return {field.strip() for field in expand.split(",") if field.strip()}
+
+def load_blob(conns: Iterable, digest: str):
+    # Blobs are content-addressed, so any shard holding the hash will do.
+    for conn in conns:
+        row = conn.execute("SELECT data FROM blobs WHERE hash = ?", (digest,)).fetchone()
+        if row:
+            return json.loads(zlib.decompress(row["data"]))
+    return None
+
+def expand_fields(conns: List, data: dict, fields: Set[str]) -> dict:
+    for key, value in data.items():
+        if is_ref(value) and ("*" in fields or key in fields):
+            blob = load_blob(conns, value[BLOB_KEY])
+            if blob is not None:
+                data[key] = blob
+    return data
+
+def expand_json(conns: List, text: Optional[str], fields: Optional[Set[str]]) -> Optional[str]:
+    # Expands references in a stored JSON object (event payload, orders_snapshot.extra).
+    if not fields or not text or f'"{BLOB_KEY}"' not in text:
+        return text
+    data = json.loads(text)
+    if not isinstance(data, dict):
+        return text
+    return json.dumps(expand_fields(conns, data, fields))
+
+def expand_rows(conns: List, rows: list, column: str, fields: Optional[Set[str]]) -> list:
+    if not fields:
+        return rows
+    out = []
+    for row in rows:
+        text = row[column]
+        expanded = expand_json(conns, text, fields)
+        if expanded is not text:
+            row = dict(row)
+            row[column] = expanded
+        out.append(row)
+    return out
@@ -0,0 +1,75 @@
+import os
+import threading
+import zlib
+from collections import OrderedDict
+from typing import List, Optional
+
+# Serialized snapshot responses (GET /runs, /orders and their /{id} forms), keyed by
+# path + query string. Every snapshot change advances the projection checkpoint
+# (projection_state), so its last_event_id/updated_at identify the snapshot state and
+# double as the ETag. Entries are only served for the ETag they were built under.
+CACHE_ENTRIES = int(os.environ.get("LEDGER_CACHE_ENTRIES", 1024))
+
+class SnapshotCache:
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self.etag = None
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str, etag: str) -> Optional[bytes]:
+        with self._lock:
+            if etag != self.etag:
+                # Snapshots changed (possibly in another process): everything is stale.
+                self._entries.clear()
+                self.etag = etag
+            body = self._entries.get(key)
+            if body is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return body
+
+    def put(self, key: str, etag: str, body: bytes):
+        with self._lock:
+            if etag != self.etag or self.max_entries <= 0:
+                return
+            self._entries[key] = body
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self):
+        # Write-through: called by the service's own write paths after they commit.
+        with self._lock:
+            self._entries.clear()
+            self.etag = None
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+snapshot_cache = SnapshotCache(CACHE_ENTRIES)
+
+def snapshot_etag(conn) -> str:
+    row = conn.execute("SELECT version, last_event_id, updated_at FROM projection_state WHERE name = 'snapshots'").fetchone()
+    if not row:
+        return '"0-0"'
+    return f'"{row["version"]}-{row["last_event_id"]}-{zlib.crc32(row["updated_at"].encode()):08x}"'
+
+def combine_etags(etags: List[str]) -> str:
+    # Sharded ledgers: one tag over every shard's checkpoint.
+    if len(etags) == 1:
+        return etags[0]
+    return f'"s{len(etags)}-{zlib.crc32("".join(etags).encode()):08x}"'
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # Weak comparison (RFC 9110): a W/ prefix doesn't matter for GET.
+    return any(tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(","))
@@ -1,18 +1,365 @@
 import sqlite3
 import json
 import os
+import queue
+import threading
+import zlib
+from collections import OrderedDict
+from multiprocessing import get_context
+from contextlib import contextmanager
 from pathlib import Path
 from datetime import datetime, timezone
 
-DB_PATH = Path(__file__).parent / "ledger.db"
+from rollups import ROLLUP_EVENTS, apply_rollups, fold_events, write_rollups
+import search
 
-def get_db():
-    conn = sqlite3.connect(DB_PATH)
+DB_PATH = Path(os.environ.get("LEDGER_DB_PATH") or Path(__file__).parent / "ledger.db")
+
+# Connection tuning. WAL lets the read pool keep serving GET /runs, /events etc. while the
+# writer commits; synchronous=NORMAL is durable across process crashes in WAL mode (only an
+# OS crash/power loss can drop the most recent commits).
+# LEDGER_DURABILITY picks what the service's writer acknowledges (see writer.py):
+# - batch: synchronous=FULL, every (group) commit is fsynced before it is acknowledged
+# - async: synchronous=NORMAL, the WAL is fsynced every LEDGER_SYNC_INTERVAL_MS, which
+#   bounds what an OS crash/power loss can drop
+DURABILITY = os.environ.get("LEDGER_DURABILITY", "batch")
+SYNC_INTERVAL_MS = int(os.environ.get("LEDGER_SYNC_INTERVAL_MS", 1000))
+READ_POOL_SIZE = int(os.environ.get("LEDGER_READ_POOL_SIZE", 4))
+BUSY_TIMEOUT_MS = int(os.environ.get("LEDGER_BUSY_TIMEOUT_MS", 5000))
+PRAGMAS = {
+    "synchronous": "NORMAL",
+    "cache_size": -64000,       # ~64MB page cache per connection
+    "mmap_size": 268435456,     # 256MB memory-mapped reads
+    "temp_store": "MEMORY",
+}
+
+# Connection state per database file. Every function below takes an optional `path` and
+# defaults to DB_PATH; with sharding (see shards.py) each shard is a separate ledger file.
+_writers = {}
+_write_locks = {}
+_read_pools = {}
+_state_lock = threading.Lock()
+
+class _ReadPool:
+    def __init__(self):
+        self.conns = queue.Queue()
+        self.open = 0
+        self.lock = threading.Lock()
+
+def _key(path):
+    return str(path or DB_PATH)
+
+def _write_lock(key):
+    with _state_lock:
+        return _write_locks.setdefault(key, threading.RLock())
+
+def _read_pool(key):
+    with _state_lock:
+        return _read_pools.setdefault(key, _ReadPool())
+
+def _connect(readonly=False, path=None):
+    path = path or DB_PATH
+    if readonly:
+        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False,
+                               timeout=BUSY_TIMEOUT_MS / 1000, isolation_level=None)
+    else:
+        conn = sqlite3.connect(path, check_same_thread=False, timeout=BUSY_TIMEOUT_MS / 1000)
+        # Persistent setting stored in the db file; every process sharing ledger.db
+        # (API, ingest_jsonl.py, verify_ledger_parity.py) then runs in WAL mode.
+        conn.execute("PRAGMA journal_mode=WAL")
     conn.row_factory = sqlite3.Row
+    conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+    for k, v in PRAGMAS.items():
+        conn.execute(f"PRAGMA {k}={v}")
     return conn
 
-def init_db():
-    with get_db() as conn:
+@contextmanager
+def write_db(path=None):
+    # Single long-lived writer connection; SQLite allows one writer at a time anyway, so
+    # serialising here avoids SQLITE_BUSY churn between our own threads.
+    key = _key(path)
+    with _write_lock(key):
+        writer = _writers.get(key)
+        if writer is None:
+            writer = _writers[key] = _connect(path=key)
+            if DURABILITY == "batch":
+                writer.execute("PRAGMA synchronous=FULL")
+        try:
+            yield writer
+            writer.commit()
+        except BaseException:
+            writer.rollback()
+            raise
+
+def sync_wal(path=None):
+    # Durability barrier for async mode: fsync the WAL, making every commit so far durable.
+    try:
+        fd = os.open(f"{_key(path)}-wal", os.O_RDONLY)
+    except FileNotFoundError:
+        return
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+@contextmanager
+def read_db(path=None):
+    # Pooled read-only connections (autocommit, so no read transaction outlives the query
+    # and blocks WAL checkpoints).
+    key = _key(path)
+    pool = _read_pool(key)
+    try:
+        conn = pool.conns.get_nowait()
+    except queue.Empty:
+        with pool.lock:
+            grow = pool.open < READ_POOL_SIZE
+            if grow:
+                pool.open += 1
+        if grow:
+            try:
+                conn = _connect(readonly=True, path=key)
+            except Exception:
+                with pool.lock:
+                    pool.open -= 1
+                raise
+        else:
+            conn = pool.conns.get()
+    try:
+        yield conn
+    finally:
+        pool.conns.put(conn)
+
+def close_db():
+    for key in list(_writers):
+        with _write_lock(key):
+            writer = _writers.pop(key, None)
+            if writer is not None:
+                writer.close()
+    for pool in list(_read_pools.values()):
+        while True:
+            try:
+                pool.conns.get_nowait().close()
+            except queue.Empty:
+                break
+        with pool.lock:
+            pool.open = 0
+
+# Indexes on the snapshot tables. Also created by MIGRATIONS for existing databases;
+# rebuild_snapshots() recreates them after swapping in freshly built tables.
+SNAPSHOT_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS idx_runs_snapshot_started_at ON runs_snapshot (started_at)",
+    "CREATE INDEX IF NOT EXISTS idx_runs_snapshot_status ON runs_snapshot (status, started_at)",
+    "CREATE INDEX IF NOT EXISTS idx_runs_snapshot_theater ON runs_snapshot (theater, status)",
+    "CREATE INDEX IF NOT EXISTS idx_runs_snapshot_updated_at ON runs_snapshot (updated_at)",
+    "CREATE INDEX IF NOT EXISTS idx_orders_snapshot_status ON orders_snapshot (status, updated_at)",
+    "CREATE INDEX IF NOT EXISTS idx_orders_snapshot_theater ON orders_snapshot (theater, status)",
+    "CREATE INDEX IF NOT EXISTS idx_orders_snapshot_run_id ON orders_snapshot (run_id)",
+    "CREATE INDEX IF NOT EXISTS idx_orders_snapshot_updated_at ON orders_snapshot (updated_at)",
+]
+
+# Columns added to both snapshot tables after the initial schema.
+SNAPSHOT_COLUMNS_V2 = {"theater": "TEXT", "updated_at": "TEXT"}
+
+def add_missing_columns(conn, table, columns):
+    existing = {row["name"] for row in conn.execute(f"PRAGMA table_info({table})")}
+    for name, decl in columns.items():
+        if name not in existing:
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN {name} {decl}")
+
+# Schema migrations, applied in order on top of the base tables created by init_db().
+# The number of applied migrations is tracked in PRAGMA user_version; append new
+# entries, never edit or reorder existing ones.
+# First theater per order/run (migration 12, rollups.py); rebuild_snapshots() fills a
+# _new shadow copy and swaps it in.
+ENTITY_THEATERS_TABLE = """
+CREATE TABLE IF NOT EXISTS entity_theaters{suffix} (
+    kind TEXT NOT NULL,
+    entity_id TEXT NOT NULL,
+    event_id INTEGER NOT NULL,
+    theater TEXT NOT NULL,
+    PRIMARY KEY (kind, entity_id)
+) WITHOUT ROWID
+"""
+
+def _index_archived_ids(conn):
+    from archive import index_archived_ids
+    index_archived_ids(conn)
+
+MIGRATIONS = [
+    # 1: secondary indexes for the real access patterns
+    [
+        # GET /events?run_id=... ORDER BY ts DESC
+        "CREATE INDEX IF NOT EXISTS idx_events_run_ts ON events (run_id, ts)",
+        # GET /events?order_id=... ORDER BY ts DESC
+        "CREATE INDEX IF NOT EXISTS idx_events_order_ts ON events (order_id, ts)",
+        # GET /events ORDER BY ts DESC, rebuild_snapshots() replay order
+        "CREATE INDEX IF NOT EXISTS idx_events_ts_id ON events (ts, id)",
+        "CREATE INDEX IF NOT EXISTS idx_events_event_type ON events (event_type)",
+        # GET /runs ORDER BY started_at DESC
+        "CREATE INDEX IF NOT EXISTS idx_runs_snapshot_started_at ON runs_snapshot (started_at)",
+    ],
+    # 2: keyset paging on id within a run/order (GET /events?run_id=...&after_id=...)
+    [
+        "CREATE INDEX IF NOT EXISTS idx_events_run_id ON events (run_id, id)",
+        "CREATE INDEX IF NOT EXISTS idx_events_order_id ON events (order_id, id)",
+    ],
+    # 3: ingest_jsonl.py resume points (byte offset of the last committed line per source)
+    [
+        """
+        CREATE TABLE IF NOT EXISTS ingest_checkpoints (
+            source TEXT PRIMARY KEY,
+            byte_offset INTEGER NOT NULL,
+            lines INTEGER NOT NULL,
+            updated_at TEXT NOT NULL
+        )
+        """,
+    ],
+    # 4: projection checkpoint (high-water mark + merge logic version of the snapshots)
+    [
+        """
+        CREATE TABLE IF NOT EXISTS projection_state (
+            name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL,
+            last_event_id INTEGER NOT NULL,
+            updated_at TEXT NOT NULL
+        )
+        """,
+    ],
+    # 5: hot payload fields as generated columns, so status/theater filters and lookups
+    #    run in SQL without json.loads. VIRTUAL (the only kind ALTER TABLE can add): the
+    #    value is extracted on read, and stored only in the indexes below. Every writer,
+    #    including other processes, gets them for free.
+    [
+        "ALTER TABLE events ADD COLUMN status TEXT GENERATED ALWAYS AS (json_extract(payload, '$.status')) VIRTUAL",
+        "ALTER TABLE events ADD COLUMN theater TEXT GENERATED ALWAYS AS (json_extract(payload, '$.theater')) VIRTUAL",
+        "ALTER TABLE events ADD COLUMN attempt INTEGER GENERATED ALWAYS AS (json_extract(payload, '$.attempt')) VIRTUAL",
+        "ALTER TABLE events ADD COLUMN stage TEXT GENERATED ALWAYS AS (json_extract(payload, '$.stage')) VIRTUAL",
+        "ALTER TABLE events ADD COLUMN model_id TEXT GENERATED ALWAYS AS (json_extract(payload, '$.model_id')) VIRTUAL",
+        "CREATE INDEX IF NOT EXISTS idx_events_status ON events (status, id)",
+        "CREATE INDEX IF NOT EXISTS idx_events_theater ON events (theater, id)",
+        "CREATE INDEX IF NOT EXISTS idx_events_model_id ON events (model_id, id)",
+    ],
+    # 6: theater/updated_at on the snapshots + filter indexes for GET /runs and GET /orders
+    #    (PROJECTION_VERSION 2 backfills them)
+    [
+        lambda conn: add_missing_columns(conn, "runs_snapshot", SNAPSHOT_COLUMNS_V2),
+        lambda conn: add_missing_columns(conn, "orders_snapshot", SNAPSHOT_COLUMNS_V2),
+        *SNAPSHOT_INDEXES[1:8],
+    ],
+    # 7: catalog of cold event segments (archive.py)
+    [
+        """
+        CREATE TABLE IF NOT EXISTS archive_segments (
+            segment INTEGER PRIMARY KEY,
+            first_id INTEGER NOT NULL,
+            last_id INTEGER NOT NULL,
+            events INTEGER NOT NULL,
+            runs INTEGER NOT NULL,
+            bytes INTEGER NOT NULL,
+            created_at TEXT NOT NULL
+        )
+        """,
+        "CREATE TABLE IF NOT EXISTS archived_runs (run_id TEXT NOT NULL, segment INTEGER NOT NULL, PRIMARY KEY (run_id, segment))",
+        "CREATE TABLE IF NOT EXISTS archived_orders (order_id TEXT NOT NULL, run_id TEXT NOT NULL, segment INTEGER NOT NULL, PRIMARY KEY (order_id, segment))",
+    ],
+    # 8: content-addressed store for large payload fields (blobs.py)
+    [
+        "CREATE TABLE IF NOT EXISTS blobs (hash TEXT PRIMARY KEY, bytes INTEGER NOT NULL, data BLOB NOT NULL) WITHOUT ROWID",
+    ],
+    # 9: model-call metrics rollups (rollups.py; PROJECTION_VERSION 3 backfills them)
+    [
+        """
+        CREATE TABLE IF NOT EXISTS metrics_rollups (
+            granularity TEXT NOT NULL,
+            bucket_start TEXT NOT NULL,
+            theater TEXT NOT NULL,
+            model_id TEXT NOT NULL,
+            profile_name TEXT NOT NULL,
+            calls INTEGER NOT NULL,
+            errors INTEGER NOT NULL,
+            cache_hits INTEGER NOT NULL,
+            cache_misses INTEGER NOT NULL,
+            latency_count INTEGER NOT NULL,
+            latency_sum_ms REAL NOT NULL,
+            latency_hist TEXT NOT NULL,
+            prompt_tokens INTEGER NOT NULL,
+            completion_tokens INTEGER NOT NULL,
+            total_tokens INTEGER NOT NULL,
+            PRIMARY KEY (granularity, bucket_start, theater, model_id, profile_name)
+        ) WITHOUT ROWID
+        """,
+    ],
+    # 10: per-entity replay checkpoints behind GET /runs/{id}?as_of= and /orders/{id}?as_of=
+    [
+        """
+        CREATE TABLE IF NOT EXISTS snapshot_checkpoints (
+            kind TEXT NOT NULL,
+            entity_id TEXT NOT NULL,
+            event_id INTEGER NOT NULL,
+            ts TEXT NOT NULL,
+            state TEXT NOT NULL,
+            PRIMARY KEY (kind, entity_id, event_id)
+        ) WITHOUT ROWID
+        """,
+    ],
+    # 11: event_ids of archived events, which left events (and its UNIQUE(event_id)) but
+    #     must still be answered "exists"; backfilled from existing segments
+    [
+        "CREATE TABLE IF NOT EXISTS archived_event_ids (event_id TEXT PRIMARY KEY, id INTEGER NOT NULL) WITHOUT ROWID",
+        "CREATE INDEX IF NOT EXISTS idx_archived_event_ids_id ON archived_event_ids (id)",
+        _index_archived_ids,
+    ],
+    # 12: first theater seen per order/run, which bucket theater-less model-call events in
+    #     metrics_rollups (rollups.py; PROJECTION_VERSION 5 backfills it)
+    [
+        ENTITY_THEATERS_TABLE.format(suffix=""),
+    ],
+]
+
+def create_snapshot_tables(conn, suffix=""):
+    conn.execute(f"""
+    CREATE TABLE IF NOT EXISTS runs_snapshot{suffix} (
+        run_id TEXT PRIMARY KEY,
+        status TEXT,
+        message TEXT,
+        started_at TEXT,
+        ended_at TEXT,
+        order_ids TEXT,
+        max_orders INTEGER,
+        worktree TEXT,
+        order_head TEXT,
+        theater TEXT,
+        updated_at TEXT
+    )
+    """)
+    conn.execute(f"""
+    CREATE TABLE IF NOT EXISTS orders_snapshot{suffix} (
+        order_id TEXT PRIMARY KEY,
+        run_id TEXT,
+        status TEXT,
+        ts TEXT,
+        worktree TEXT,
+        unit_head TEXT,
+        order_head TEXT,
+        extra TEXT,
+        theater TEXT,
+        updated_at TEXT
+    )
+    """)
+
+def migrate(conn):
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    for i, statements in enumerate(MIGRATIONS[version:], start=version + 1):
+        for stmt in statements:
+            if callable(stmt):
+                stmt(conn)
+            else:
+                conn.execute(stmt)
+        conn.execute(f"PRAGMA user_version = {i}")
+        print(f"Applied ledger migration {i}.")
+
+def init_db(path=None):
+    with write_db(path) as conn:
         conn.execute("""
         CREATE TABLE IF NOT EXISTS events (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -24,141 +371,631 @@ def init_db():
             payload TEXT NOT NULL
         )
         """)
-        conn.execute("""
-        CREATE TABLE IF NOT EXISTS runs_snapshot (
-            run_id TEXT PRIMARY KEY,
-            status TEXT,
-            message TEXT,
-            started_at TEXT,
-            ended_at TEXT,
-            order_ids TEXT,
-            max_orders INTEGER,
-            worktree TEXT,
-            order_head TEXT
-        )
-        """)
-        conn.execute("""
-        CREATE TABLE IF NOT EXISTS orders_snapshot (
-            order_id TEXT PRIMARY KEY,
-            run_id TEXT,
-            status TEXT,
-            ts TEXT,
-            worktree TEXT,
-            unit_head TEXT,
-            order_head TEXT,
-            extra TEXT
-        )
-        """)
+        create_snapshot_tables(conn)
+        migrate(conn)
+        search.ensure_index(conn)
     print("Database initialized.")
 
-def rebuild_snapshots():
-    with get_db() as conn:
-        conn.execute("DELETE FROM runs_snapshot")
-        conn.execute("DELETE FROM orders_snapshot")
-        
-        events = conn.execute("SELECT * FROM events ORDER BY ts ASC, id ASC").fetchall()
-        
-        runs = {}
-        orders = {}
-        
-        for ev in events:
-            payload = json.loads(ev["payload"])
-            run_id = ev["run_id"]
-            order_id = ev["order_id"]
-            
-            if run_id:
-                if run_id not in runs:
-                    runs[run_id] = {
-                        "run_id": run_id,
-                        "status": "-",
-                        "message": "-",
-                        "started_at": None,
-                        "ended_at": None,
-                        "order_ids": [],
-                        "max_orders": None,
-                        "worktree": "-",
-                        "order_head": "-"
-                    }
-                r = runs[run_id]
-                
-                # Merge logic similar to co_list.py
-                sa = payload.get("started_at")
-                if sa:
-                    if not r["started_at"] or sa < r["started_at"]:
-                        r["started_at"] = sa
-                
-                ea = payload.get("ended_at")
-                if ea:
-                    if not r["ended_at"] or ea > r["ended_at"]:
-                        r["ended_at"] = ea
-                
-                msg = payload.get("message")
-                if msg: r["message"] = msg
-                
-                oids = payload.get("order_ids")
-                if isinstance(oids, list) and oids:
-                    r["order_ids"] = list(set(r["order_ids"] + [str(x) for x in oids]))
-                
-                mo = payload.get("max_orders")
-                if mo is not None: r["max_orders"] = mo
-                
-                wt = payload.get("worktree")
-                if wt: r["worktree"] = wt
-                
-                oh = payload.get("order_head")
-                if oh: r["order_head"] = oh
-                
-                st = payload.get("status")
-                if st: r["status"] = st
-
-            if order_id:
-                if order_id not in orders:
-                    orders[order_id] = {
-                        "order_id": order_id,
-                        "run_id": run_id or "-",
-                        "status": "-",
-                        "ts": ev["ts"],
-                        "worktree": "-",
-                        "unit_head": "-",
-                        "order_head": "-",
-                        "extra": {}
-                    }
-                o = orders[order_id]
-                st = payload.get("status")
-                if st:
-                    o["status"] = st
-                    o["ts"] = ev["ts"]
-                
-                rid = payload.get("run_id")
-                if rid: o["run_id"] = rid
-                
-                wt = payload.get("worktree")
-                if wt: o["worktree"] = wt
-                
-                uh = payload.get("unit_head")
-                if uh: o["unit_head"] = uh
-                
-                oh = payload.get("order_head")
-                if oh: o["order_head"] = oh
-                
-                # Extras
-                for k, v in payload.items():
-                    if k in {"ts", "run_id", "order_id", "status", "worktree", "unit_head", "order_head", "message", "started_at", "ended_at", "order_ids", "max_orders"}:
-                        continue
-                    o["extra"][k] = v
-
-        # Write snapshots
-        for rid, r in runs.items():
-            conn.execute("""
-            INSERT INTO runs_snapshot (run_id, status, message, started_at, ended_at, order_ids, max_orders, worktree, order_head)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, (r["run_id"], r["status"], r["message"], r["started_at"], r["ended_at"], json.dumps(r["order_ids"]), r["max_orders"], r["worktree"], r["order_head"]))
-            
-        for oid, o in orders.items():
-            conn.execute("""
-            INSERT INTO orders_snapshot (order_id, run_id, status, ts, worktree, unit_head, order_head, extra)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-            """, (o["order_id"], o["run_id"], o["status"], o["ts"], o["worktree"], o["unit_head"], o["order_head"], json.dumps(o["extra"])))
+# Payload keys that are projected onto dedicated order columns (or belong to the run)
+# and therefore never land in orders_snapshot.extra.
+ORDER_RESERVED_KEYS = {"ts", "run_id", "order_id", "status", "worktree", "unit_head", "order_head", "message", "started_at", "ended_at", "order_ids", "max_orders"}
+
+def new_run(run_id):
+    return {
+        "run_id": run_id,
+        "status": "-",
+        "message": "-",
+        "started_at": None,
+        "ended_at": None,
+        "order_ids": {},
+        "max_orders": None,
+        "worktree": "-",
+        "order_head": "-",
+        "theater": None,
+        "updated_at": None
+    }
+
+# While projecting, run["order_ids"] is an ordered set (dict keys, first-seen order) so
+# merging stays O(new ids); it is stored as a JSON list.
+
+def new_order(order_id, run_id, ts):
+    return {
+        "order_id": order_id,
+        "run_id": run_id or "-",
+        "status": "-",
+        "ts": ts,
+        "worktree": "-",
+        "unit_head": "-",
+        "order_head": "-",
+        "extra": {},
+        "theater": None,
+        "updated_at": None
+    }
+
+def merge_updated_at(x, ts):
+    if ts and (not x["updated_at"] or ts > x["updated_at"]):
+        x["updated_at"] = ts
+
+def merge_run(r, ts, payload):
+    # Merge logic similar to co_list.py
+    sa = payload.get("started_at")
+    if sa:
+        if not r["started_at"] or sa < r["started_at"]:
+            r["started_at"] = sa
+    
+    ea = payload.get("ended_at")
+    if ea:
+        if not r["ended_at"] or ea > r["ended_at"]:
+            r["ended_at"] = ea
+    
+    msg = payload.get("message")
+    if msg: r["message"] = msg
+    
+    oids = payload.get("order_ids")
+    if isinstance(oids, list) and oids:
+        for x in oids:
+            r["order_ids"][str(x)] = None
+    
+    mo = payload.get("max_orders")
+    if mo is not None: r["max_orders"] = mo
+    
+    wt = payload.get("worktree")
+    if wt: r["worktree"] = wt
+    
+    oh = payload.get("order_head")
+    if oh: r["order_head"] = oh
+    
+    st = payload.get("status")
+    if st: r["status"] = st
+    
+    th = payload.get("theater")
+    if th: r["theater"] = th
+    
+    merge_updated_at(r, ts)
+
+def merge_order(o, ts, payload):
+    st = payload.get("status")
+    if st:
+        o["status"] = st
+        o["ts"] = ts
+    
+    rid = payload.get("run_id")
+    if rid: o["run_id"] = rid
+    
+    wt = payload.get("worktree")
+    if wt: o["worktree"] = wt
+    
+    uh = payload.get("unit_head")
+    if uh: o["unit_head"] = uh
+    
+    oh = payload.get("order_head")
+    if oh: o["order_head"] = oh
+    
+    th = payload.get("theater")
+    if th: o["theater"] = th
+    
+    merge_updated_at(o, ts)
+    
+    # Extras
+    for k, v in payload.items():
+        if k in ORDER_RESERVED_KEYS:
+            continue
+        o["extra"][k] = v
+
+RUN_COLUMNS = ("run_id", "status", "message", "started_at", "ended_at", "order_ids", "max_orders", "worktree",
+               "order_head", "theater", "updated_at")
+ORDER_COLUMNS = ("order_id", "run_id", "status", "ts", "worktree", "unit_head", "order_head", "extra", "theater",
+                 "updated_at")
+RUN_INSERT = """
+INSERT OR REPLACE INTO {table} (run_id, status, message, started_at, ended_at, order_ids, max_orders, worktree, order_head, theater, updated_at)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+ORDER_INSERT = """
+INSERT OR REPLACE INTO {table} (order_id, run_id, status, ts, worktree, unit_head, order_head, extra, theater, updated_at)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+def run_row(r):
+    return (r["run_id"], r["status"], r["message"], r["started_at"], r["ended_at"], json.dumps(list(r["order_ids"])), r["max_orders"], r["worktree"], r["order_head"], r["theater"], r["updated_at"])
+
+def order_row(o):
+    return (o["order_id"], o["run_id"], o["status"], o["ts"], o["worktree"], o["unit_head"], o["order_head"], json.dumps(o["extra"]), o["theater"], o["updated_at"])
+
+def write_run(conn, r):
+    conn.execute(RUN_INSERT.format(table="runs_snapshot"), run_row(r))
+
+def write_order(conn, o):
+    conn.execute(ORDER_INSERT.format(table="orders_snapshot"), order_row(o))
+
+def load_run(conn, run_id):
+    row = conn.execute("SELECT * FROM runs_snapshot WHERE run_id = ?", (run_id,)).fetchone()
+    if not row:
+        return None
+    r = dict(row)
+    r["order_ids"] = dict.fromkeys(json.loads(r["order_ids"]))
+    return r
+
+def load_order(conn, order_id):
+    row = conn.execute("SELECT * FROM orders_snapshot WHERE order_id = ?", (order_id,)).fetchone()
+    if not row:
+        return None
+    o = dict(row)
+    o["extra"] = json.loads(o["extra"])
+    return o
+
+def apply_events(conn, evs):
+    # Fold events (in order) into the affected run/order rows. Each touched row is read
+    # and written once no matter how many of the events hit it. An entity that receives
+    # an event older than its newest one is re-folded from its events in (ts, id) order,
+    # as rebuild_snapshots() would. Returns the (kind, id) of those entities.
+    runs = {}
+    orders = {}
+    late = {}
+    for ev in evs:
+        payload = ev["payload"]
+        if isinstance(payload, str):
+            payload = json.loads(payload)
+        run_id = ev["run_id"]
+        order_id = ev["order_id"]
+
+        if run_id:
+            if run_id not in runs:
+                runs[run_id] = load_run(conn, run_id) or new_run(run_id)
+            if runs[run_id]["updated_at"] and ev["ts"] < runs[run_id]["updated_at"]:
+                late[("run", run_id)] = min(ev["ts"], late.get(("run", run_id), ev["ts"]))
+            merge_run(runs[run_id], ev["ts"], payload)
+
+        if order_id:
+            if order_id not in orders:
+                orders[order_id] = load_order(conn, order_id) or new_order(order_id, run_id, ev["ts"])
+            if orders[order_id]["updated_at"] and ev["ts"] < orders[order_id]["updated_at"]:
+                late[("order", order_id)] = min(ev["ts"], late.get(("order", order_id), ev["ts"]))
+            merge_order(orders[order_id], ev["ts"], payload)
+
+    high_water = max(ev["id"] for ev in evs) if late else None
+    for (kind, entity_id), ts in late.items():
+        drop_checkpoints(conn, kind, entity_id, ts)
+        row = replay_as_of(conn, kind, entity_id, high_water)[0]
+        (runs if kind == "run" else orders)[entity_id] = _load_state(kind, row)
+
+    for r in runs.values():
+        write_run(conn, r)
+    for o in orders.values():
+        write_order(conn, o)
+    return set(late)
+
+# Projection checkpoint: snapshots reflect every event with id <= last_event_id, built
+# with merge logic `version`. Bump PROJECTION_VERSION whenever merge_run/merge_order (or
+# the snapshot schema) change meaning; the next startup rebuilds in the background.
+PROJECTION_VERSION = 5  # 2: theater/updated_at snapshot columns, 3: metrics_rollups, 4: late events re-fold in (ts, id) order, 5: entity_theaters
+PROJECTION_CATCHUP_CHUNK = 5000
+
+_rebuild_locks = {}
+_rebuild_threads = {}
+
+def _rebuild_lock(key):
+    with _state_lock:
+        return _rebuild_locks.setdefault(key, threading.Lock())
+
+def get_projection_state(conn):
+    row = conn.execute("SELECT version, last_event_id FROM projection_state WHERE name = 'snapshots'").fetchone()
+    return (row["version"], row["last_event_id"]) if row else (None, None)
+
+# Highest event id in the ledger. archive.py deletes archived events from `events`, so
+# MAX(id) there can fall below (or to 0) ids already handed out; the segment catalog
+# remembers them.
+MAX_EVENT_ID_SQL = """
+SELECT MAX((SELECT COALESCE(MAX(id), 0) FROM events), (SELECT COALESCE(MAX(last_id), 0) FROM archive_segments))
+"""
+
+def max_event_id(conn) -> int:
+    return conn.execute(MAX_EVENT_ID_SQL).fetchone()[0]
+
+def set_projection_state(conn, version, last_event_id):
+    conn.execute("""
+    INSERT OR REPLACE INTO projection_state (name, version, last_event_id, updated_at)
+    VALUES ('snapshots', ?, ?, ?)
+    """, (version, last_event_id, datetime.now(timezone.utc).isoformat()))
+
+def project_pending(conn, limit=None):
+    # Incremental projection: apply every event after the checkpoint, in id order, and
+    # advance the checkpoint. On the write path that is just the freshly inserted events;
+    # must run inside the same transaction as the INSERTs so events, projection and
+    # checkpoint commit (or roll back) together. Snapshots match a replay in (ts, id)
+    # order even when producers emit out-of-order timestamps (see apply_events).
+    version, last_id = get_projection_state(conn)
+    if version is None:
+        return 0
+    query = "SELECT id, ts, run_id, order_id, event_type, payload FROM events WHERE id > ? ORDER BY id"
+    params = [last_id]
+    if limit:
+        query += " LIMIT ?"
+        params.append(limit)
+    rows = conn.execute(query, params).fetchall()
+    if rows:
+        late = apply_events(conn, rows)
+        apply_rollups(conn, rows)
+        search.index_events(conn, rows)
+        record_checkpoints(conn, rows, late)
+        set_projection_state(conn, version, rows[-1]["id"])
+    return len(rows)
+
+def recover_projection(background=True, path=None):
+    # Startup: replay only the events after the checkpoint (e.g. written by ingest_jsonl.py
+    # or lost to a crash between versions), then rebuild if the merge logic changed.
+    with write_db(path) as conn:
+        version, last_id = get_projection_state(conn)
+        if version is None:
+            max_id = max_event_id(conn)
+            # Fresh ledger, or one projected before checkpoints existed: the latter is
+            # assumed current and marked version 0 so it gets rebuilt below.
+            version = PROJECTION_VERSION if max_id == 0 else 0
+            set_projection_state(conn, version, max_id)
+        if version != PROJECTION_VERSION:
+            # Checkpoints hold state built by the old merge logic.
+            conn.execute("DELETE FROM snapshot_checkpoints")
+
+    replayed = 0
+    while True:
+        with write_db(path) as conn:
+            n = project_pending(conn, PROJECTION_CATCHUP_CHUNK)
+        if not n:
+            break
+        replayed += n
+    if replayed:
+        print(f"Projection caught up: replayed {replayed} events after checkpoint.")
+
+    if version != PROJECTION_VERSION:
+        print(f"Projection version {version} != {PROJECTION_VERSION}; rebuilding snapshots.")
+        if background:
+            start_background_rebuild(path)
+        else:
+            rebuild_snapshots(path=path)
+
+    if search.SEARCH_ENABLED:
+        if background:
+            search.start_backfill(path)
+        else:
+            search.backfill(path)
+
+def start_background_rebuild(path=None):
+    # Reads (and incremental writes) keep using the current tables until the swap.
+    key = _key(path)
+    thread = _rebuild_threads.get(key)
+    if thread is not None and thread.is_alive():
+        return
+    thread = _rebuild_threads[key] = threading.Thread(target=rebuild_snapshots, kwargs={"path": key},
+                                                      name="ledger-rebuild", daemon=True)
+    thread.start()
+
+def projection_status(path=None):
+    with read_db(path) as conn:
+        version, last_id = get_projection_state(conn)
+        max_id = max_event_id(conn)
+    return {
+        "version": version,
+        "target_version": PROJECTION_VERSION,
+        "last_event_id": last_id,
+        "max_event_id": max_id,
+        "rebuilding": _rebuild_lock(_key(path)).locked(),
+    }
+
+REBUILD_WORKERS = int(os.environ.get("LEDGER_REBUILD_WORKERS", 1))
+REBUILD_BATCH_ROWS = 2000
+
+def partition_of(key, partitions):
+    # Stable across processes (unlike hash()), so every worker agrees on ownership.
+    return zlib.crc32(key.encode()) % partitions
+
+def _stream_entities(reader, query, params, key, new, merge, to_row):
+    # Rows arrive grouped by key (then ts, id), so only one run/order is held in memory
+    # at a time; yields each finished row.
+    current = None
+    current_key = None
+    for row in reader.execute(query, params):
+        if row[key] != current_key:
+            if current is not None:
+                yield to_row(current)
+            current_key = row[key]
+            current = new(row)
+        merge(current, row)
+    if current is not None:
+        yield to_row(current)
+
+def replay_entities(reader, db_path, part, partitions, high_water):
+    # Full replay of every run and order owned by `part` (of `partitions`), events up to
+    # `high_water` in (ts, id) order per entity. Yields ("run", run_row) and
+    # ("order", order_row); shared by the rebuild and parity checks (digests.py).
+    params = [high_water]
+    # Runs/orders with archived events are replayed separately (_replay_archived).
+    run_filter = " AND run_id NOT IN (SELECT run_id FROM archived_runs)"
+    order_filter = " AND order_id NOT IN (SELECT order_id FROM archived_orders)"
+    if partitions > 1:
+        reader.create_function("ledger_part", 1, lambda k: partition_of(k, partitions), deterministic=True)
+        run_filter += " AND ledger_part(run_id) = ?"
+        order_filter += " AND ledger_part(order_id) = ?"
+        params.append(part)
+
+    def merge_run_row(r, row):
+        merge_run(r, row["ts"], json.loads(row["payload"]))
+
+    def merge_order_row(o, row):
+        merge_order(o, row["ts"], json.loads(row["payload"]))
+
+    for row in _stream_entities(reader,
+            f"SELECT run_id, ts, payload FROM events WHERE run_id IS NOT NULL AND run_id != '' AND id <= ?{run_filter} ORDER BY run_id, ts, id",
+            params, "run_id", lambda row: new_run(row["run_id"]), merge_run_row, run_row):
+        yield "run", row
+    for row in _stream_entities(reader,
+            f"SELECT order_id, run_id, ts, payload FROM events WHERE order_id IS NOT NULL AND order_id != '' AND id <= ?{order_filter} ORDER BY order_id, ts, id",
+            params, "order_id", lambda row: new_order(row["order_id"], row["run_id"], row["ts"]), merge_order_row, order_row):
+        yield "order", row
+    yield from _replay_archived(reader, db_path, part, partitions, high_water)
+
+def _replay_archived(reader, db_path, part, partitions, high_water):
+    # Entities with archived events: cold events (archive.py) and any later hot ones are
+    # merged in (ts, id) order, one run/order at a time.
+    from archive import cold_events
+
+    def replay(kind, column, table, new, merge, to_row):
+        keys = [row[0] for row in reader.execute(f"SELECT DISTINCT {column} FROM {table}")]
+        for key in keys:
+            if partitions > 1 and partition_of(key, partitions) != part:
+                continue
+            events = [e for e in cold_events(db_path, **{column: key}) if e["id"] <= high_water]
+            events += reader.execute(f"SELECT id, ts, run_id, payload FROM events WHERE {column} = ? AND id <= ?",
+                                     (key, high_water)).fetchall()
+            if not events:
+                continue
+            events.sort(key=lambda e: (e["ts"], e["id"]))
+            entity = new(key, events[0])
+            for e in events:
+                merge(entity, e["ts"], json.loads(e["payload"]))
+            yield kind, to_row(entity)
+
+    yield from replay("run", "run_id", "archived_runs", lambda key, e: new_run(key), merge_run, run_row)
+    yield from replay("order", "order_id", "archived_orders", lambda key, e: new_order(key, e["run_id"], e["ts"]),
+                      merge_order, order_row)
+
+# Point-in-time reads (GET /runs/{id}?as_of=, GET /orders/{id}?as_of=): what a rebuild
+# stopped at that point would produce, i.e. the entity's events up to an event id (or
+# stamped at or before a ts) replayed in (ts, id) order. So that long runs don't replay
+# their whole history, the projection stores the replayed state of an entity every
+# LEDGER_CHECKPOINT_EVENTS of its events in snapshot_checkpoints (migration 10); a read
+# starts from the newest usable checkpoint and replays only the events after it.
+# A checkpoint at event_id E with newest ts M stands for the entity's events with id <= E.
+# It stays usable while every later event of the entity sorts after them (ts >= M): an
+# event arriving with an older ts drops the checkpoints it would sort into.
+CHECKPOINT_EVENTS = int(os.environ.get("LEDGER_CHECKPOINT_EVENTS", 500))
+CHECKPOINT_TRACKED = 100000
+
+ENTITY_KINDS = {
+    "run": ("run_id", "archived_runs", RUN_COLUMNS, lambda key, e: new_run(key), merge_run, run_row),
+    "order": ("order_id", "archived_orders", ORDER_COLUMNS, lambda key, e: new_order(key, e["run_id"], e["ts"]),
+              merge_order, order_row),
+}
+
+# Events folded into each entity since its last checkpoint, by (ledger file, kind, id).
+# Only decides when to write the next checkpoint; a restart just starts counting again.
+_checkpoint_counts = OrderedDict()
+_checkpoint_lock = threading.Lock()
+
+def drop_checkpoints(conn, kind, entity_id, ts):
+    conn.execute("DELETE FROM snapshot_checkpoints WHERE kind = ? AND entity_id = ? AND ts > ?", (kind, entity_id, ts))
+
+def _load_state(kind, row):
+    columns = ENTITY_KINDS[kind][2]
+    x = dict(zip(columns, row))
+    if kind == "run":
+        x["order_ids"] = dict.fromkeys(json.loads(x["order_ids"]))
+    else:
+        x["extra"] = json.loads(x["extra"])
+    return x
+
+def _entity_events(conn, kind, entity_id, after_id, high_water, until_ts):
+    # The entity's events in (after_id, high_water] (stamped <= until_ts), hot and archived,
+    # in (ts, id) order.
+    column, archived = ENTITY_KINDS[kind][:2]
+    query = f"SELECT id, ts, run_id, payload FROM events WHERE {column} = ? AND id > ? AND id <= ?"
+    params = [entity_id, after_id, high_water]
+    if until_ts is not None:
+        query += " AND ts <= ?"
+        params.append(until_ts)
+    events = {e["id"]: e for e in conn.execute(query, params)}
+    cold = conn.execute(f"""
+    SELECT 1 FROM {archived} a JOIN archive_segments s ON s.segment = a.segment
+    WHERE a.{column} = ? AND s.last_id > ? LIMIT 1
+    """, (entity_id, after_id)).fetchone()
+    if cold:
+        from archive import cold_events
+        path = conn.execute("PRAGMA database_list").fetchone()["file"]
+        for e in cold_events(path, **{column: entity_id}):
+            if after_id < e["id"] <= high_water and (until_ts is None or e["ts"] <= until_ts):
+                events.setdefault(e["id"], e)
+    return sorted(events.values(), key=lambda e: (e["ts"], e["id"]))
+
+def replay_as_of(conn, kind, entity_id, high_water, until_ts=None):
+    # The entity replayed from its newest usable checkpoint: (row, newest ts, newest event
+    # id folded in), or None if it has no events in range.
+    query = "SELECT event_id, ts, state FROM snapshot_checkpoints WHERE kind = ? AND entity_id = ? AND event_id <= ?"
+    params = [kind, entity_id, high_water]
+    if until_ts is not None:
+        query += " AND ts <= ?"
+        params.append(until_ts)
+    checkpoint = conn.execute(query + " ORDER BY event_id DESC LIMIT 1", params).fetchone()
+    if checkpoint:
+        after_id, newest, row = checkpoint["event_id"], checkpoint["ts"], json.loads(checkpoint["state"])
+    else:
+        after_id, newest, row = 0, None, None
+    events = _entity_events(conn, kind, entity_id, after_id, high_water, until_ts)
+    if not events:
+        return (row, newest, after_id) if row else None
+    _, _, _, new, merge, to_row = ENTITY_KINDS[kind]
+    x = _load_state(kind, row) if row else new(entity_id, events[0])
+    for e in events:
+        merge(x, e["ts"], json.loads(e["payload"]))
+    newest = max([e["ts"] for e in events] + ([newest] if newest else []))
+    return to_row(x), newest, max(after_id, max(e["id"] for e in events))
+
+def entity_as_of(conn, kind, entity_id, until_id=None, until_ts=None):
+    # Snapshot row (as a dict) of a run/order as of event until_id or time until_ts, within
+    # what the projection has applied; None if it had no events by then.
+    _, last_id = get_projection_state(conn)
+    high_water = min(last_id or 0, until_id) if until_id is not None else (last_id or 0)
+    replayed = replay_as_of(conn, kind, entity_id, high_water, until_ts)
+    return dict(zip(ENTITY_KINDS[kind][2], replayed[0])) if replayed else None
+
+def record_checkpoints(conn, evs, late=()):
+    # Write path: evs were just projected. Entities that reached CHECKPOINT_EVENTS events
+    # since their last checkpoint get a new one at their newest event. Not those with late
+    # events in this batch: a producer whose timestamps lag would drop each new checkpoint
+    # again, and every one would replay the entity's whole history.
+    if CHECKPOINT_EVENTS <= 0 or not evs:
+        return
+    db = conn.execute("PRAGMA database_list").fetchone()["file"]
+    newest = {}
+    due = set()
+    with _checkpoint_lock:
+        for ev in evs:
+            for kind in ENTITY_KINDS:
+                entity_id = ev[ENTITY_KINDS[kind][0]]
+                if not entity_id:
+                    continue
+                key = (db, kind, entity_id)
+                newest[key] = ev["id"]
+                count = _checkpoint_counts.pop(key, 0) + 1
+                if count >= CHECKPOINT_EVENTS:
+                    due.add(key)
+                    count = 0
+                _checkpoint_counts[key] = count
+        while len(_checkpoint_counts) > CHECKPOINT_TRACKED:
+            _checkpoint_counts.popitem(last=False)
+    for key in due:
+        _, kind, entity_id = key
+        if (kind, entity_id) in late:
+            continue
+        row, ts, event_id = replay_as_of(conn, kind, entity_id, newest[key])
+        conn.execute("INSERT OR REPLACE INTO snapshot_checkpoints (kind, entity_id, event_id, ts, state) VALUES (?, ?, ?, ?, ?)",
+                     (kind, entity_id, event_id, ts, json.dumps(row)))
+
+def _rebuild_partition(args):
+    # Worker: project every run and order owned by `part` (of `partitions`) into the
+    # shadow tables, flushing finished rows with executemany in batches.
+    db_path, part, partitions, high_water = args
+    reader = _connect(readonly=True, path=db_path)
+    conn = _connect(path=db_path)
+    # Workers take turns on the write lock; give them room to wait for each other.
+    conn.execute("PRAGMA busy_timeout=60000")
+    inserts = {"run": RUN_INSERT.format(table="runs_snapshot_new"), "order": ORDER_INSERT.format(table="orders_snapshot_new")}
+    batches = {"run": [], "order": []}
+    try:
+        for kind, row in replay_entities(reader, db_path, part, partitions, high_water):
+            batch = batches[kind]
+            batch.append(row)
+            if len(batch) >= REBUILD_BATCH_ROWS:
+                with conn:
+                    conn.executemany(inserts[kind], batch)
+                batch.clear()
+        for kind, batch in batches.items():
+            if batch:
+                with conn:
+                    conn.executemany(inserts[kind], batch)
+    finally:
+        reader.close()
+        conn.close()
+
+def _rebuild_rollups(path, high_water):
+    # Metrics rollups (rollups.py) over every model-call event up to high_water, in one
+    # streaming pass: archived events segment by segment, then hot ones by id. A run is
+    # archived up to some event and later ones stay hot, so every run and order is seen in
+    # id order, and fold_events() resolves theaters exactly as the write path does, from
+    # the entity_theaters_new shadow table it fills on the way.
+    from archive import iter_cold_events, to_event_row
+    acc = {}
+    reader = _connect(readonly=True, path=path)
+    conn = _connect(path=path)
+    conn.execute("PRAGMA busy_timeout=60000")
+    try:
+        with conn:
+            conn.execute("DROP TABLE IF EXISTS entity_theaters_new")
+            conn.execute(ENTITY_THEATERS_TABLE.format(suffix="_new"))
+        def events():
+            for values in iter_cold_events(path):
+                if values[0] <= high_water:
+                    yield to_event_row(values)
+            yield from reader.execute("""
+            SELECT id, event_type, ts, run_id, order_id, payload FROM events WHERE id <= ? ORDER BY id
+            """, (high_water,))
+        batch = []
+        for ev in events():
+            if ev["event_type"] in ROLLUP_EVENTS or '"theater"' in ev["payload"]:
+                batch.append(ev)
+            if len(batch) >= REBUILD_BATCH_ROWS:
+                with conn:
+                    fold_events(conn, acc, batch, "entity_theaters_new")
+                batch.clear()
+        with conn:
+            fold_events(conn, acc, batch, "entity_theaters_new")
+    finally:
+        reader.close()
+        conn.close()
+    return acc
+
+def rebuild_snapshots(workers=None, path=None):
+    with _rebuild_lock(_key(path)):
+        _rebuild_snapshots(workers, _key(path))
+
+def _rebuild_snapshots(workers, path):
+    # Full replay of the event log. No longer on the write path (see project_pending);
+    # kept as the offline repair path behind POST /rebuild and ingest_jsonl.py.
+    # Builds into shadow tables (optionally partitioned by run_id/order_id across a
+    # process pool), then swaps them in atomically. Memory stays flat: rows are streamed
+    # per entity instead of loading the event table.
+    workers = max(1, workers or REBUILD_WORKERS)
+    with write_db(path) as conn:
+        # Never below the checkpoint: archived events are gone from `events` but not from
+        # the snapshots (their ids come from the segment catalog).
+        high_water = max(max_event_id(conn), get_projection_state(conn)[1] or 0)
+        conn.execute("DROP TABLE IF EXISTS runs_snapshot_new")
+        conn.execute("DROP TABLE IF EXISTS orders_snapshot_new")
+        create_snapshot_tables(conn, "_new")
+
+    jobs = [(path, part, workers, high_water) for part in range(workers)]
+    if workers > 1:
+        with get_context("spawn").Pool(workers) as pool:
+            pool.map(_rebuild_partition, jobs)
+    else:
+        _rebuild_partition(jobs[0])
+
+    rollups = _rebuild_rollups(path, high_water)
+
+    with write_db(path) as conn:
+        # DDL doesn't open a transaction implicitly; make the swap atomic explicitly.
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute("DROP TABLE runs_snapshot")
+        conn.execute("DROP TABLE orders_snapshot")
+        conn.execute("ALTER TABLE runs_snapshot_new RENAME TO runs_snapshot")
+        conn.execute("ALTER TABLE orders_snapshot_new RENAME TO orders_snapshot")
+        for stmt in SNAPSHOT_INDEXES:
+            conn.execute(stmt)
+        conn.execute("DELETE FROM metrics_rollups")
+        write_rollups(conn, rollups)
+        conn.execute("DROP TABLE entity_theaters")
+        conn.execute("ALTER TABLE entity_theaters_new RENAME TO entity_theaters")
+        # Cut over to the current merge logic, then catch up with events committed while
+        # the shadow tables were being built.
+        set_projection_state(conn, PROJECTION_VERSION, high_water)
+        project_pending(conn)
 
 if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Initialise or repair the ledger database")
+    parser.add_argument("command", nargs="?", choices=["init", "rebuild"], default="init")
+    parser.add_argument("--workers", type=int, default=REBUILD_WORKERS, help="Rebuild partitions/processes")
+    args = parser.parse_args()
     init_db()
+    if args.command == "rebuild":
+        rebuild_snapshots(args.workers)
+        print("Snapshots rebuilt.")
+    else:
+        recover_projection(background=False)
@@ -0,0 +1,51 @@
+import os
+import threading
+from collections import OrderedDict
+from typing import Iterable
+
+# Recently seen event_ids, so retried POSTs (CO, workers, observer) are answered "exists"
+# without queueing for the writer. Only ids known to be in the ledger are added, so a
+# hit is always a true duplicate; a miss still goes through the UNIQUE(event_id) check
+# in writer.commit_events().
+DEDUP_ENTRIES = int(os.environ.get("LEDGER_DEDUP_ENTRIES", 100000))
+
+class RecentIds:
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self.events = 0
+        self.filter_hits = 0
+        self.ledger_hits = 0
+        self._ids = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, event_id: str) -> bool:
+        with self._lock:
+            if event_id in self._ids:
+                self._ids.move_to_end(event_id)
+                return True
+            return False
+
+    def add(self, event_ids: Iterable[str]):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            for event_id in event_ids:
+                self._ids[event_id] = None
+                self._ids.move_to_end(event_id)
+            while len(self._ids) > self.max_entries:
+                self._ids.popitem(last=False)
+
+    def record(self, events: int, filter_hits: int, ledger_hits: int):
+        with self._lock:
+            self.events += events
+            self.filter_hits += filter_hits
+            self.ledger_hits += ledger_hits
+
+    def stats(self) -> dict:
+        with self._lock:
+            duplicates = self.filter_hits + self.ledger_hits
+            return {"entries": len(self._ids), "events": self.events, "duplicates": duplicates,
+                    "filter_hits": self.filter_hits, "ledger_hits": self.ledger_hits,
+                    "duplicate_rate": duplicates / self.events if self.events else 0.0}
+
+recent_ids = RecentIds(DEDUP_ENTRIES)
@@ -0,0 +1,207 @@
+import hashlib
+import json
+import os
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import database
+from database import ORDER_COLUMNS, RUN_COLUMNS, get_projection_state, read_db, replay_entities
+
+# Content digests of the snapshots, rolled up into a Merkle tree, so two ledgers (primary and
+# follower, a restored copy) or a projection and a full replay of its events can be compared
+# by exchanging digests and descending only into the subtrees that differ.
+# - entity digest: SHA-256 of a run_row() / order_row() tuple (database.py)
+# - leaf, one per run: the run's digest and the (order_id, digest) of its orders; orders
+#   belong to the run named by their snapshot (orders without one share the leaf "-")
+# - tree: leaves are bucketed by the first LEDGER_DIGEST_DEPTH hex digits of SHA-256(run_id),
+#   so buckets stay even however run ids are named; a node's digest covers its (up to 16)
+#   non-empty children, the root's ("") the whole ledger.
+# The service keeps the tree of its snapshots per ledger file and refreshes it from the
+# projection checkpoint: only runs and orders touched by events since the last refresh are
+# re-read, so repeated checks against a live ledger cost little (GET /digests).
+DIGEST_DEPTH = int(os.environ.get("LEDGER_DIGEST_DEPTH", 3))
+HEX = "0123456789abcdef"
+NO_RUN = "-"
+
+def entity_digest(row) -> str:
+    return hashlib.sha256(json.dumps(list(row), separators=(",", ":")).encode()).hexdigest()
+
+def bucket_of(run_id: str) -> str:
+    return hashlib.sha256(run_id.encode()).hexdigest()[:DIGEST_DEPTH]
+
+def _combine(parts: Iterable[str]) -> str:
+    h = hashlib.sha256()
+    for part in parts:
+        h.update(part.encode())
+        h.update(b"\n")
+    return h.hexdigest()
+
+class DigestTree:
+    def __init__(self):
+        self.runs: Dict[str, Optional[str]] = {}  # run_id -> run digest (None: only orders)
+        self.orders: Dict[str, Dict[str, str]] = {}  # run_id -> order_id -> digest
+        self.order_runs: Dict[str, str] = {}  # order_id -> run_id
+        self._nodes: Dict[str, Optional[str]] = {}
+        self._buckets: Dict[str, set] = {}
+
+    def _touch(self, run_id: str):
+        bucket = bucket_of(run_id)
+        self._buckets.setdefault(bucket, set()).add(run_id)
+        for i in range(len(bucket) + 1):
+            self._nodes.pop(bucket[:i], None)
+
+    def set_run(self, row):
+        self.runs[row[0]] = entity_digest(row)
+        self._touch(row[0])
+
+    def set_order(self, row):
+        order_id, run_id = row[0], row[1] or NO_RUN
+        previous = self.order_runs.get(order_id)
+        if previous is not None and previous != run_id:
+            self.orders[previous].pop(order_id, None)
+            self._touch(previous)
+        self.order_runs[order_id] = run_id
+        self.runs.setdefault(run_id, None)
+        self.orders.setdefault(run_id, {})[order_id] = entity_digest(row)
+        self._touch(run_id)
+
+    def entry(self, run_id: str) -> dict:
+        return {"run": self.runs.get(run_id), "orders": dict(sorted(self.orders.get(run_id, {}).items()))}
+
+    def leaf(self, run_id: str) -> Optional[str]:
+        orders = self.orders.get(run_id) or {}
+        if self.runs.get(run_id) is None and not orders:
+            return None
+        return _combine([run_id, self.runs.get(run_id) or ""] + [f"{k} {v}" for k, v in sorted(orders.items())])
+
+    def digest(self, prefix: str = "") -> Optional[str]:
+        if prefix not in self._nodes:
+            if len(prefix) == DIGEST_DEPTH:
+                leaves = sorted((run_id, self.leaf(run_id)) for run_id in self._buckets.get(prefix, ()))
+                parts = [f"{run_id} {leaf}" for run_id, leaf in leaves if leaf]
+            else:
+                parts = [f"{child} {d}" for child in (prefix + c for c in HEX) if (d := self.digest(child))]
+            self._nodes[prefix] = _combine(parts) if parts else None
+        return self._nodes[prefix]
+
+    def node(self, prefix: str = "") -> dict:
+        # One level of the tree: children digests, or the run leaves of a bucket.
+        if len(prefix) >= DIGEST_DEPTH:
+            bucket = prefix[:DIGEST_DEPTH]
+            runs = {run_id: leaf for run_id in sorted(self._buckets.get(bucket, ())) if (leaf := self.leaf(run_id))}
+            return {"prefix": bucket, "digest": self.digest(bucket), "runs": runs}
+        children = {child: d for child in (prefix + c for c in HEX) if (d := self.digest(child))}
+        return {"prefix": prefix, "digest": self.digest(prefix), "children": children}
+
+def merge_trees(trees: List[DigestTree]) -> DigestTree:
+    # Shards hold disjoint runs and orders: one tree over all of them.
+    if len(trees) == 1:
+        return trees[0]
+    out = DigestTree()
+    for tree in trees:
+        for run_id, digest in tree.runs.items():
+            if digest is not None:
+                out.runs[run_id] = digest
+            out._touch(run_id)
+        for run_id, orders in tree.orders.items():
+            out.runs.setdefault(run_id, None)
+            out.orders.setdefault(run_id, {}).update(orders)
+            out.order_runs.update(dict.fromkeys(orders, run_id))
+            out._touch(run_id)
+    return out
+
+def _generation(conn) -> tuple:
+    # A rebuild swaps in new snapshot tables (new root pages): everything may have changed.
+    pages = conn.execute("""
+    SELECT name, rootpage FROM sqlite_master WHERE type = 'table' AND name IN ('runs_snapshot', 'orders_snapshot')
+    """).fetchall()
+    return get_projection_state(conn)[0], tuple(sorted(tuple(row) for row in pages))
+
+class SnapshotDigests:
+    # Tree of one ledger file's snapshots, kept current from the projection checkpoint.
+    def __init__(self):
+        self.tree = None
+        self.last_event_id = None
+        self.generation = None
+
+    def refresh(self, conn) -> DigestTree:
+        # conn: a read connection; one read transaction so rows match the checkpoint.
+        conn.execute("BEGIN")
+        try:
+            generation = _generation(conn)
+            _, last_id = get_projection_state(conn)
+            if self.tree is None or generation != self.generation:
+                self.tree = snapshot_tree(conn)
+            elif last_id != self.last_event_id:
+                self._apply(conn, self.last_event_id, last_id)
+            self.generation, self.last_event_id = generation, last_id
+        finally:
+            conn.execute("COMMIT")
+        return self.tree
+
+    def _apply(self, conn, after_id: int, last_id: int):
+        touched = conn.execute("SELECT run_id, order_id FROM events WHERE id > ? AND id <= ?", (after_id, last_id)).fetchall()
+        for run_id in {row[0] for row in touched if row[0]}:
+            row = conn.execute(f"SELECT {', '.join(RUN_COLUMNS)} FROM runs_snapshot WHERE run_id = ?", (run_id,)).fetchone()
+            if row:
+                self.tree.set_run(tuple(row))
+        for order_id in {row[1] for row in touched if row[1]}:
+            row = conn.execute(f"SELECT {', '.join(ORDER_COLUMNS)} FROM orders_snapshot WHERE order_id = ?", (order_id,)).fetchone()
+            if row:
+                self.tree.set_order(tuple(row))
+
+def snapshot_tree(conn) -> DigestTree:
+    tree = DigestTree()
+    for row in conn.execute(f"SELECT {', '.join(RUN_COLUMNS)} FROM runs_snapshot"):
+        tree.set_run(tuple(row))
+    for row in conn.execute(f"SELECT {', '.join(ORDER_COLUMNS)} FROM orders_snapshot"):
+        tree.set_order(tuple(row))
+    return tree
+
+def replay_tree(path=None) -> Tuple[DigestTree, DigestTree, int]:
+    # The snapshots and a full replay of the events they were projected from (the rebuild's
+    # own replay, nothing written), both as of the same checkpoint.
+    key = database._key(path)
+    reader = database._connect(readonly=True, path=key)
+    try:
+        reader.execute("BEGIN")
+        _, last_id = get_projection_state(reader)
+        snapshots = snapshot_tree(reader)
+        replayed = DigestTree()
+        for kind, row in replay_entities(reader, key, 0, 1, last_id or 0):
+            (replayed.set_run if kind == "run" else replayed.set_order)(row)
+        reader.execute("COMMIT")
+    finally:
+        reader.close()
+    return snapshots, replayed, last_id
+
+def diff_runs(a, b, prefix: str = "") -> List[str]:
+    # a, b: anything with node(prefix) (a DigestTree, or a remote ledger's GET /digests).
+    # Descends only where the digests differ; returns the run ids whose leaves differ.
+    na, nb = a.node(prefix), b.node(prefix)
+    if na["digest"] == nb["digest"]:
+        return []
+    if "runs" in na:
+        return sorted(r for r in set(na["runs"]) | set(nb["runs"]) if na["runs"].get(r) != nb["runs"].get(r))
+    out = []
+    for child in sorted(set(na["children"]) | set(nb["children"])):
+        if na["children"].get(child) != nb["children"].get(child):
+            out += diff_runs(a, b, child)
+    return out
+
+_snapshot_digests: Dict[str, SnapshotDigests] = {}
+_digests_lock = threading.Lock()
+
+def ledger_digests(paths: List[str], run_id: Optional[str] = None, prefix: str = "") -> dict:
+    # GET /digests (one level of the tree) and /digests/runs/{id} (a leaf's entities), over
+    # every shard, as of each shard's projection checkpoint.
+    with _digests_lock:
+        trees = []
+        for path in paths:
+            digests = _snapshot_digests.setdefault(database._key(path), SnapshotDigests())
+            with read_db(path) as conn:
+                trees.append(digests.refresh(conn))
+        tree = merge_trees(trees)
+        last_id = max(_snapshot_digests[database._key(path)].last_event_id or 0 for path in paths)
+        body = tree.entry(run_id) if run_id is not None else tree.node(prefix)
+        return {**body, "last_event_id": last_id}
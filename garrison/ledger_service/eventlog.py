@@ -0,0 +1,130 @@
+import fcntl
+import json
+import os
+import struct
+import zlib
+from pathlib import Path
+from typing import Iterator, List, Tuple
+
+import database
+from archive import _fsync_dir
+
+# Append-only event log for LEDGER_STORAGE=log (storage.py): the durable copy of every event,
+# in id order, as segment files in <db name>.log/ next to the ledger file. A segment is named
+# after its first event id (zero-padded, so names sort in id order) and is a sequence of
+# frames:
+#   <u32 body length><u32 crc32 of body><body>
+# where body is the JSON list [id, event_id, ts, run_id, order_id, event_type, payload].
+# Appends go to the last segment; a new one starts once it reaches LEDGER_LOG_SEGMENT_BYTES.
+# On open, a torn or corrupt tail of the last segment (a crash mid-append) is cut off; a bad
+# frame in any earlier segment is corruption and raises. One process appends at a time
+# (flock on <db name>.log/LOCK).
+LOG_SEGMENT_BYTES = int(os.environ.get("LEDGER_LOG_SEGMENT_BYTES", 64 * 1024 * 1024))
+FRAME = struct.Struct("<II")
+
+def log_dir(path=None) -> Path:
+    db = Path(path or database.DB_PATH)
+    return db.with_name(db.stem + ".log")
+
+def encode_frame(row) -> bytes:
+    body = json.dumps(list(row), separators=(",", ":")).encode()
+    return FRAME.pack(len(body), zlib.crc32(body)) + body
+
+def read_frames(data: bytes) -> Iterator[Tuple[int, list]]:
+    # (end offset, row) for each intact frame; stops at the first torn or corrupt one.
+    pos = 0
+    while pos + FRAME.size <= len(data):
+        length, crc = FRAME.unpack_from(data, pos)
+        end = pos + FRAME.size + length
+        body = data[pos + FRAME.size:end]
+        if end > len(data) or zlib.crc32(body) != crc:
+            return
+        yield end, json.loads(body)
+        pos = end
+
+class SegmentLog:
+    def __init__(self, directory: Path):
+        self.directory = Path(directory)
+        self.last_id = 0
+        self._lock_file = None
+        self._file = None
+        self._size = 0
+
+    def segments(self) -> List[Path]:
+        return sorted(self.directory.glob("*.log"))
+
+    def open(self):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._lock_file = (self.directory / "LOCK").open("a")
+        try:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            self._lock_file.close()
+            raise RuntimeError(f"{self.directory} is in use by another ledger process")
+        segments = self.segments()
+        if not segments:
+            return
+        last = segments[-1]
+        data = last.read_bytes()
+        self.last_id = int(last.stem) - 1
+        end = 0
+        for end, row in read_frames(data):
+            self.last_id = row[0]
+        if end < len(data):
+            print(f"Event log: dropping {len(data) - end} bytes of torn tail in {last.name}.")
+            with last.open("r+b") as f:
+                f.truncate(end)
+                os.fsync(f.fileno())
+        self._file = last.open("ab")
+        self._size = end
+
+    def close(self):
+        if self._file:
+            self.sync()
+            self._file.close()
+            self._file = None
+        if self._lock_file:
+            self._lock_file.close()
+            self._lock_file = None
+
+    def append(self, rows: list):
+        # rows: event tuples in id order, ids above last_id. Written, not yet fsynced.
+        if self._file is None or self._size >= LOG_SEGMENT_BYTES:
+            self._roll(rows[0][0])
+        data = b"".join(encode_frame(row) for row in rows)
+        self._file.write(data)
+        self._file.flush()
+        self._size += len(data)
+        self.last_id = rows[-1][0]
+
+    def _roll(self, first_id: int):
+        if self._file:
+            self.sync()
+            self._file.close()
+        self._file = (self.directory / f"{first_id:020d}.log").open("ab")
+        self._size = 0
+        _fsync_dir(self.directory)
+
+    def sync(self):
+        if self._file:
+            os.fsync(self._file.fileno())
+
+    def iter_from(self, after_id: int) -> Iterator[list]:
+        # Rows with id > after_id, in id order. Only reads complete, flushed frames.
+        segments = self.segments()
+        start = 0
+        for i, segment in enumerate(segments):
+            if int(segment.stem) <= after_id + 1:
+                start = i
+        for i, segment in enumerate(segments[start:], start=start):
+            data = segment.read_bytes()
+            end = 0
+            for end, row in read_frames(data):
+                if row[0] > after_id:
+                    yield row
+            if end < len(data) and i < len(segments) - 1:
+                raise RuntimeError(f"Event log segment {segment} is corrupt at byte {end}")
+
+    def stats(self) -> dict:
+        segments = self.segments()
+        return {"segments": len(segments), "bytes": sum(s.stat().st_size for s in segments), "last_id": self.last_id}
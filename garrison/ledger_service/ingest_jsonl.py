@@ -1,66 +1,180 @@
+import argparse
+import hashlib
+import itertools
 import json
-import sqlite3
 from pathlib import Path
 from datetime import datetime, timezone
-import uuid
+from multiprocessing import Pool
 
 import os
 
+from database import write_db, read_db, init_db
+from blobs import externalize
+from archive import archived_ids
+from shards import router
+
 # Configuration
 THEATER_ROOT = Path(os.environ.get("IRONCLAW_THEATER_ROOT", "/home/tyler/dev/ironclaw/theaters/demo"))
 RUNS_JSONL = THEATER_ROOT / "runs.jsonl"
 ORDERS_JSONL = THEATER_ROOT / "orders.jsonl"
-DB_PATH = Path(__file__).parent / "ledger.db"
+CHUNK_LINES = 5000
+
+# Streaming, resumable import of MVP .jsonl files:
+# - event ids are derived from a hash of the record, so re-running never duplicates events
+# - lines are inserted with executemany, one transaction per chunk
+# - each chunk commits together with a byte-offset checkpoint (ingest_checkpoints), so an
+#   interrupted import resumes after the last committed line
+# - the projection is rebuilt once at the end (see __main__)
+
+def content_event_id(kind: str, data: dict) -> str:
+    canonical = json.dumps(data, sort_keys=True, separators=(",", ":"))
+    return f"ingest-{kind}-" + hashlib.sha256(f"{kind}:{canonical}".encode()).hexdigest()[:32]
+
+def parse_run(data: dict) -> tuple:
+    ts = data.get("started_at") or data.get("ended_at") or data.get("ts") or datetime.now(timezone.utc).isoformat()
+    return (content_event_id("run", data), ts, data.get("run_id"), None, "RUN_EVENT", json.dumps(data))
+
+def parse_order(data: dict) -> tuple:
+    ts = data.get("ts") or datetime.now(timezone.utc).isoformat()
+    return (content_event_id("order", data), ts, data.get("run_id"), data.get("order_id"), "ORDER_EVENT", json.dumps(data))
+
+PARSERS = {"run": parse_run, "order": parse_order}
+
+def parse_chunk(job: tuple) -> tuple:
+    # Top-level so it can run in a worker process. Returns (rows, malformed line count).
+    kind, lines = job
+    parse = PARSERS[kind]
+    rows = []
+    bad = 0
+    for raw in lines:
+        line = raw.strip()
+        if not line: continue
+        try:
+            data = json.loads(line)
+        except ValueError:
+            bad += 1
+            continue
+        if not isinstance(data, dict):
+            bad += 1
+            continue
+        rows.append(parse(data))
+    return rows, bad
 
-def get_db():
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    return conn
+def read_chunks(path: Path, offset: int, chunk_lines: int, follow: bool = False):
+    # Yields chunks of raw lines with the byte offset just past their last line.
+    # A last line without a newline is imported, unless follow is set: the file is still
+    # being written, and the line is left for the next run.
+    with path.open("rb") as f:
+        f.seek(offset)
+        chunk = []
+        for raw in f:
+            if follow and not raw.endswith(b"\n"):
+                print(f"  {path.name}: leaving the unterminated line at byte {offset} for the next run")
+                break
+            offset += len(raw)
+            chunk.append(raw)
+            if len(chunk) >= chunk_lines:
+                yield chunk, offset
+                chunk = []
+        if chunk:
+            yield chunk, offset
 
-def ingest():
-    with get_db() as conn:
+def load_checkpoint(source: str):
+    with read_db() as conn:
+        row = conn.execute("SELECT byte_offset, lines FROM ingest_checkpoints WHERE source = ?", (source,)).fetchone()
+    return (row["byte_offset"], row["lines"]) if row else (0, 0)
+
+def ingest_file(path: Path, kind: str, chunk_lines: int = CHUNK_LINES, pool=None, restart: bool = False,
+                ids=None, follow: bool = False) -> int:
+    source = str(path.resolve())
+    offset, done = (0, 0) if restart else load_checkpoint(source)
+    size = path.stat().st_size
+    if offset > size:
+        # File was truncated or replaced; deterministic ids make a full re-read safe.
+        print(f"{path} is smaller than its checkpoint ({size} < {offset}); starting over.")
+        offset, done = 0, 0
+    if offset:
+        print(f"Resuming {path} at byte {offset} ({done} lines already ingested)...")
+    else:
+        print(f"Ingesting {path}...")
+
+    # Parsing (json.loads + hashing) is the CPU-heavy part; with a pool it runs ahead of
+    # the single writer while chunk order (and therefore checkpoint order) is preserved.
+    chunks = read_chunks(path, offset, chunk_lines, follow)
+    offsets = []
+    def jobs():
+        for lines, end in chunks:
+            offsets.append((end, len(lines)))
+            yield (kind, lines)
+    parsed = pool.imap(parse_chunk, jobs()) if pool else map(parse_chunk, jobs())
+
+    inserted = 0
+    malformed = 0
+    for i, (rows, bad) in enumerate(parsed):
+        end, n = offsets[i]
+        done += n
+        malformed += bad
+        # Shares ledger.db with the running service; WAL + busy timeout (see database.py)
+        # keep the API responsive between chunks.
+        with write_db() as conn:
+            before = conn.total_changes
+            # Archived events left `events`; ON CONFLICT alone would re-insert them.
+            archived = archived_ids(conn, [row[0] for row in rows])
+            rows = [row for row in rows if row[0] not in archived]
+            conn.executemany("""
+            INSERT INTO events (id, event_id, ts, run_id, order_id, event_type, payload)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (event_id) DO NOTHING
+            """, [(next(ids) if ids else None,) + row[:5] + (externalize(conn, row[5]),) for row in rows])
+            inserted += conn.total_changes - before
+            conn.execute("""
+            INSERT OR REPLACE INTO ingest_checkpoints (source, byte_offset, lines, updated_at)
+            VALUES (?, ?, ?, ?)
+            """, (source, end, done, datetime.now(timezone.utc).isoformat()))
+        print(f"  {path.name}: {done} lines, {end}/{size} bytes ({100 * end // max(size, 1)}%)")
+
+    if malformed:
+        print(f"  {path.name}: skipped {malformed} malformed lines")
+    return inserted
+
+def ingest(chunk_lines: int = CHUNK_LINES, workers: int = 0, restart: bool = False,
+           runs_path: Path = RUNS_JSONL, orders_path: Path = ORDERS_JSONL, follow: bool = False) -> int:
+    inserted = 0
+    # Sharded ledger (shards.py): imports land in the default shard (ledger.db) but take
+    # ledger-wide ids after every shard's highest id. Run with the service stopped.
+    ids = None
+    if router.sharded:
+        router.open(background=False)
+        ids = itertools.count(router.max_event_id() + 1)
+    pool = Pool(workers) if workers > 1 else None
+    try:
         # Ingest runs.jsonl
-        if RUNS_JSONL.exists():
-            print(f"Ingesting {RUNS_JSONL}...")
-            with RUNS_JSONL.open("r", encoding="utf-8") as f:
-                for line in f:
-                    line = line.strip()
-                    if not line: continue
-                    data = json.loads(line)
-                    
-                    run_id = data.get("run_id")
-                    ts = data.get("started_at") or data.get("ended_at") or data.get("ts") or datetime.now(timezone.utc).isoformat()
-                    event_id = str(uuid.uuid4()) # We don't have event IDs in JSONL, so we generate them.
-                    
-                    conn.execute("""
-                    INSERT OR IGNORE INTO events (event_id, ts, run_id, event_type, payload)
-                    VALUES (?, ?, ?, ?, ?)
-                    """, (event_id, ts, run_id, "RUN_EVENT", json.dumps(data)))
-        
+        if runs_path.exists():
+            inserted += ingest_file(runs_path, "run", chunk_lines, pool, restart, ids, follow)
         # Ingest orders.jsonl
-        if ORDERS_JSONL.exists():
-            print(f"Ingesting {ORDERS_JSONL}...")
-            with ORDERS_JSONL.open("r", encoding="utf-8") as f:
-                for line in f:
-                    line = line.strip()
-                    if not line: continue
-                    data = json.loads(line)
-                    
-                    run_id = data.get("run_id")
-                    order_id = data.get("order_id")
-                    ts = data.get("ts") or datetime.now(timezone.utc).isoformat()
-                    event_id = str(uuid.uuid4())
-                    
-                    conn.execute("""
-                    INSERT OR IGNORE INTO events (event_id, ts, run_id, order_id, event_type, payload)
-                    VALUES (?, ?, ?, ?, ?, ?)
-                    """, (event_id, ts, run_id, order_id, "ORDER_EVENT", json.dumps(data)))
-        
-        conn.commit()
-    print("Ingestion complete.")
+        if orders_path.exists():
+            inserted += ingest_file(orders_path, "order", chunk_lines, pool, restart, ids, follow)
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+    print(f"Ingestion complete ({inserted} new events).")
+    return inserted
 
 if __name__ == "__main__":
     from database import rebuild_snapshots
-    ingest()
+    parser = argparse.ArgumentParser(description="Import MVP runs.jsonl/orders.jsonl into the ledger")
+    parser.add_argument("--runs", type=Path, default=RUNS_JSONL)
+    parser.add_argument("--orders", type=Path, default=ORDERS_JSONL)
+    parser.add_argument("--chunk-lines", type=int, default=CHUNK_LINES, help="Lines per transaction/checkpoint")
+    parser.add_argument("--workers", type=int, default=0, help="Parse in N worker processes")
+    parser.add_argument("--restart", action="store_true", help="Ignore checkpoints and re-read from the start")
+    parser.add_argument("--follow", action="store_true",
+                        help="Files are still being written: leave an unterminated last line for the next run")
+    args = parser.parse_args()
+
+    init_db()
+    ingest(args.chunk_lines, args.workers, args.restart, args.runs, args.orders, args.follow)
+    # Always rebuild: a previous, interrupted run may have committed chunks without it.
     rebuild_snapshots()
     print("Snapshots rebuilt.")
@@ -1,53 +1,167 @@
-from fastapi import FastAPI, HTTPException, Query
-from typing import List, Optional
+from fastapi import FastAPI, HTTPException, Query, Response, Request, Header
+from fastapi.responses import StreamingResponse, JSONResponse
+from typing import Callable, List, Optional, Tuple
+import asyncio
+import base64
 import json
+import re
 import sqlite3
 from datetime import datetime, timezone
 import uuid
 
-from database import get_db, init_db, rebuild_snapshots
-from models import EventCreate, RunSnapshotModel, OrderSnapshotModel
+from database import close_db, entity_as_of
+from models import EventCreate, EventBatchCreate, RunSnapshotModel, OrderSnapshotModel
+from responses import FastJSONResponse, RawJSONResponse, dumps, encode_rows, encode_row
+from cache import snapshot_cache, snapshot_etag, combine_etags, etag_matches
+from writer import EventRow
+from dedup import recent_ids, DEDUP_ENTRIES
+from blobs import parse_expand, expand_rows, load_blob
+from archive import cold_events, archive_runs, archive_status, ARCHIVE_AGE_DAYS, ARCHIVE_INTERVAL_SECONDS
+from shards import router, sort_rows
+from replica import follower
+import storage
+from backup import backup_all
+from search import SEARCH_ENABLED, search_status
+from digests import ledger_digests
+from rollups import COUNTERS, GRANULARITIES, KEY_COLUMNS, LATENCY_BUCKETS_MS, merge as merge_rollup, percentile
+from stream import notifier, build_event_filters, format_sse, HEARTBEAT_SECONDS, MAX_LONGPOLL_SECONDS
 
-app = FastAPI(title="IronClaw Ledger Service")
+app = FastAPI(title="IronClaw Ledger Service", default_response_class=FastJSONResponse)
 
 @app.on_event("startup")
-def startup():
-    init_db()
+async def startup():
+    router.open()
+    max_id = router.max_event_id()
+    notifier.start(max_id)
+    for table in ("events", "archived_event_ids"):
+        recent_ids.add(row[0] for row in router.query(f"SELECT event_id FROM {table} WHERE id > ?", [max_id - DEDUP_ENTRIES]))
+    router.start(on_commit)
+    if follower:
+        if router.sharded or storage.STORAGE != "sqlite":
+            raise RuntimeError("LEDGER_FOLLOW_URL cannot be combined with LEDGER_SHARD_BY or LEDGER_STORAGE=log")
+        follower.start(on_commit)
+    if ARCHIVE_INTERVAL_SECONDS > 0:
+        app.state.archiver = asyncio.create_task(archive_loop())
+
+@app.on_event("shutdown")
+async def shutdown():
+    archiver = getattr(app.state, "archiver", None)
+    if archiver:
+        archiver.cancel()
+    if follower:
+        await follower.stop()
+    await router.stop()
+    close_db()
+
+def on_commit(last_id: int):
+    snapshot_cache.invalidate()
+    notifier.publish(last_id)
+
+async def read_your_writes(request: Request, call_next):
+    # LEDGER_STORAGE=log (storage.py): writes are acknowledged before they are indexed, so a
+    # read first waits for the index to hold every write acknowledged before it started.
+    if request.method == "GET" and not await storage.wait_indexed():
+        return JSONResponse(status_code=503, content={"detail": "Event log index is behind; retry"})
+    return await call_next(request)
+
+# Only registered where it does something, so other deployments skip the extra layer.
+if storage.STORAGE == "log":
+    app.middleware("http")(read_your_writes)
+
+async def replication_lag_header(request: Request, call_next):
+    response = await call_next(request)
+    lag = follower.lag_seconds()
+    response.headers["X-Replication-Lag"] = "unknown" if lag is None else f"{lag:.3f}"
+    return response
+
+if follower:
+    app.middleware("http")(replication_lag_header)
+
+def event_row(event: EventCreate) -> EventRow:
+    event_id = event.event_id or str(uuid.uuid4())
+    ts = event.ts or datetime.now(timezone.utc).isoformat()
+    return (None, event_id, ts, event.run_id, event.order_id, event.event_type, json.dumps(event.payload))
+
+def event_theater(event: EventCreate) -> Optional[str]:
+    theater = event.payload.get("theater")
+    return theater if isinstance(theater, str) and theater else None
 
 @app.get("/health")
 async def health():
     return {"status": "ok"}
 
+async def submit(rows: List[EventRow], theaters: List[Optional[str]]) -> List[dict]:
+    # Recently seen event_ids (dedup.py) are answered "exists" without queueing for the
+    # writer; the rest go to the group committer.
+    if follower:
+        raise HTTPException(status_code=403, detail=f"Read-only follower; write to {follower.url}")
+    results = [None] * len(rows)
+    pending = []
+    for i, row in enumerate(rows):
+        if row[1] in recent_ids:
+            results[i] = {"status": "exists", "event_id": row[1]}
+        else:
+            pending.append(i)
+    if pending:
+        out = await router.submit([rows[i] for i in pending], [theaters[i] for i in pending])
+        for i, r in zip(pending, out):
+            results[i] = r
+        recent_ids.add(r["event_id"] for r in out)
+    ledger_hits = sum(1 for r in results if r["status"] == "exists")
+    recent_ids.record(len(rows), len(rows) - len(pending), ledger_hits - (len(rows) - len(pending)))
+    return results
+
 @app.post("/events")
 async def create_event(event: EventCreate):
-    event_id = event.event_id or str(uuid.uuid4())
-    ts = event.ts or datetime.now(timezone.utc).isoformat()
-    
-    with get_db() as conn:
-        try:
-            conn.execute("""
-            INSERT INTO events (event_id, ts, run_id, order_id, event_type, payload)
-            VALUES (?, ?, ?, ?, ?, ?)
-            """, (event_id, ts, event.run_id, event.order_id, event.event_type, json.dumps(event.payload)))
-            conn.commit()
-        except sqlite3.IntegrityError:
-            # Idempotency: return success if event already exists
-            return {"status": "exists", "event_id": event_id}
-            
-    # Trigger an incremental snapshot update or just wait for explicit rebuild for now
-    # For MVP, we'll just allow explicit rebuild or rebuild on read if needed.
-    # Actually, let's just rebuild for now to keep it simple, or provide a flag.
-    rebuild_snapshots()
-    
-    return {"status": "created", "event_id": event_id}
+    # Group-committed with concurrent requests (see writer.py); acknowledged once durable.
+    # Idempotency: a known event_id returns "exists".
+    return (await submit([event_row(event)], [event_theater(event)]))[0]
+
+@app.post("/events/batch")
+async def create_events_batch(batch: EventBatchCreate):
+    # Ordered batch ingest: the whole batch lands in one transaction and one projection
+    # pass. Duplicates within the batch: first occurrence wins.
+    results = await submit([event_row(event) for event in batch.events],
+                                  [event_theater(event) for event in batch.events])
+    created = sum(1 for r in results if r["status"] == "created")
+    return {"created": created, "exists": len(results) - created, "results": results}
+
+def encode_cursor(direction: str, event_id: int) -> str:
+    raw = json.dumps({"d": direction, "id": event_id}, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> Tuple[str, int]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        data = json.loads(raw)
+        if data["d"] not in {"after", "before"}:
+            raise ValueError(data["d"])
+        return data["d"], int(data["id"])
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
 
 @app.get("/events")
 async def list_events(
     run_id: Optional[str] = None,
     order_id: Optional[str] = None,
     limit: int = 100,
-    offset: int = 0
+    offset: int = 0,
+    after_id: Optional[int] = None,
+    before_id: Optional[int] = None,
+    cursor: Optional[str] = None,
+    expand: Optional[str] = None
 ):
+    # Two paging modes:
+    # - keyset (after_id / before_id / cursor): ordered by the monotonically increasing `id`,
+    #   after_id ascending (tailing from a high-water mark), before_id descending (walking
+    #   back in history). Constant cost per page; next page cursor in X-Next-Cursor.
+    # - legacy (none of the above): newest first by ts with LIMIT/OFFSET.
+    if cursor:
+        direction, cursor_id = decode_cursor(cursor)
+        after_id, before_id = (cursor_id, None) if direction == "after" else (None, cursor_id)
+    if after_id is not None and before_id is not None:
+        raise HTTPException(status_code=400, detail="after_id and before_id are mutually exclusive")
+    
     query = "SELECT * FROM events WHERE 1=1"
     params = []
     if run_id:
@@ -56,46 +170,427 @@ async def list_events(
     if order_id:
         query += " AND order_id = ?"
         params.append(order_id)
+    cap = router.event_cap()
+    if cap is not None:
+        # Sharded: only ids below every in-flight commit (see shards.py)
+        query += " AND id <= ?"
+        params.append(cap)
+    
+    # Archived events of the run/order (archive.py) are merged in with the hot rows.
+    cold = [row for path in list(router.paths.values()) for row in cold_events(path, run_id, order_id)]
     
-    query += " ORDER BY ts DESC LIMIT ? OFFSET ?"
-    params.extend([limit, offset])
+    # Sharded ledgers run the query on every shard and merge the pages.
+    keyset = after_id is not None or before_id is not None
+    if after_id is not None:
+        query += " AND id > ? ORDER BY id ASC LIMIT ?"
+        params.extend([after_id, limit])
+        rows = router.merged(router.query(query, params), "id", limit=limit)
+        if cold:
+            rows = sort_rows([*rows, *(row for row in cold if row["id"] > after_id)], "id")[:limit]
+    elif before_id is not None:
+        query += " AND id < ? ORDER BY id DESC LIMIT ?"
+        params.extend([before_id, limit])
+        rows = router.merged(router.query(query, params), "id", descending=True, limit=limit)
+        if cold:
+            rows = sort_rows([*rows, *(row for row in cold if row["id"] < before_id)], "id", descending=True)[:limit]
+    else:
+        query += " ORDER BY ts DESC LIMIT ? OFFSET ?"
+        params.extend([limit + offset, 0] if router.fan_out or cold else [limit, offset])
+        rows = router.query(query, params)
+        if cold:
+            rows = sort_rows([*rows, *cold], "ts", descending=True)[offset:offset + limit]
+        else:
+            rows = router.merged(rows, "ts", descending=True, limit=limit, offset=offset)
     
-    with get_db() as conn:
-        rows = conn.execute(query, params).fetchall()
-        return [dict(row) for row in rows]
+    headers = {}
+    if keyset and rows:
+        last_id = rows[-1]["id"]
+        headers["X-Last-Event-Id"] = str(last_id)
+        if len(rows) == limit or after_id is not None:
+            # Tailing (after) always gets a cursor so consumers can resume from it later.
+            headers["X-Next-Cursor"] = encode_cursor("after" if after_id is not None else "before", last_id)
+    fields = parse_expand(expand)
+    if fields:
+        # Out-of-line payload fields (blobs.py) are only loaded when asked for.
+        with router.snapshot() as conns:
+            rows = expand_rows(conns, rows, "payload", fields)
+    # Rows are encoded straight to bytes; payload stays the stored JSON string.
+    return RawJSONResponse(encode_rows(rows), headers=headers)
+
+@app.get("/events/search")
+async def search_events(
+    q: str,
+    run_id: Optional[str] = None,
+    order_id: Optional[str] = None,
+    event_type: Optional[str] = None,
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    before_id: Optional[int] = None,
+    limit: int = 50
+):
+    # Full-text search (search.py) over the indexed payload fields, newest first. q is an
+    # FTS5 query: words, "phrases", prefix*, AND/OR/NOT, field filters like error:timeout.
+    # Page back with before_id=X-Last-Event-Id.
+    if not SEARCH_ENABLED:
+        raise HTTPException(status_code=404, detail="Search index not enabled (LEDGER_SEARCH=1)")
+    query = "SELECT e.* FROM events_fts JOIN events e ON e.id = events_fts.rowid WHERE events_fts MATCH ?"
+    params = [q]
+    for clause, value in [(" AND events_fts.rowid < ?", before_id), (" AND e.run_id = ?", run_id),
+                          (" AND e.order_id = ?", order_id), (" AND e.event_type = ?", event_type),
+                          (" AND e.ts >= ?", since), (" AND e.ts < ?", until)]:
+        if value is not None:
+            query += clause
+            params.append(value)
+    cap = router.event_cap()
+    if cap is not None:
+        query += " AND events_fts.rowid <= ?"
+        params.append(cap)
+    query += " ORDER BY events_fts.rowid DESC LIMIT ?"
+    params.append(limit)
+    try:
+        rows = router.merged(router.query(query, params), "id", descending=True, limit=limit)
+    except sqlite3.OperationalError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid search query: {e}")
+    headers = {"X-Last-Event-Id": str(rows[-1]["id"])} if rows else {}
+    return RawJSONResponse(encode_rows(rows), headers=headers)
+
+def fetch_events_after(after_id: int, clauses: str, params: list, limit: int):
+    cap = router.event_cap()
+    if cap is not None:
+        clauses += " AND id <= ?"
+        params = [*params, cap]
+    rows = router.query(f"SELECT * FROM events WHERE id > ?{clauses} ORDER BY id ASC LIMIT ?",
+                        [after_id, *params, limit])
+    return [dict(row) for row in router.merged(rows, "id", limit=limit)]
+
+@app.get("/events/stream")
+async def stream_events(
+    request: Request,
+    run_id: Optional[str] = None,
+    order_id: Optional[str] = None,
+    event_type: Optional[str] = None,
+    theater: Optional[str] = None,
+    status: Optional[str] = None,
+    after_id: Optional[int] = None,
+    mode: str = "sse",
+    timeout: float = 30,
+    limit: int = 500,
+    last_event_id: Optional[str] = Header(None)
+):
+    # Push newly committed events to subscribers.
+    # - mode=sse: text/event-stream, `id:` is the ledger event id so EventSource reconnects
+    #   resume via the Last-Event-ID header. A comment heartbeat is sent when idle.
+    # - mode=poll: long-poll; returns as soon as at least one matching event is committed
+    #   (or after `timeout` seconds with []), resume with after_id=X-Last-Event-Id.
+    # Without after_id/Last-Event-ID only events committed after the request are delivered.
+    if mode not in {"sse", "poll"}:
+        raise HTTPException(status_code=400, detail="mode must be 'sse' or 'poll'")
+    if after_id is None and last_event_id:
+        try:
+            after_id = int(last_event_id)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid Last-Event-ID")
+    if after_id is None:
+        after_id = notifier.last_id
+    clauses, params = build_event_filters(run_id, order_id, event_type, theater, status)
+
+    def next_page(cursor: int) -> Tuple[list, int]:
+        seen = notifier.last_id
+        rows = fetch_events_after(cursor, clauses, params, limit)
+        if rows:
+            return rows, rows[-1]["id"]
+        # Nothing matched up to `seen`; don't rescan those rows on the next wake-up.
+        return rows, max(cursor, seen)
+
+    if mode == "poll":
+        deadline = asyncio.get_running_loop().time() + min(timeout, MAX_LONGPOLL_SECONDS)
+        cursor = after_id
+        while True:
+            seen = notifier.last_id
+            rows, cursor = next_page(cursor)
+            remaining = deadline - asyncio.get_running_loop().time()
+            if rows or remaining <= 0:
+                break
+            await notifier.wait(seen, remaining)
+        return RawJSONResponse(dumps(rows), headers={"X-Last-Event-Id": str(cursor)})
+
+    async def sse():
+        cursor = after_id
+        yield "retry: 1000\n\n"
+        while not await request.is_disconnected():
+            seen = notifier.last_id
+            rows, cursor = next_page(cursor)
+            for row in rows:
+                yield format_sse(row)
+            if len(rows) == limit:
+                continue
+            if not await notifier.wait(seen, HEARTBEAT_SECONDS):
+                yield ": keepalive\n\n"
+
+    return StreamingResponse(sse(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+MAX_ID_FILTER = 1000
+
+def build_snapshot_filters(status: Optional[List[str]], theater: Optional[str], updated_since: Optional[str],
+                           **id_filters: Optional[List[str]]) -> Tuple[str, list]:
+    # WHERE clause for the snapshot listings; every filter is backed by an index
+    # (see database.SNAPSHOT_INDEXES). Repeated query params become IN (...).
+    clauses = ""
+    params = []
+    for col, values in [("status", status), *id_filters.items()]:
+        if not values:
+            continue
+        if len(values) > MAX_ID_FILTER:
+            raise HTTPException(status_code=400, detail=f"At most {MAX_ID_FILTER} values per {col} filter")
+        clauses += f" AND {col} IN ({', '.join('?' * len(values))})"
+        params.extend(values)
+    if theater:
+        clauses += " AND theater = ?"
+        params.append(theater)
+    if updated_since:
+        clauses += " AND updated_at > ?"
+        params.append(updated_since)
+    return clauses, params
+
+def cached_snapshot_response(request: Request, if_none_match: Optional[str],
+                             load: Callable[[List[sqlite3.Connection]], bytes]) -> Response:
+    # Conditional GET for snapshot reads: the ETag is the projection checkpoint (see
+    # cache.py), so an idle ledger answers If-None-Match with 304 after one primary-key
+    # lookup, and repeated queries are served from the cached bytes without touching the
+    # snapshot tables or re-running response validation. ETag and rows are read in one
+    # transaction so the tag always describes the body.
+    # load() gets one connection per shard and returns the encoded body (see
+    # responses.encode_rows).
+    key = f"{request.url.path}?{request.url.query}"
+    with router.snapshot() as conns:
+        etag = combine_etags([snapshot_etag(conn) for conn in conns])
+        headers = {"ETag": etag, "Cache-Control": "no-cache"}
+        if etag_matches(if_none_match, etag):
+            return Response(status_code=304, headers=headers)
+        body = snapshot_cache.get(key, etag)
+        if body is None:
+            body = load(conns)
+            snapshot_cache.put(key, etag, body)
+    return RawJSONResponse(body, headers=headers)
+
+def fetch_all(conns: List[sqlite3.Connection], query: str, params) -> list:
+    rows = []
+    for conn in conns:
+        rows.extend(conn.execute(query, params).fetchall())
+    return rows
 
 @app.get("/runs", response_model=List[RunSnapshotModel])
-async def list_runs():
-    with get_db() as conn:
-        rows = conn.execute("SELECT * FROM runs_snapshot ORDER BY started_at DESC").fetchall()
-        out = []
-        for row in rows:
-            d = dict(row)
-            d["order_ids"] = json.loads(d["order_ids"])
-            out.append(d)
-        return out
+async def list_runs(
+    request: Request,
+    status: Optional[List[str]] = Query(None),
+    theater: Optional[str] = None,
+    run_id: Optional[List[str]] = Query(None),
+    updated_since: Optional[str] = None,
+    limit: Optional[int] = None,
+    if_none_match: Optional[str] = Header(None)
+):
+    clauses, params = build_snapshot_filters(status, theater, updated_since, run_id=run_id)
+    query = f"SELECT * FROM runs_snapshot WHERE 1=1{clauses} ORDER BY started_at DESC"
+    if limit:
+        query += " LIMIT ?"
+        params.append(limit)
+    def load(conns):
+        rows = router.merged(fetch_all(conns, query, params), "started_at", descending=True, limit=limit)
+        return encode_rows(rows, raw_columns=("order_ids",))
+    return cached_snapshot_response(request, if_none_match, load)
+
+def parse_as_of(as_of: Optional[str]) -> Tuple[Optional[int], Optional[str]]:
+    # as_of=<event id> or as_of=<ISO timestamp>, compared like the stored event ts.
+    if as_of is None or as_of.isdigit():
+        return (int(as_of) if as_of else None), None
+    try:
+        datetime.fromisoformat(as_of.replace("Z", "+00:00"))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="as_of must be an event id or an ISO timestamp")
+    return None, as_of
+
+def fetch_as_of(conns: List[sqlite3.Connection], kind: str, entity_id: str,
+                until_id: Optional[int], until_ts: Optional[str]) -> list:
+    # Point-in-time snapshot (database.entity_as_of), from the shard holding the entity.
+    for conn in conns:
+        row = entity_as_of(conn, kind, entity_id, until_id, until_ts)
+        if row:
+            return [row]
+    return []
 
 @app.get("/runs/{run_id}", response_model=RunSnapshotModel)
-async def get_run(run_id: str):
-    with get_db() as conn:
-        row = conn.execute("SELECT * FROM runs_snapshot WHERE run_id = ?", (run_id,)).fetchone()
-        if not row:
+async def get_run(run_id: str, request: Request, as_of: Optional[str] = None,
+                  if_none_match: Optional[str] = Header(None)):
+    until_id, until_ts = parse_as_of(as_of)
+    def load(conns):
+        if as_of is not None:
+            rows = fetch_as_of(conns, "run", run_id, until_id, until_ts)
+        else:
+            rows = fetch_all(conns, "SELECT * FROM runs_snapshot WHERE run_id = ?", (run_id,))
+        if not rows:
             raise HTTPException(status_code=404, detail="Run not found")
-        d = dict(row)
-        d["order_ids"] = json.loads(d["order_ids"])
-        return d
+        return encode_row(rows[0], raw_columns=("order_ids",))
+    return cached_snapshot_response(request, if_none_match, load)
+
+@app.get("/orders", response_model=List[OrderSnapshotModel])
+async def list_orders(
+    request: Request,
+    status: Optional[List[str]] = Query(None),
+    theater: Optional[str] = None,
+    run_id: Optional[List[str]] = Query(None),
+    order_id: Optional[List[str]] = Query(None),
+    updated_since: Optional[str] = None,
+    limit: Optional[int] = None,
+    expand: Optional[str] = None,
+    if_none_match: Optional[str] = Header(None)
+):
+    # Bulk lookup: one query instead of one GET /orders/{id} per order.
+    clauses, params = build_snapshot_filters(status, theater, updated_since, run_id=run_id, order_id=order_id)
+    query = f"SELECT * FROM orders_snapshot WHERE 1=1{clauses} ORDER BY updated_at DESC"
+    if limit:
+        query += " LIMIT ?"
+        params.append(limit)
+    def load(conns):
+        rows = router.merged(fetch_all(conns, query, params), "updated_at", descending=True, limit=limit)
+        return encode_rows(expand_rows(conns, rows, "extra", parse_expand(expand)), raw_columns=("extra",))
+    return cached_snapshot_response(request, if_none_match, load)
 
 @app.get("/orders/{order_id}", response_model=OrderSnapshotModel)
-async def get_order(order_id: str):
-    with get_db() as conn:
-        row = conn.execute("SELECT * FROM orders_snapshot WHERE order_id = ?", (order_id,)).fetchone()
-        if not row:
+async def get_order(order_id: str, request: Request, expand: Optional[str] = None, as_of: Optional[str] = None,
+                    if_none_match: Optional[str] = Header(None)):
+    until_id, until_ts = parse_as_of(as_of)
+    def load(conns):
+        if as_of is not None:
+            rows = fetch_as_of(conns, "order", order_id, until_id, until_ts)
+        else:
+            rows = fetch_all(conns, "SELECT * FROM orders_snapshot WHERE order_id = ?", (order_id,))
+        if not rows:
             raise HTTPException(status_code=404, detail="Order not found")
-        d = dict(row)
-        d["extra"] = json.loads(d["extra"])
-        return d
+        return encode_row(expand_rows(conns, rows[:1], "extra", parse_expand(expand))[0], raw_columns=("extra",))
+    return cached_snapshot_response(request, if_none_match, load)
+
+@app.get("/blobs/{digest}")
+async def get_blob(digest: str):
+    with router.snapshot() as conns:
+        value = load_blob(conns, digest)
+    if value is None:
+        raise HTTPException(status_code=404, detail="Blob not found")
+    return value
+
+def utc_param(name: str, value: Optional[str]) -> Optional[str]:
+    # Rollup buckets are stored as UTC isoformat strings; compare like with like.
+    if value is None:
+        return None
+    try:
+        dt = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid {name} timestamp")
+    return (dt.replace(tzinfo=timezone.utc) if dt.tzinfo is None else dt.astimezone(timezone.utc)).isoformat()
+
+@app.get("/metrics/rollups")
+async def get_metrics_rollups(
+    granularity: str = "hour",
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    theater: Optional[str] = None,
+    model_id: Optional[str] = None,
+    profile_name: Optional[str] = None,
+    combine: bool = False
+):
+    # Model-call rollups (rollups.py) for buckets in [since, until). combine=true folds the
+    # buckets of each theater/model/profile into one row, e.g. p95 per model over the last
+    # hour: ?granularity=minute&since=<now-1h>&combine=true
+    if granularity not in GRANULARITIES:
+        raise HTTPException(status_code=400, detail=f"granularity must be one of {', '.join(GRANULARITIES)}")
+    query = "SELECT * FROM metrics_rollups WHERE granularity = ?"
+    params = [granularity]
+    for clause, value in [(" AND bucket_start >= ?", utc_param("since", since)),
+                          (" AND bucket_start < ?", utc_param("until", until)),
+                          (" AND theater = ?", theater), (" AND model_id = ?", model_id),
+                          (" AND profile_name = ?", profile_name)]:
+        if value is not None:
+            query += clause
+            params.append(value)
+    query += " ORDER BY bucket_start"
+    # Shards hold disjoint events for the same buckets: sum rows with equal keys.
+    groups = {}
+    for row in router.query(query, params):
+        key = tuple(row[c] for c in KEY_COLUMNS if not (combine and c == "bucket_start"))
+        r = {c: row[c] for c in COUNTERS}
+        r["latency_hist"] = json.loads(row["latency_hist"])
+        if key in groups:
+            merge_rollup(groups[key], r)
+        else:
+            groups[key] = r
+    out = []
+    for key, r in sorted(groups.items()):
+        quantiles = {name: percentile(r["latency_hist"], q) for name, q in (("p50", 0.5), ("p95", 0.95), ("p99", 0.99))}
+        lookups = r["cache_hits"] + r["cache_misses"]
+        out.append({
+            **dict(zip([c for c in KEY_COLUMNS if not (combine and c == "bucket_start")], key)),
+            **r,
+            "latency_avg_ms": r["latency_sum_ms"] / r["latency_count"] if r["latency_count"] else None,
+            **{f"latency_{name}_ms": value for name, (value, _) in quantiles.items()},
+            # Quantiles above the largest bound: the value reported is a lower limit.
+            "latency_saturated": [name for name, (_, saturated) in quantiles.items() if saturated],
+            "cache_hit_rate": r["cache_hits"] / lookups if lookups else None,
+        })
+    return {"granularity": granularity, "latency_buckets_ms": list(LATENCY_BUCKETS_MS), "rollups": out}
+
+@app.get("/digests")
+async def get_digests(prefix: str = ""):
+    # Merkle tree of the snapshots (digests.py), one level per request: compare the root
+    # with another ledger's and descend only into children whose digests differ, down to
+    # the run leaves of a bucket (see verify_ledger_parity.py compare).
+    if not re.fullmatch(r"[0-9a-f]*", prefix):
+        raise HTTPException(status_code=400, detail="prefix must be lowercase hex")
+    return await asyncio.to_thread(ledger_digests, list(router.paths.values()), None, prefix)
+
+@app.get("/digests/runs/{run_id}")
+async def get_run_digests(run_id: str):
+    # A leaf's entities: the run's digest and each of its orders'.
+    return await asyncio.to_thread(ledger_digests, list(router.paths.values()), run_id)
+
+@app.get("/projection")
+async def get_projection():
+    with router.snapshot() as conns:
+        search = [search_status(conn) for conn in conns]
+    return {**router.status(), "cache": snapshot_cache.stats(), "dedup": recent_ids.stats(),
+            "search": search if router.fan_out else search[0],
+            "replication": follower.status() if follower else {"role": "primary"}}
+
+@app.post("/admin/backup")
+async def trigger_backup():
+    # Online backup of every shard (backup.py); writes continue while it runs.
+    return await asyncio.to_thread(backup_all, dict(router.paths))
+
+@app.get("/replication")
+async def get_replication():
+    return follower.status() if follower else {"role": "primary"}
 
 @app.post("/rebuild")
 async def trigger_rebuild():
-    rebuild_snapshots()
+    router.rebuild()
+    snapshot_cache.invalidate()
     return {"status": "rebuilt"}
+
+def archive_all(age_days: float) -> dict:
+    return {name: archive_runs(path, age_days) for name, path in list(router.paths.items())}
+
+@app.post("/archive")
+async def trigger_archive(age_days: float = ARCHIVE_AGE_DAYS):
+    # Moves events of runs finished more than age_days ago to cold segments (archive.py).
+    return {"status": "archived", "shards": await asyncio.to_thread(archive_all, age_days)}
+
+@app.get("/archive")
+async def get_archive():
+    return {name: archive_status(path) for name, path in list(router.paths.items())}
+
+async def archive_loop():
+    while True:
+        await asyncio.sleep(ARCHIVE_INTERVAL_SECONDS)
+        try:
+            await asyncio.to_thread(archive_all, ARCHIVE_AGE_DAYS)
+        except Exception as e:
+            print(f"Archiving failed: {e}")
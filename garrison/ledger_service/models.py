@@ -9,6 +9,9 @@ class EventCreate(BaseModel):
     event_type: str
     payload: Dict[str, Any]
 
+class EventBatchCreate(BaseModel):
+    events: List[EventCreate]
+
 class OrderSnapshotModel(BaseModel):
     order_id: str
     run_id: str
@@ -18,6 +21,8 @@ class OrderSnapshotModel(BaseModel):
     unit_head: str
     order_head: str
     extra: Dict[str, Any]
+    theater: Optional[str] = None
+    updated_at: Optional[str] = None
 
 class RunSnapshotModel(BaseModel):
     run_id: str
@@ -29,3 +34,5 @@ class RunSnapshotModel(BaseModel):
     max_orders: Optional[int] = None
     worktree: str
     order_head: str
+    theater: Optional[str] = None
+    updated_at: Optional[str] = None
@@ -0,0 +1,122 @@
+import asyncio
+import json
+import os
+import time
+from typing import Callable, List, Optional, Tuple
+
+import requests
+
+from database import read_db, write_db, get_projection_state
+from writer import commit_events
+from archive import EVENT_COLUMNS
+from blobs import refs, store_blob
+
+# Follower mode (read scaling). With LEDGER_FOLLOW_URL set to a primary ledger's base URL,
+# the service does not accept writes; instead it tails the primary's event log with
+# long-polls on GET /events/stream?mode=poll&after_id=<cursor> and commits each page
+# (events + projection, same path as local writes) into its own ledger.db. Every read
+# endpoint then serves the local copy, with X-Replication-Lag on responses.
+# The cursor is the local projection checkpoint, so a restarted follower resumes where it
+# stopped. Referenced blobs (blobs.py) are copied along with their events. Archived events
+# (archive.py) are not in the stream: a follower whose cursor is behind the primary's
+# archive refuses to follow (it would silently miss those runs and orders).
+FOLLOW_URL = os.environ.get("LEDGER_FOLLOW_URL", "").rstrip("/")
+FOLLOW_BATCH = int(os.environ.get("LEDGER_FOLLOW_BATCH", 1000))
+FOLLOW_POLL_SECONDS = float(os.environ.get("LEDGER_FOLLOW_POLL_SECONDS", 25))
+FOLLOW_RETRY_SECONDS = float(os.environ.get("LEDGER_FOLLOW_RETRY_SECONDS", 2))
+
+class Follower:
+    def __init__(self, url: str, path=None):
+        self.url = url
+        self.path = path
+        self.applied_id = 0
+        self.primary_id = 0
+        self.events = 0
+        self.in_sync = False
+        self.synced_at = None
+        self.last_error = None
+        self._session = requests.Session()
+        self._task = None
+
+    def start(self, on_commit: Callable[[int], None]):
+        with read_db(self.path) as conn:
+            self.applied_id = get_projection_state(conn)[1] or 0
+        try:
+            self.check_archive(self.applied_id)
+        except requests.RequestException:
+            pass  # Primary not reachable yet; the loop checks before every fetch.
+        self._task = asyncio.create_task(self._run(on_commit))
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    def check_archive(self, cursor: int):
+        resp = self._session.get(f"{self.url}/archive", timeout=30)
+        resp.raise_for_status()
+        archived_id = max((shard["last_id"] for shard in resp.json().values()), default=0)
+        if archived_id > cursor:
+            raise RuntimeError(f"Primary has archived events up to id {archived_id}, past this follower's "
+                               f"cursor {cursor}; start from a backup of the primary (backup.py) instead")
+
+    def fetch(self, cursor: int) -> Tuple[List[dict], int]:
+        self.check_archive(cursor)
+        resp = self._session.get(f"{self.url}/events/stream", params={
+            "mode": "poll", "after_id": cursor, "limit": FOLLOW_BATCH, "timeout": FOLLOW_POLL_SECONDS,
+        }, timeout=FOLLOW_POLL_SECONDS + 10)
+        resp.raise_for_status()
+        return resp.json(), int(resp.headers.get("X-Last-Event-Id", cursor))
+
+    def apply(self, rows: List[dict]):
+        missing = {digest for row in rows for digest in refs(row["payload"])}
+        if missing:
+            with read_db(self.path) as conn:
+                missing -= {r["hash"] for r in conn.execute(
+                    f"SELECT hash FROM blobs WHERE hash IN ({', '.join('?' * len(missing))})", list(missing))}
+            blobs = {}
+            for digest in missing:
+                resp = self._session.get(f"{self.url}/blobs/{digest}", timeout=30)
+                resp.raise_for_status()
+                blobs[digest] = json.dumps(resp.json()).encode()
+            with write_db(self.path) as conn:
+                for digest, encoded in blobs.items():
+                    store_blob(conn, digest, encoded)
+        # Primary ids are kept, so after_id cursors work the same against either instance.
+        commit_events([[tuple(row[col] for col in EVENT_COLUMNS) for row in rows]], self.path)
+
+    async def _run(self, on_commit: Callable[[int], None]):
+        while True:
+            try:
+                rows, head = await asyncio.to_thread(self.fetch, self.applied_id)
+                if rows:
+                    await asyncio.to_thread(self.apply, rows)
+                    self.applied_id = rows[-1]["id"]
+                    self.events += len(rows)
+                    on_commit(self.applied_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.in_sync = False
+                self.last_error = f"{type(e).__name__}: {e}"
+                await asyncio.sleep(FOLLOW_RETRY_SECONDS)
+                continue
+            self.last_error = None
+            self.primary_id = max(self.primary_id, head)
+            # A short page means the primary had nothing more: in sync until the next
+            # long-poll returns a full page.
+            self.in_sync = len(rows) < FOLLOW_BATCH
+            if self.in_sync:
+                self.synced_at = time.time()
+
+    def lag_seconds(self) -> Optional[float]:
+        if self.in_sync:
+            return 0.0
+        return time.time() - self.synced_at if self.synced_at else None
+
+    def status(self) -> dict:
+        return {"role": "follower", "primary": self.url, "applied_id": self.applied_id,
+                "primary_id": self.primary_id, "lag_events": max(self.primary_id - self.applied_id, 0),
+                "lag_seconds": self.lag_seconds(), "events": self.events, "last_error": self.last_error}
+
+follower: Optional[Follower] = Follower(FOLLOW_URL) if FOLLOW_URL else None
@@ -0,0 +1,45 @@
+import json
+from typing import Any, Iterable, Sequence
+
+from fastapi.responses import JSONResponse, Response
+
+# Response encoding for the read endpoints. Rows go straight from sqlite3.Row to JSON
+# bytes: no FastAPI jsonable_encoder / pydantic pass per row, and columns that already
+# hold JSON text (runs_snapshot.order_ids, orders_snapshot.extra) are spliced into the
+# body verbatim instead of being json.loads'ed only to be encoded again.
+# orjson is optional; without it the stdlib encoder is used.
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+def dumps(obj: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, separators=(",", ":"), ensure_ascii=False).encode()
+
+def encode_rows(rows: Iterable[Any], raw_columns: Sequence[str] = ()) -> bytes:
+    # JSON array of row objects. raw_columns must contain valid JSON text (or NULL).
+    parts = []
+    for row in rows:
+        d = dict(row)
+        raw = [(col, d.pop(col)) for col in raw_columns]
+        obj = dumps(d)
+        if raw:
+            obj = obj[:-1] + b"".join(
+                b',"' + col.encode() + b'":' + (value.encode() if value is not None else b"null")
+                for col, value in raw) + b"}"
+        parts.append(obj)
+    return b"[" + b",".join(parts) + b"]"
+
+def encode_row(row: Any, raw_columns: Sequence[str] = ()) -> bytes:
+    return encode_rows([row], raw_columns)[1:-1]
+
+class FastJSONResponse(JSONResponse):
+    # Default response class for the app: orjson when installed.
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+class RawJSONResponse(Response):
+    # Body is already encoded JSON (see encode_rows).
+    media_type = "application/json"
@@ -0,0 +1,157 @@
+import bisect
+import json
+from datetime import datetime, timezone
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+# Time-bucketed model-call metrics, maintained by project_pending() in the same transaction
+# as the snapshots, so "p95 latency per model over the last hour" reads a few rows instead
+# of parsing every event. One metrics_rollups row (migration 9) per
+# (granularity, bucket start, theater, model_id, profile_name) holds counters, a latency
+# histogram (LATENCY_BUCKETS_MS upper bounds + overflow) and token totals.
+# - worker.model_call.completed: calls, latency, cache hit/miss, usage tokens
+# - worker.model_call.failed: errors
+# Worker events don't carry a theater; they take the first theater seen on their order
+# (else run) in an earlier event. entity_theaters (migration 12) keeps that first theater
+# per order/run, so the write path and rebuild_snapshots() (which recomputes both tables
+# from the whole log, hot and archived) bucket every event the same way.
+ROLLUP_EVENTS = ("worker.model_call.completed", "worker.model_call.failed")
+GRANULARITIES = ("minute", "hour")
+LATENCY_BUCKETS_MS = (50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000)
+COUNTERS = ("calls", "errors", "cache_hits", "cache_misses", "latency_count", "latency_sum_ms",
+            "prompt_tokens", "completion_tokens", "total_tokens")
+KEY_COLUMNS = ("granularity", "bucket_start", "theater", "model_id", "profile_name")
+
+RollupKey = Tuple[str, str, str, str, str]
+
+def new_rollup() -> dict:
+    return {**dict.fromkeys(COUNTERS, 0), "latency_hist": [0] * (len(LATENCY_BUCKETS_MS) + 1)}
+
+def bucket_starts(ts: str) -> Optional[Dict[str, str]]:
+    try:
+        dt = datetime.fromisoformat(ts.replace("Z", "+00:00"))
+    except (AttributeError, ValueError):
+        return None
+    dt = dt.replace(tzinfo=timezone.utc) if dt.tzinfo is None else dt.astimezone(timezone.utc)
+    return {"minute": dt.replace(second=0, microsecond=0).isoformat(),
+            "hour": dt.replace(minute=0, second=0, microsecond=0).isoformat()}
+
+def _number(value) -> Optional[float]:
+    return value if isinstance(value, (int, float)) and not isinstance(value, bool) else None
+
+def fold(r: dict, event_type: str, payload: dict):
+    if event_type == "worker.model_call.failed":
+        r["errors"] += 1
+        return
+    r["calls"] += 1
+    cache_hit = payload.get("cache_hit")
+    if cache_hit is True:
+        r["cache_hits"] += 1
+    elif cache_hit is False:
+        r["cache_misses"] += 1
+    latency = _number(payload.get("latency_ms"))
+    if latency is not None:
+        r["latency_count"] += 1
+        r["latency_sum_ms"] += latency
+        r["latency_hist"][bisect.bisect_left(LATENCY_BUCKETS_MS, latency)] += 1
+    usage = payload.get("usage")
+    if isinstance(usage, dict):
+        for field in ("prompt_tokens", "completion_tokens", "total_tokens"):
+            r[field] += _number(usage.get(field)) or 0
+
+def merge(into: dict, r: dict):
+    for c in COUNTERS:
+        into[c] += r[c]
+    into["latency_hist"] = [a + b for a, b in zip(into["latency_hist"], r["latency_hist"])]
+
+def accumulate(acc: Dict[RollupKey, dict], event_type: str, ts: str, payload, theater: Optional[str]):
+    if event_type not in ROLLUP_EVENTS or not isinstance(payload, dict):
+        return
+    starts = bucket_starts(ts)
+    if starts is None:
+        return
+    model_id = str(payload.get("model_id") or "-")
+    profile = str(payload.get("profile_name") or "-")
+    for granularity in GRANULARITIES:
+        key = (granularity, starts[granularity], theater or "-", model_id, profile)
+        if key not in acc:
+            acc[key] = new_rollup()
+        fold(acc[key], event_type, payload)
+
+def event_theater(payload) -> Optional[str]:
+    theater = payload.get("theater") if isinstance(payload, dict) else None
+    return theater if isinstance(theater, str) and theater else None
+
+def theater_of(first_theater: Callable, payload: dict, event_id: int, run_id: Optional[str], order_id: Optional[str]) -> Optional[str]:
+    # first_theater(kind, entity_id) -> (event id, theater) of the entity's first event with one.
+    theater = event_theater(payload)
+    if theater:
+        return theater
+    for kind, value in (("order", order_id), ("run", run_id)):
+        if value:
+            first = first_theater(kind, value)
+            if first and first[0] < event_id:
+                return first[1]
+    return None
+
+def record_theaters(conn, evs: Iterable, table: str = "entity_theaters"):
+    # evs come in id order within every order/run, so the first insert per entity wins.
+    rows = []
+    for ev in evs:
+        if '"theater"' not in ev["payload"]:
+            continue
+        theater = event_theater(json.loads(ev["payload"]))
+        if theater:
+            rows += [(kind, value, ev["id"], theater) for kind, value in (("order", ev["order_id"]), ("run", ev["run_id"])) if value]
+    if rows:
+        conn.executemany(f"INSERT OR IGNORE INTO {table} (kind, entity_id, event_id, theater) VALUES (?, ?, ?, ?)", rows)
+
+def fold_events(conn, acc: Dict[RollupKey, dict], evs: Iterable, table: str = "entity_theaters"):
+    # Records the theaters of a batch of events, then adds its model calls to acc. Shared
+    # by the write path and rebuild_snapshots() (which fills a shadow table).
+    evs = list(evs)
+    record_theaters(conn, evs, table)
+    def first_theater(kind, entity_id):
+        return conn.execute(f"SELECT event_id, theater FROM {table} WHERE kind = ? AND entity_id = ?",
+                            (kind, entity_id)).fetchone()
+    for ev in evs:
+        if ev["event_type"] not in ROLLUP_EVENTS:
+            continue
+        payload = json.loads(ev["payload"])
+        if isinstance(payload, dict):
+            accumulate(acc, ev["event_type"], ev["ts"], payload, theater_of(first_theater, payload, ev["id"], ev["run_id"], ev["order_id"]))
+
+def write_rollups(conn, acc: Dict[RollupKey, dict]):
+    # Adds acc onto the stored rows.
+    for key, r in acc.items():
+        row = conn.execute(f"SELECT * FROM metrics_rollups WHERE {' AND '.join(f'{c} = ?' for c in KEY_COLUMNS)}", key).fetchone()
+        if row:
+            stored = {c: row[c] for c in COUNTERS}
+            stored["latency_hist"] = json.loads(row["latency_hist"])
+            merge(stored, r)
+            r = stored
+        conn.execute(f"""
+        INSERT OR REPLACE INTO metrics_rollups ({', '.join(KEY_COLUMNS + COUNTERS)}, latency_hist)
+        VALUES ({', '.join('?' * (len(KEY_COLUMNS) + len(COUNTERS) + 1))})
+        """, (*key, *(r[c] for c in COUNTERS), json.dumps(r["latency_hist"])))
+
+def apply_rollups(conn, evs: Iterable):
+    # Write path: evs are the rows project_pending() just folded into the snapshots.
+    acc = {}
+    fold_events(conn, acc, evs)
+    if acc:
+        write_rollups(conn, acc)
+
+def percentile(hist: List[int], q: float) -> Tuple[Optional[float], bool]:
+    # Upper bound of the histogram bucket holding the q-quantile (None: no data), and
+    # whether it is saturated: the quantile is in the overflow bucket, so the true value
+    # is above the largest bound that is returned.
+    total = sum(hist)
+    if not total:
+        return None, False
+    rank = q * total
+    seen = 0
+    for bound, count in zip(LATENCY_BUCKETS_MS, hist):
+        seen += count
+        if seen >= rank:
+            return bound, False
+    return LATENCY_BUCKETS_MS[-1], True
@@ -0,0 +1,127 @@
+import json
+import os
+import re
+import threading
+import zlib
+from datetime import datetime, timezone
+from typing import List, Optional
+
+# Optional full-text index over selected payload fields (LEDGER_SEARCH=1), for
+# GET /events/search. events_fts is a contentless FTS5 table (only the index is stored)
+# whose rowid is the event id, one column per LEDGER_SEARCH_FIELDS field. Fields moved to
+# the blob store (blobs.py) are indexed with their full text.
+# Like the snapshots, the index follows the log from a checkpoint (projection_state row
+# 'search'): project_pending() indexes the events it projects in the same transaction as
+# their insert, and a background thread backfills existing events when the index is first
+# enabled (or its fields change). While the backfill is behind, the write path leaves new
+# events to it instead of indexing the backlog. Archived events drop out of search results.
+SEARCH_ENABLED = os.environ.get("LEDGER_SEARCH", "0") == "1"
+SEARCH_FIELDS = [f.strip() for f in os.environ.get("LEDGER_SEARCH_FIELDS", "error,message,answer,stage").split(",") if f.strip()]
+SEARCH_CHUNK = 1000
+
+_backfills = {}
+
+def _fields_ok() -> bool:
+    return bool(SEARCH_FIELDS) and all(re.fullmatch(r"[A-Za-z_][A-Za-z0-9_]*", f) for f in SEARCH_FIELDS)
+
+def index_columns(conn) -> List[str]:
+    return [row[1] for row in conn.execute("PRAGMA table_info(events_fts)")]
+
+def ensure_index(conn):
+    # Creates (or, if LEDGER_SEARCH_FIELDS changed, recreates) events_fts and its checkpoint.
+    if not SEARCH_ENABLED:
+        return
+    if not _fields_ok():
+        raise ValueError(f"LEDGER_SEARCH_FIELDS must be payload field names, not {SEARCH_FIELDS!r}")
+    if index_columns(conn) != SEARCH_FIELDS:
+        conn.execute("DROP TABLE IF EXISTS events_fts")
+        conn.execute(f"CREATE VIRTUAL TABLE events_fts USING fts5({', '.join(SEARCH_FIELDS)}, content='')")
+        conn.execute("DELETE FROM projection_state WHERE name = 'search'")
+    if conn.execute("SELECT 1 FROM projection_state WHERE name = 'search'").fetchone() is None:
+        conn.execute("""
+        INSERT INTO projection_state (name, version, last_event_id, updated_at)
+        VALUES ('search', 1, 0, ?)
+        """, (datetime.now(timezone.utc).isoformat(),))
+
+def _text(conn, value) -> Optional[str]:
+    if isinstance(value, dict) and "$blob" in value:
+        row = conn.execute("SELECT data FROM blobs WHERE hash = ?", (value["$blob"],)).fetchone()
+        value = json.loads(zlib.decompress(row[0])) if row else None
+    if value is None:
+        return None
+    return value if isinstance(value, str) else json.dumps(value)
+
+def _checkpoint(conn) -> Optional[int]:
+    row = conn.execute("SELECT last_event_id FROM projection_state WHERE name = 'search'").fetchone()
+    return row[0] if row else None
+
+def _index_rows(conn, rows):
+    # rows: (id, payload) events after the search checkpoint, in id order.
+    entries = []
+    for ev in rows:
+        try:
+            payload = json.loads(ev["payload"])
+        except ValueError:
+            continue
+        if not isinstance(payload, dict):
+            continue
+        values = [_text(conn, payload.get(field)) for field in SEARCH_FIELDS]
+        if any(v is not None for v in values):
+            entries.append((ev["id"], *values))
+    if entries:
+        conn.executemany(f"INSERT INTO events_fts (rowid, {', '.join(SEARCH_FIELDS)}) VALUES ({', '.join('?' * (len(SEARCH_FIELDS) + 1))})",
+                         entries)
+    conn.execute("UPDATE projection_state SET last_event_id = ?, updated_at = ? WHERE name = 'search'",
+                 (rows[-1]["id"], datetime.now(timezone.utc).isoformat()))
+
+def index_events(conn, rows) -> int:
+    # Write path: indexes the events project_pending() just projected (id order), in the
+    # caller's transaction, if the index has caught up to them. Otherwise the backfill
+    # thread gets to them. Returns the number of events indexed.
+    if not SEARCH_ENABLED or not rows:
+        return 0
+    last_id = _checkpoint(conn)
+    if last_id is None:
+        return 0
+    rows = [ev for ev in rows if ev["id"] > last_id]
+    if not rows or conn.execute("SELECT 1 FROM events WHERE id > ? AND id < ? LIMIT 1", (last_id, rows[0]["id"])).fetchone():
+        return 0
+    _index_rows(conn, rows)
+    return len(rows)
+
+def index_pending(conn, limit: int = SEARCH_CHUNK) -> int:
+    # Backfill: indexes up to `limit` events after the search checkpoint; runs inside the
+    # caller's transaction. Returns the number of events consumed.
+    if not SEARCH_ENABLED:
+        return 0
+    last_id = _checkpoint(conn)
+    if last_id is None:
+        return 0
+    rows = conn.execute("SELECT id, payload FROM events WHERE id > ? ORDER BY id LIMIT ?", (last_id, limit)).fetchall()
+    if not rows:
+        return 0
+    _index_rows(conn, rows)
+    return len(rows)
+
+def backfill(path):
+    # Indexes existing events in SEARCH_CHUNK transactions (each one short, so the writer
+    # keeps going in between).
+    from database import write_db
+    while True:
+        with write_db(path) as conn:
+            if not index_pending(conn):
+                break
+
+def start_backfill(path):
+    from database import _key
+    key = _key(path)
+    thread = _backfills.get(key)
+    if thread is not None and thread.is_alive():
+        return
+    thread = _backfills[key] = threading.Thread(target=backfill, args=(key,), name="ledger-search-backfill", daemon=True)
+    thread.start()
+
+def search_status(conn) -> Optional[dict]:
+    if not SEARCH_ENABLED:
+        return None
+    return {"fields": SEARCH_FIELDS, "last_event_id": _checkpoint(conn)}
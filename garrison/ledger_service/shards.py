@@ -0,0 +1,235 @@
+import asyncio
+import os
+import re
+import zlib
+from collections import OrderedDict
+from contextlib import ExitStack, contextmanager
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+import database
+import storage
+from database import init_db, recover_projection, read_db, rebuild_snapshots, projection_status, partition_of
+from writer import EventRow, GroupCommitter
+
+# Storage sharding. By default the ledger is the single ledger.db (DB_PATH). With
+# LEDGER_SHARD_BY each shard is a complete ledger file (events + snapshots + projection
+# checkpoint) with its own writer, so SQLite's write lock is no longer shared by every
+# theater:
+# - theater: one shard per payload theater, created on first write
+# - run_id:  LEDGER_SHARD_COUNT shards by a stable hash of run_id (or order_id)
+# ledger.db stays the "default" shard: events without a theater, data from before
+# sharding was enabled and ingest_jsonl.py imports. A run/order stays on the shard that
+# already holds it, so its snapshot is never split.
+# Event ids stay ledger-wide: the router assigns them, and reads only see ids up to
+# committed_id() (every lower id committed or abandoned), so after_id tailing and
+# Last-Event-ID keep working across shards.
+SHARD_BY = os.environ.get("LEDGER_SHARD_BY", "")
+SHARD_COUNT = int(os.environ.get("LEDGER_SHARD_COUNT", 4))
+SHARD_DIR = os.environ.get("LEDGER_SHARD_DIR")  # Default: shards/ next to ledger.db
+DEFAULT_SHARD = "default"
+LOCATION_CACHE_SIZE = int(os.environ.get("LEDGER_SHARD_LOCATION_CACHE", 100000))
+
+def shard_name(theater: str) -> str:
+    if re.fullmatch(r"[A-Za-z0-9_-]{1,64}", theater):
+        return theater
+    return "t-%08x" % zlib.crc32(theater.encode())
+
+def sort_rows(rows: list, column: str, descending: bool = False) -> list:
+    # Same order as SQLite's ORDER BY column [DESC] (NULLs sort first ascending), with id
+    # as tie-breaker where present.
+    def key(row):
+        value = row[column]
+        return (value is not None, value, row["id"] if "id" in row.keys() else 0)
+    return sorted(rows, key=key, reverse=descending)
+
+class ShardRouter:
+    def __init__(self):
+        self.paths: Dict[str, str] = {}
+        self.committers: Dict[str, GroupCommitter] = {}
+        self._on_commit = None
+        self._started = False
+        self._next_id = None
+        self._in_flight = set()
+        self._locations = {"run_id": OrderedDict(), "order_id": OrderedDict()}
+
+    @property
+    def sharded(self) -> bool:
+        return bool(SHARD_BY)
+
+    @property
+    def fan_out(self) -> bool:
+        return len(self.paths) > 1
+
+    def shard_dir(self) -> Path:
+        return Path(SHARD_DIR) if SHARD_DIR else database.DB_PATH.parent / "shards"
+
+    def shard_path(self, name: str) -> str:
+        if name == DEFAULT_SHARD:
+            return str(database.DB_PATH)
+        return str(self.shard_dir() / f"{name}.db")
+
+    def open(self, background: bool = True):
+        # Initialise and recover every shard; also used offline by the scripts.
+        if SHARD_BY not in {"", "theater", "run_id"}:
+            raise ValueError(f"LEDGER_SHARD_BY must be 'theater' or 'run_id', not {SHARD_BY!r}")
+        if SHARD_BY and storage.STORAGE != "sqlite":
+            raise ValueError("LEDGER_SHARD_BY requires LEDGER_STORAGE=sqlite")
+        names = [DEFAULT_SHARD]
+        if SHARD_BY == "run_id":
+            names += [str(i) for i in range(SHARD_COUNT)]
+        elif SHARD_BY == "theater" and self.shard_dir().exists():
+            names += sorted(p.stem for p in self.shard_dir().glob("*.db"))
+        for name in names:
+            self._open_shard(name, background)
+        if self.sharded:
+            self._next_id = self.max_event_id() + 1
+
+    def _open_shard(self, name: str, background: bool = True):
+        path = self.shard_path(name)
+        if name != DEFAULT_SHARD:
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+        init_db(path)
+        recover_projection(background, path)
+        self.paths[name] = path
+        if self._started:
+            self._start_committer(name)
+
+    def start(self, on_commit: Callable[[int], None]):
+        self._on_commit = on_commit
+        self._started = True
+        for name in list(self.paths):
+            self._start_committer(name)
+
+    def _start_committer(self, name: str):
+        committer = GroupCommitter(self.paths[name], storage.engine(self.paths[name]))
+        # Sharded: the router publishes committed_id() once a request's shards are done.
+        committer.start(lambda last_id: None if self.sharded else self._on_commit(last_id))
+        self.committers[name] = committer
+
+    async def stop(self):
+        self._started = False
+        for committer in self.committers.values():
+            await committer.stop()
+        self.committers = {}
+
+    def max_event_id(self) -> int:
+        # Archived ids count too: they left `events` but stay in cursors and as_of replays.
+        return max(row[0] for row in self.query(database.MAX_EVENT_ID_SQL))
+
+    def committed_id(self) -> int:
+        return min(self._in_flight) - 1 if self._in_flight else self._next_id - 1
+
+    def event_cap(self) -> Optional[int]:
+        # Highest event id readers may see; None when SQLite assigns ids (single ledger).
+        return self.committed_id() if self.sharded else None
+
+    def allocate_ids(self, n: int) -> range:
+        ids = range(self._next_id, self._next_id + n)
+        self._next_id += n
+        return ids
+
+    def _remember(self, column: str, value: str, name: str):
+        cache = self._locations[column]
+        cache[value] = name
+        cache.move_to_end(value)
+        if len(cache) > LOCATION_CACHE_SIZE:
+            cache.popitem(last=False)
+
+    def locate(self, column: str, value: str) -> Optional[str]:
+        # Shard holding the run (column="run_id") or order ("order_id"), if any.
+        cache = self._locations[column]
+        if value in cache:
+            cache.move_to_end(value)
+            return cache[value]
+        table = "runs_snapshot" if column == "run_id" else "orders_snapshot"
+        for name, path in list(self.paths.items()):
+            with read_db(path) as conn:
+                if conn.execute(f"SELECT 1 FROM {table} WHERE {column} = ?", (value,)).fetchone():
+                    self._remember(column, value, name)
+                    return name
+        return None
+
+    def route(self, run_id: Optional[str], order_id: Optional[str], theater: Optional[str]) -> str:
+        if not self.sharded:
+            return DEFAULT_SHARD
+        name = (run_id and self.locate("run_id", run_id)) or (order_id and self.locate("order_id", order_id))
+        if not name:
+            if SHARD_BY == "theater":
+                name = shard_name(theater) if theater else DEFAULT_SHARD
+            else:
+                name = str(partition_of(run_id or order_id or "", SHARD_COUNT))
+        if run_id:
+            self._remember("run_id", run_id, name)
+        if order_id:
+            self._remember("order_id", order_id, name)
+        return name
+
+    async def submit(self, rows: List[EventRow], theaters: List[Optional[str]]) -> List[dict]:
+        # Commits rows (in order) on their shards; results in request order. A request
+        # spanning shards is atomic per shard, not across them.
+        if not self.sharded:
+            return await self.committers[DEFAULT_SHARD].submit(rows)
+        parts = {}
+        for i, (row, theater) in enumerate(zip(rows, theaters)):
+            name = self.route(row[3], row[4], theater)
+            if name not in self.paths:
+                self._open_shard(name, background=False)
+            parts.setdefault(name, []).append(i)
+        # Ids are assigned and queued without yielding, so every shard commits in id order.
+        ids = self.allocate_ids(len(rows))
+        self._in_flight.update(ids)
+        futures = {}
+        for name, idx in parts.items():
+            futures[name] = self.committers[name].enqueue([(ids[i],) + rows[i][1:] for i in idx])
+        try:
+            outcomes = await asyncio.gather(*futures.values(), return_exceptions=True)
+        finally:
+            self._in_flight.difference_update(ids)
+            self._on_commit(self.committed_id())
+        results = [None] * len(rows)
+        for (name, idx), out in zip(parts.items(), outcomes):
+            if isinstance(out, BaseException):
+                raise out
+            for i, r in zip(idx, out):
+                results[i] = r
+        return results
+
+    def query(self, sql: str, params: list = ()) -> list:
+        # Runs sql on every shard and concatenates the rows (merging is up to the caller).
+        rows = []
+        for path in list(self.paths.values()):
+            with read_db(path) as conn:
+                rows.extend(conn.execute(sql, params).fetchall())
+        return rows
+
+    def merged(self, rows: list, column: str, descending: bool = False,
+               limit: Optional[int] = None, offset: int = 0) -> list:
+        # Per-shard results (each already ordered and limited) merged into one page.
+        if not self.fan_out:
+            return rows
+        rows = sort_rows(rows, column, descending)
+        return rows[offset:offset + limit] if limit else rows[offset:]
+
+    @contextmanager
+    def snapshot(self):
+        # One read transaction per shard, held together: yields the connections.
+        with ExitStack() as stack:
+            conns = [stack.enter_context(read_db(path)) for path in list(self.paths.values())]
+            for conn in conns:
+                conn.execute("BEGIN")
+                stack.callback(conn.execute, "COMMIT")
+            yield conns
+
+    def rebuild(self, workers: Optional[int] = None):
+        for path in list(self.paths.values()):
+            rebuild_snapshots(workers, path)
+
+    def status(self) -> dict:
+        if not self.sharded:
+            return {**projection_status(), "writer": self.committers[DEFAULT_SHARD].stats() if self.committers else None}
+        return {"shard_by": SHARD_BY, "committed_id": self.committed_id(), "shards": {
+            name: {**projection_status(path), "writer": self.committers[name].stats() if name in self.committers else None}
+            for name, path in list(self.paths.items())}}
+
+router = ShardRouter()
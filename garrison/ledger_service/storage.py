@@ -0,0 +1,284 @@
+import asyncio
+import itertools
+import os
+import threading
+from collections import deque
+from datetime import datetime, timezone
+from typing import Callable, List, Optional, Tuple
+
+import database
+from database import read_db, write_db
+from writer import EventRow, commit_events, insert_events
+from eventlog import SegmentLog, log_dir
+from blobs import expand_json
+from archive import archived_ids
+
+# Storage engines behind the group committer (writer.py). Every read is served from the
+# SQLite ledger file either way; LEDGER_STORAGE picks what a write commits to:
+# - sqlite (default): events and their projection are inserted into ledger.db in the
+#   transaction that acknowledges them.
+# - log: events are appended to a CRC-framed segmented log (eventlog.py) and acknowledged
+#   once the append is durable. ledger.db becomes an index of the log: an indexer task
+#   inserts and projects what was appended, up to LEDGER_LOG_INDEX_BATCH events per
+#   transaction, and tracks its position as the 'eventlog' row of projection_state. GET
+#   requests wait until everything acknowledged before them is indexed (main.py), so
+#   responses are the same as with sqlite. Deleting ledger.db rebuilds it from the log on
+#   the next start.
+STORAGE = os.environ.get("LEDGER_STORAGE", "sqlite")
+LOG_INDEX_BATCH = int(os.environ.get("LEDGER_LOG_INDEX_BATCH", 5000))
+LOG_READ_WAIT_SECONDS = float(os.environ.get("LEDGER_LOG_READ_WAIT_SECONDS", 5))
+LOOKUP_CHUNK = 900
+
+_engines = {}
+_engines_lock = threading.Lock()
+
+class SqliteEngine:
+    name = "sqlite"
+
+    def __init__(self, path):
+        self.path = path
+
+    def start(self, on_commit: Callable[[int], None]):
+        pass
+
+    async def stop(self):
+        pass
+
+    def commit(self, batches: List[List[EventRow]]) -> Tuple[List[List[dict]], Optional[int]]:
+        return commit_events(batches, self.path)
+
+    def sync(self):
+        database.sync_wal(self.path)
+
+    async def wait_indexed(self, timeout: float) -> bool:
+        return True
+
+    def stats(self) -> dict:
+        return {"engine": self.name}
+
+class LogEngine:
+    name = "log"
+
+    def __init__(self, path):
+        self.path = path
+        self.log = SegmentLog(log_dir(path))
+        self.next_id = 1
+        self.appended_id = 0
+        self.indexed_id = 0
+        self.index_commits = 0
+        self.last_error = None
+        self._pending = deque()  # appended, not yet indexed rows, in id order
+        self._unindexed = set()  # their event_ids
+        self._lock = threading.Lock()
+        self._loop = None
+        self._task = None
+        self._wakeup = None
+        self._indexed = None
+        self._stopping = False
+        self._opened = False
+
+    def open(self) -> int:
+        # Recovery, before the first write: index what the log has beyond the checkpoint,
+        # then take into the log any events that only ledger.db has (a ledger that ran with
+        # LEDGER_STORAGE=sqlite, ingest_jsonl.py imports). Returns the events indexed.
+        self.log.open()
+        self._opened = True
+        with write_db(self.path) as conn:
+            # The log is the durable copy; the index can lose its last commits to an OS
+            # crash and replays them from the log.
+            conn.execute("PRAGMA synchronous=NORMAL")
+            row = conn.execute("SELECT last_event_id FROM projection_state WHERE name = 'eventlog'").fetchone()
+            checkpoint = row[0] if row else 0
+        replayed = 0
+        rows = self.log.iter_from(checkpoint)
+        while True:
+            chunk = [tuple(row) for row in itertools.islice(rows, LOG_INDEX_BATCH)]
+            if not chunk:
+                break
+            self._index(chunk)
+            replayed += len(chunk)
+        if replayed:
+            print(f"Event log: indexed {replayed} events after checkpoint {checkpoint}.")
+        adopted = self._adopt()
+        if adopted:
+            print(f"Event log: appended {adopted} events found only in {self.path}.")
+        with read_db(self.path) as conn:
+            seq = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'events'").fetchone()
+        # AUTOINCREMENT semantics: never reuse an id, even of a deleted (trimmed) event.
+        self.appended_id = self.indexed_id = self.log.last_id
+        self.next_id = max(self.log.last_id, seq[0] if seq else 0) + 1
+        return replayed
+
+    def _adopt(self) -> int:
+        adopted = 0
+        while True:
+            with read_db(self.path) as conn:
+                rows = conn.execute("""
+                SELECT id, event_id, ts, run_id, order_id, event_type, payload FROM events
+                WHERE id > ? ORDER BY id LIMIT ?
+                """, (self.log.last_id, LOG_INDEX_BATCH)).fetchall()
+                # The log keeps payloads whole; blob references are resolved.
+                rows = [tuple(row[:6]) + (expand_json([conn], row["payload"], {"*"}),) for row in rows]
+            if not rows:
+                break
+            self.log.append(rows)
+            self.log.sync()
+            with write_db(self.path) as conn:
+                self._set_checkpoint(conn, rows[-1][0])
+            adopted += len(rows)
+        return adopted
+
+    @staticmethod
+    def _set_checkpoint(conn, last_id: int):
+        conn.execute("""
+        INSERT OR REPLACE INTO projection_state (name, version, last_event_id, updated_at)
+        VALUES ('eventlog', 1, ?, ?)
+        """, (last_id, datetime.now(timezone.utc).isoformat()))
+
+    def start(self, on_commit: Callable[[int], None]):
+        if self.open():
+            on_commit(self.indexed_id)
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._indexed = asyncio.Condition()
+        self._stopping = False
+        self._task = asyncio.create_task(self._run(on_commit))
+
+    async def stop(self):
+        # Drain: whatever was acknowledged is indexed before shutdown.
+        if self._task is None:
+            return
+        self._stopping = True
+        self._wakeup.set()
+        await self._task
+        self._task = None
+        self.log.close()
+        self._opened = False
+
+    def _known(self, event_ids: List[str]) -> set:
+        # event_ids already appended: still waiting for the indexer, or in the index.
+        known = self._unindexed.intersection(event_ids)
+        rest = [e for e in event_ids if e not in known]
+        with read_db(self.path) as conn:
+            known.update(archived_ids(conn, rest))
+            for i in range(0, len(rest), LOOKUP_CHUNK):
+                chunk = rest[i:i + LOOKUP_CHUNK]
+                known.update(row[0] for row in conn.execute(
+                    f"SELECT event_id FROM events WHERE event_id IN ({', '.join('?' * len(chunk))})", chunk))
+        return known
+
+    def commit(self, batches: List[List[EventRow]]) -> Tuple[List[List[dict]], Optional[int]]:
+        # Same results as writer.commit_events(); the returned id is only set when the
+        # events are already indexed (no indexer task running: inline use).
+        if not self._opened:
+            self.open()
+        results = []
+        appended = []
+        with self._lock:
+            known = self._known([row[1] for rows in batches for row in rows])
+            for rows in batches:
+                out = []
+                for row in rows:
+                    event_id = row[1]
+                    if event_id in known:
+                        out.append({"status": "exists", "event_id": event_id})
+                        continue
+                    known.add(event_id)
+                    appended.append((self.next_id,) + tuple(row[1:]))
+                    self.next_id += 1
+                    out.append({"status": "created", "event_id": event_id})
+                results.append(out)
+            if appended:
+                self.log.append(appended)
+                if database.DURABILITY == "batch":
+                    self.log.sync()
+                self._pending.extend(appended)
+                self._unindexed.update(row[1] for row in appended)
+                self.appended_id = appended[-1][0]
+        if not appended:
+            return results, None
+        if self._task is None:
+            return results, self.index_pending()
+        self._loop.call_soon_threadsafe(self._wakeup.set)
+        return results, None
+
+    def _index(self, rows: List[EventRow]):
+        with write_db(self.path) as conn:
+            insert_events(conn, [rows])
+            self._set_checkpoint(conn, rows[-1][0])
+        self.index_commits += 1
+        self.indexed_id = rows[-1][0]
+
+    def index_pending(self) -> int:
+        # Moves up to LOG_INDEX_BATCH appended events into ledger.db in one transaction.
+        with self._lock:
+            rows = list(itertools.islice(self._pending, LOG_INDEX_BATCH))
+        if rows:
+            self._index(rows)
+            with self._lock:
+                for _ in rows:
+                    self._pending.popleft()
+                self._unindexed.difference_update(row[1] for row in rows)
+        return self.indexed_id
+
+    async def _run(self, on_commit: Callable[[int], None]):
+        while True:
+            if not self._pending:
+                if self._stopping:
+                    return
+                await self._wakeup.wait()
+                self._wakeup.clear()
+                continue
+            try:
+                last_id = await asyncio.to_thread(self.index_pending)
+            except Exception as e:
+                # The events are safe in the log; retry (or replay them on the next start).
+                self.last_error = f"{type(e).__name__}: {e}"
+                print(f"Event log indexing failed: {self.last_error}")
+                if self._stopping:
+                    return
+                await asyncio.sleep(1)
+                continue
+            self.last_error = None
+            on_commit(last_id)
+            async with self._indexed:
+                self._indexed.notify_all()
+
+    def sync(self):
+        with self._lock:
+            self.log.sync()
+
+    async def wait_indexed(self, timeout: float) -> bool:
+        # Read-your-writes: True once every event acknowledged so far is in the index.
+        target = self.appended_id
+        if self.indexed_id >= target or self._indexed is None:
+            return True
+        try:
+            async with self._indexed:
+                await asyncio.wait_for(self._indexed.wait_for(lambda: self.indexed_id >= target), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def stats(self) -> dict:
+        return {"engine": self.name, "appended_id": self.appended_id, "indexed_id": self.indexed_id,
+                "index_lag_events": self.appended_id - self.indexed_id, "index_commits": self.index_commits,
+                "last_error": self.last_error, "log": self.log.stats()}
+
+ENGINES = {"sqlite": SqliteEngine, "log": LogEngine}
+
+def engine(path=None):
+    # One engine per ledger file, created on first use.
+    if STORAGE not in ENGINES:
+        raise ValueError(f"LEDGER_STORAGE must be 'sqlite' or 'log', not {STORAGE!r}")
+    key = database._key(path)
+    with _engines_lock:
+        if key not in _engines:
+            _engines[key] = ENGINES[STORAGE](key)
+        return _engines[key]
+
+async def wait_indexed(timeout: float = LOG_READ_WAIT_SECONDS) -> bool:
+    for e in list(_engines.values()):
+        if not await e.wait_indexed(timeout):
+            return False
+    return True
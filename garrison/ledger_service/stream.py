@@ -0,0 +1,77 @@
+import asyncio
+import os
+from typing import Any, Dict, List, Optional, Tuple
+
+from responses import dumps
+
+# Push side of the ledger: writers publish the highest committed event id, subscribers
+# (GET /events/stream) wait on it instead of polling the database on a fixed interval.
+HEARTBEAT_SECONDS = float(os.environ.get("LEDGER_STREAM_HEARTBEAT_SECONDS", 15))
+MAX_LONGPOLL_SECONDS = float(os.environ.get("LEDGER_STREAM_MAX_LONGPOLL_SECONDS", 60))
+
+class CommitNotifier:
+    def __init__(self):
+        self.last_id = 0
+        self._loop = None
+        self._waiters = set()
+
+    def start(self, last_id: int):
+        self._loop = asyncio.get_running_loop()
+        self.last_id = last_id
+
+    def publish(self, last_id: Optional[int]):
+        # Safe to call from any thread, after the commit that made last_id visible.
+        if last_id is None or self._loop is None:
+            return
+        self._loop.call_soon_threadsafe(self._publish, last_id)
+
+    def _publish(self, last_id: int):
+        if last_id <= self.last_id:
+            return
+        self.last_id = last_id
+        waiters, self._waiters = self._waiters, set()
+        for fut in waiters:
+            if not fut.done():
+                fut.set_result(last_id)
+
+    async def wait(self, seen_id: int, timeout: float) -> bool:
+        # Returns True as soon as something newer than seen_id was committed, False on timeout.
+        if self.last_id > seen_id:
+            return True
+        fut = asyncio.get_running_loop().create_future()
+        self._waiters.add(fut)
+        try:
+            await asyncio.wait_for(fut, timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            self._waiters.discard(fut)
+
+notifier = CommitNotifier()
+
+def build_event_filters(run_id: Optional[str] = None, order_id: Optional[str] = None,
+                        event_type: Optional[str] = None, theater: Optional[str] = None,
+                        status: Optional[str] = None) -> Tuple[str, List[Any]]:
+    clauses = ""
+    params = []
+    if run_id:
+        clauses += " AND run_id = ?"
+        params.append(run_id)
+    if order_id:
+        clauses += " AND order_id = ?"
+        params.append(order_id)
+    if event_type:
+        clauses += " AND event_type = ?"
+        params.append(event_type)
+    if theater:
+        # Generated columns (migration 5), indexed with id
+        clauses += " AND theater = ?"
+        params.append(theater)
+    if status:
+        clauses += " AND status = ?"
+        params.append(status)
+    return clauses, params
+
+def format_sse(row: Dict[str, Any]) -> str:
+    return f"id: {row['id']}\nevent: {row['event_type']}\ndata: {dumps(row).decode()}\n\n"
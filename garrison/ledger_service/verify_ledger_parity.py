@@ -1,15 +1,25 @@
+import argparse
 import json
-import sqlite3
+import sys
+import time
 from pathlib import Path
+from typing import Dict, List, Tuple
+
+import requests
+
+import database
+from database import read_db, replay_entities
+from digests import DigestTree, ORDER_COLUMNS, RUN_COLUMNS, diff_runs, replay_tree, snapshot_tree
 
 # Configuration
 BASELINE_PATH = Path("/tmp/co_list_baseline.json")
-DB_PATH = Path(__file__).parent / "ledger.db"
+MAX_REPORTED_RUNS = 20
 
-def get_db():
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    return conn
+# Three checks:
+# - baseline (default): snapshots against a co_list.py export (status and worktree)
+# - compare A B: two ledgers (files or service URLs), every snapshot field, via the Merkle
+#   digests of digests.py; only the subtrees that differ are fetched
+# - replay [DB]: the projected snapshots against a full replay of the same events
 
 def verify():
     if not BASELINE_PATH.exists():
@@ -19,7 +29,7 @@ def verify():
     with BASELINE_PATH.open("r", encoding="utf-8") as f:
         baseline = json.load(f)
 
-    with get_db() as conn:
+    with read_db() as conn:
         runs = conn.execute("SELECT * FROM runs_snapshot").fetchall()
         orders = conn.execute("SELECT * FROM orders_snapshot").fetchall()
 
@@ -68,5 +78,176 @@ def verify():
     else:
         print(f"VERIFICATION FAILED: {mismatches} mismatches found.")
 
+class LocalLedger:
+    # A ledger file, read in one transaction (tree and rows match).
+    def __init__(self, path: Path):
+        self.name = str(path)
+        self.conn = database._connect(readonly=True, path=path)
+        self.conn.execute("BEGIN")
+        self.last_event_id = database.get_projection_state(self.conn)[1]
+        self.tree = snapshot_tree(self.conn)
+
+    def node(self, prefix: str) -> dict:
+        return self.tree.node(prefix)
+
+    def close(self):
+        # Ends the read transaction, which would otherwise hold back WAL checkpoints.
+        self.conn.close()
+
+    def entry(self, run_id: str) -> dict:
+        return self.tree.entry(run_id)
+
+    def rows(self, run_id: str) -> Dict[Tuple[str, str], dict]:
+        out = {}
+        run = self.conn.execute(f"SELECT {', '.join(RUN_COLUMNS)} FROM runs_snapshot WHERE run_id = ?", (run_id,)).fetchone()
+        if run:
+            out[("run", run_id)] = dict(run)
+        for order in self.conn.execute(f"SELECT {', '.join(ORDER_COLUMNS)} FROM orders_snapshot WHERE run_id = ?", (run_id,)):
+            out[("order", order["order_id"])] = dict(order)
+        return out
+
+class RemoteLedger:
+    # A running ledger service: GET /digests, one request per visited node.
+    def __init__(self, url: str):
+        self.name = url.rstrip("/")
+        self.session = requests.Session()
+        self.requests = 0
+        self.last_event_id = self.node("")["last_event_id"]
+
+    def close(self):
+        self.session.close()
+
+    def _get(self, path: str, **params):
+        self.requests += 1
+        resp = self.session.get(f"{self.name}{path}", params=params, timeout=60)
+        resp.raise_for_status()
+        return resp.json()
+
+    def node(self, prefix: str) -> dict:
+        return self._get("/digests", prefix=prefix)
+
+    def entry(self, run_id: str) -> dict:
+        return self._get(f"/digests/runs/{requests.utils.quote(run_id, safe='')}")
+
+    def rows(self, run_id: str) -> Dict[Tuple[str, str], dict]:
+        out = {}
+        resp = self.session.get(f"{self.name}/runs/{requests.utils.quote(run_id, safe='')}", timeout=60)
+        if resp.ok:
+            run = resp.json()
+            run["order_ids"] = json.dumps(run["order_ids"])
+            out[("run", run_id)] = {k: run.get(k) for k in RUN_COLUMNS}
+        for order in self._get("/orders", run_id=run_id):
+            order["extra"] = json.dumps(order["extra"])
+            out[("order", order["order_id"])] = {k: order.get(k) for k in ORDER_COLUMNS}
+        return out
+
+class ReplayedLedger:
+    # Full replay of a ledger file's events, as of its projection checkpoint.
+    def __init__(self, path: Path, tree: DigestTree, last_event_id: int):
+        self.name = f"replay of {path}"
+        self.path = path
+        self.tree = tree
+        self.last_event_id = last_event_id
+
+    def node(self, prefix: str) -> dict:
+        return self.tree.node(prefix)
+
+    def entry(self, run_id: str) -> dict:
+        return self.tree.entry(run_id)
+
+    def rows_for(self, run_ids: List[str]) -> Dict[str, Dict[Tuple[str, str], dict]]:
+        # Second replay pass, keeping only the rows of the runs that differ.
+        wanted = set(run_ids)
+        out = {run_id: {} for run_id in run_ids}
+        reader = database._connect(readonly=True, path=self.path)
+        try:
+            for kind, row in replay_entities(reader, str(self.path), 0, 1, self.last_event_id or 0):
+                columns = RUN_COLUMNS if kind == "run" else ORDER_COLUMNS
+                run_id = row[0] if kind == "run" else (row[1] or "-")
+                if run_id in wanted:
+                    out[run_id][(kind, row[0])] = dict(zip(columns, row))
+        finally:
+            reader.close()
+        return out
+
+def open_ledger(spec: str):
+    return RemoteLedger(spec) if spec.startswith(("http://", "https://")) else LocalLedger(Path(spec))
+
+def report(a, b, run_ids: List[str], rows_a, rows_b) -> int:
+    # Field-level differences of the first MAX_REPORTED_RUNS differing runs.
+    for run_id in run_ids[:MAX_REPORTED_RUNS]:
+        ea, eb = a.entry(run_id), b.entry(run_id)
+        ra, rb = rows_a(run_id), rows_b(run_id)
+        print(f"RUN {run_id}:")
+        for key in sorted(set(ra) | set(rb)):
+            kind, entity_id = key
+            digest_a = ea["run"] if kind == "run" else ea["orders"].get(entity_id)
+            digest_b = eb["run"] if kind == "run" else eb["orders"].get(entity_id)
+            if digest_a == digest_b:
+                continue
+            if key not in ra or key not in rb:
+                print(f"  {kind} {entity_id}: only in {a.name if key in ra else b.name}")
+                continue
+            for field in ra[key]:
+                if ra[key][field] != rb[key].get(field):
+                    print(f"  {kind} {entity_id}.{field}: {ra[key][field]!r} != {rb[key].get(field)!r}")
+    if len(run_ids) > MAX_REPORTED_RUNS:
+        print(f"... and {len(run_ids) - MAX_REPORTED_RUNS} more runs")
+    return len(run_ids)
+
+def compare(spec_a: str, spec_b: str) -> int:
+    t = time.perf_counter()
+    a, b = open_ledger(spec_a), open_ledger(spec_b)
+    try:
+        if a.last_event_id != b.last_event_id:
+            print(f"NOTE: checkpoints differ ({a.name}: {a.last_event_id}, {b.name}: {b.last_event_id}); "
+                  "runs with newer events will show up as differences")
+        run_ids = diff_runs(a, b)
+        fetched = sum(getattr(x, "requests", 0) for x in (a, b))
+        print(f"Compared {a.name} and {b.name} in {time.perf_counter() - t:.2f}s"
+              + (f" ({fetched} digest requests)" if fetched else ""))
+        return report(a, b, run_ids, a.rows, b.rows)
+    finally:
+        a.close()
+        b.close()
+
+def verify_replay(path: Path) -> int:
+    t = time.perf_counter()
+    snapshots, replayed, last_id = replay_tree(path)
+    projected = ReplayedLedger(path, snapshots, last_id)
+    projected.name = f"projection of {path}"
+    replay = ReplayedLedger(path, replayed, last_id)
+    run_ids = diff_runs(projected, replay)
+    print(f"Replayed {path} up to event {last_id} in {time.perf_counter() - t:.2f}s")
+    if not run_ids:
+        return 0
+    local = LocalLedger(path)
+    try:
+        replayed_rows = replay.rows_for(run_ids[:MAX_REPORTED_RUNS])
+        return report(projected, replay, run_ids, local.rows, lambda run_id: replayed_rows.get(run_id, {}))
+    finally:
+        local.close()
+
 if __name__ == "__main__":
-    verify()
+    parser = argparse.ArgumentParser(description="Check ledger snapshots for parity")
+    sub = parser.add_subparsers(dest="command")
+    sub.add_parser("baseline", help=f"Compare with the co_list.py export at {BASELINE_PATH} (default)")
+    p = sub.add_parser("compare", help="Compare two ledgers by Merkle digests")
+    p.add_argument("a", help="Ledger file or service base URL")
+    p.add_argument("b", help="Ledger file or service base URL")
+    p.add_argument("--interval", type=float, help="Repeat every N seconds")
+    p = sub.add_parser("replay", help="Compare the projection with a full replay of the events")
+    p.add_argument("db", nargs="?", type=Path, default=database.DB_PATH)
+    args = parser.parse_args()
+    if args.command in (None, "baseline"):
+        verify()
+        sys.exit(0)
+    while True:
+        mismatches = compare(args.a, args.b) if args.command == "compare" else verify_replay(args.db)
+        if mismatches == 0:
+            print("VERIFICATION SUCCESS: digests match.")
+        else:
+            print(f"VERIFICATION FAILED: {mismatches} runs differ.")
+        if args.command != "compare" or not args.interval:
+            sys.exit(1 if mismatches else 0)
+        time.sleep(args.interval)
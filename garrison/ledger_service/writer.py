@@ -0,0 +1,186 @@
+import asyncio
+import os
+from typing import Callable, List, Optional, Tuple
+
+import database
+from database import write_db, project_pending
+from blobs import externalize
+from archive import archived_ids
+
+# Group commit for POST /events and /events/batch. Requests hand their rows to a single
+# writer task, which folds everything queued (up to GROUP_COMMIT_MAX_EVENTS events, waiting
+# at most GROUP_COMMIT_WAIT_MS for more) into one transaction: one projection pass, one
+# commit, one fsync. Each request is resolved once that commit is durable, according to
+# database.DURABILITY. What a commit writes is up to the storage engine (storage.py).
+GROUP_COMMIT_MAX_EVENTS = int(os.environ.get("LEDGER_GROUP_COMMIT_MAX_EVENTS", 500))
+GROUP_COMMIT_WAIT_MS = float(os.environ.get("LEDGER_GROUP_COMMIT_WAIT_MS", 2))
+
+# (id, event_id, ts, run_id, order_id, event_type, payload JSON). id is None unless the
+# shard router assigns ledger-wide ids (see shards.py).
+EventRow = Tuple[Optional[int], str, str, Optional[str], Optional[str], str, str]
+
+def insert_events(conn, batches: List[List[EventRow]]) -> Tuple[List[List[dict]], Optional[int]]:
+    # Inserts and projects the batches inside the caller's transaction. Events are
+    # deduplicated by event_id, against the ledger and across the group (first occurrence
+    # wins). Returns per-batch results and the id of the last inserted event.
+    results = []
+    # Archived events are no longer in `events`; they still count as in the ledger.
+    seen = archived_ids(conn, [row[1] for rows in batches for row in rows])
+    last_id = None
+    for rows in batches:
+        out = []
+        for row in rows:
+            event_id = row[1]
+            if event_id in seen:
+                out.append({"status": "exists", "event_id": event_id})
+                continue
+            seen.add(event_id)
+            # Large payload fields go to the blob store (blobs.py), same transaction.
+            row = row[:6] + (externalize(conn, row[6]),)
+            # Only an event_id conflict is a duplicate; an id conflict is an error.
+            cur = conn.execute("""
+            INSERT INTO events (id, event_id, ts, run_id, order_id, event_type, payload)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (event_id) DO NOTHING
+            """, row)
+            if cur.rowcount == 0:
+                # Idempotency: already in the ledger
+                out.append({"status": "exists", "event_id": event_id})
+                continue
+            out.append({"status": "created", "event_id": event_id})
+            last_id = cur.lastrowid
+        results.append(out)
+    if last_id is not None:
+        # Project only the new events onto their run/order rows; committed together
+        # with the inserts.
+        project_pending(conn)
+    return results, last_id
+
+def commit_events(batches: List[List[EventRow]], path=None) -> Tuple[List[List[dict]], Optional[int]]:
+    # One transaction for all batches (see insert_events).
+    with write_db(path) as conn:
+        return insert_events(conn, batches)
+
+class GroupCommitter:
+    def __init__(self, path, engine):
+        self.path = path
+        self.engine = engine
+        self.commits = 0
+        self.events = 0
+        self.largest_group = 0
+        self._queue = None
+        self._task = None
+        self._syncer = None
+        self._on_commit = None
+        self._unsynced = False
+
+    def start(self, on_commit: Callable[[int], None]):
+        if database.DURABILITY not in {"batch", "async"}:
+            raise ValueError(f"LEDGER_DURABILITY must be 'batch' or 'async', not {database.DURABILITY!r}")
+        self._on_commit = on_commit
+        self.engine.start(on_commit)
+        self._queue = asyncio.Queue()
+        self._task = asyncio.create_task(self._run())
+        if database.DURABILITY == "async":
+            self._syncer = asyncio.create_task(self._sync_loop())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        # Drain: everything queued before shutdown is still committed.
+        await self._queue.put(None)
+        await self._task
+        if self._syncer:
+            self._syncer.cancel()
+            await asyncio.to_thread(self.engine.sync)
+        await self.engine.stop()
+        self._task = self._syncer = self._queue = None
+
+    async def submit(self, rows: List[EventRow]) -> List[dict]:
+        if self._queue is None:
+            # Not started (e.g. app used without its startup hook): commit inline.
+            results, last_id = self.engine.commit([rows])
+            if last_id is not None and self._on_commit:
+                self._on_commit(last_id)
+            return results[0]
+        return await self.enqueue(rows)
+
+    def enqueue(self, rows: List[EventRow]) -> asyncio.Future:
+        # Synchronous, so callers can queue on several committers in a fixed order
+        # (shards.py relies on this for id order).
+        fut = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((rows, fut))
+        return fut
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            item = await self._queue.get()
+            if item is None:
+                break
+            group = [item]
+            size = len(item[0])
+            deadline = loop.time() + GROUP_COMMIT_WAIT_MS / 1000
+            while size < GROUP_COMMIT_MAX_EVENTS:
+                try:
+                    item = self._queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    remaining = deadline - loop.time()
+                    if remaining <= 0:
+                        break
+                    try:
+                        item = await asyncio.wait_for(self._queue.get(), remaining)
+                    except asyncio.TimeoutError:
+                        break
+                if item is None:
+                    stopping = True
+                    break
+                group.append(item)
+                size += len(item[0])
+            await self._commit(group)
+
+    async def _commit(self, group):
+        try:
+            results, last_id = await asyncio.to_thread(self.engine.commit, [rows for rows, _ in group])
+        except Exception as e:
+            if len(group) == 1:
+                self._resolve(group[0][1], exc=e)
+                return
+            # Retry one request per transaction so a failure only affects its own request.
+            for item in group:
+                await self._commit([item])
+            return
+        self.commits += 1
+        self.events += sum(len(rows) for rows, _ in group)
+        self.largest_group = max(self.largest_group, len(group))
+        if any(r["status"] == "created" for out in results for r in out):
+            self._unsynced = True
+        if last_id is not None:
+            # Visible to readers now (a deferred engine publishes once it has indexed).
+            self._on_commit(last_id)
+        for (_, fut), out in zip(group, results):
+            self._resolve(fut, out)
+
+    @staticmethod
+    def _resolve(fut, result=None, exc=None):
+        if fut.done():
+            return # client went away
+        if exc is not None:
+            fut.set_exception(exc)
+        else:
+            fut.set_result(result)
+
+    async def _sync_loop(self):
+        # async durability: commits are acknowledged before they are fsynced; this bounds
+        # the loss window to SYNC_INTERVAL_MS.
+        while True:
+            await asyncio.sleep(database.SYNC_INTERVAL_MS / 1000)
+            if self._unsynced:
+                self._unsynced = False
+                await asyncio.to_thread(self.engine.sync)
+
+    def stats(self) -> dict:
+        return {"durability": database.DURABILITY, "commits": self.commits, "events": self.events,
+                "largest_group": self.largest_group, "queued": self._queue.qsize() if self._queue else 0,
+                "storage": self.engine.stats()}
@@ -7,6 +7,14 @@ from typing import Dict, List, Any
 import requests
 from datetime import datetime, timezone
 
+# Ledger caps repeated id filters at 1000 per request
+ORPHAN_BATCH_SIZE = 200
+ORDERS_CACHE_SIZE = 64
+# Completion events read per request, and requests per poll (a fresh observer works
+# through the existing history over several polls)
+COMPLETED_PAGE_SIZE = 500
+COMPLETED_PAGES_PER_POLL = 20
+
 class IronClawMonitor:
     def __init__(self, config: Dict[str, Any], signals: Any):
         self.config = config
@@ -23,67 +31,72 @@ class IronClawMonitor:
             "integrity_failures": 0,
             "alerts_emitted": 0
         }
+        # Completed orders are integrity-checked once, in ledger event id order: the cursor
+        # is the id of the last `status=completed` event seen. Ids only grow with commit
+        # order, unlike producer timestamps, so no completion is skipped; starting at 0
+        # covers orders completed before the observer started.
+        self.completed_after_id = 0
+        # Last (ETag, result) per GET /orders query
+        self.orders_cache = {}
 
     def poll(self):
         print(f"Observer polling theater: {self.theater}")
         self.stats["last_poll"] = time.time()
         
-        # 1. Fetch active snapshots from Ledger
+        # 1. Check running/completed orders against the Ledger snapshots
         try:
-            # We assume Ledger has /orders for a theater or we iterate
-            # For MVP, we'll fetch all orders and filter by theater and status
-            resp = requests.get(f"{self.ledger_url}/events", timeout=10)
-            resp.raise_for_status()
-            events = resp.json()
-            # Derive latest snapshots (simplified internal logic or fetch from snapshots table if API exists)
-            # CO uses /orders/{order_id} but doesn't have a bulk list.
-            # Let's assume we fetch all events and group them to find currently 'running' orders.
-            self.check_stalls_and_integrity(events)
+            self.check_stalls_and_integrity()
         except Exception as e:
             print(f"Monitor failed to reach Ledger: {e}")
 
         # 2. Check Orphans
         self.check_orphans()
 
-    def check_stalls_and_integrity(self, events: List[Dict[str, Any]]):
-        if not isinstance(events, list):
-            print(f"Monitor expected list of events, got {type(events)}")
-            return
+    def fetch_orders(self, **params) -> List[Dict[str, Any]]:
+        # Conditional GET: while nothing changed in the Ledger it answers 304 and the last
+        # result for the same query is reused.
+        key = json.dumps(params, sort_keys=True)
+        cached = self.orders_cache.get(key)
+        headers = {"If-None-Match": cached[0]} if cached else {}
+        resp = requests.get(f"{self.ledger_url}/orders", params=params, headers=headers, timeout=10)
+        if resp.status_code == 304 and cached:
+            return cached[1]
+        resp.raise_for_status()
+        orders = resp.json()
+        if resp.headers.get("ETag"):
+            if len(self.orders_cache) >= ORDERS_CACHE_SIZE:
+                # updated_since/order_id queries change over time; drop the old ones
+                self.orders_cache.clear()
+            self.orders_cache[key] = (resp.headers["ETag"], orders)
+        return orders
 
-        # Group events by order_id
-        orders = {}
-        for ev in events:
-            if not isinstance(ev, dict): continue
-            oid = ev.get("order_id")
-            if not oid: continue
-            if oid not in orders: orders[oid] = []
-            orders[oid].append(ev)
+    def in_theater(self, order: Dict[str, Any]) -> bool:
+        return (order.get("theater") or self.theater) == self.theater # Fallback
 
-        active_count = 0
-        for oid, evs in orders.items():
-            # Get latest status for this order
-            evs.sort(key=lambda x: x["id"]) 
-            latest = evs[-1]
-            # Payload is stored as a JSON string in Ledger
-            payload = latest.get("payload", {})
-            if isinstance(payload, str):
-                try:
-                    payload = json.loads(payload)
-                except:
-                    payload = {}
-            
-            status = payload.get("status")
-            theater = payload.get("theater") or self.theater # Fallback
-            
-            if theater != self.theater: continue
-
-            if status == "running":
-                active_count += 1
-                self.verify_stall(oid, latest, evs, payload)
-            elif status == "completed":
-                self.verify_integrity(oid, latest, payload)
+    def check_stalls_and_integrity(self):
+        # Stalls are the absence of progress, so every running order is re-checked each
+        # poll. The snapshot's ts is the time of the order's last status change; our own
+        # observer.* alerts don't move it.
+        running = [o for o in self.fetch_orders(status="running") if self.in_theater(o)]
+        for order in running:
+            self.verify_stall(order["order_id"], order, [order], order)
+        self.stats["active_runs"] = len(running)
 
-        self.stats["active_runs"] = active_count
+        for _ in range(COMPLETED_PAGES_PER_POLL):
+            resp = requests.get(f"{self.ledger_url}/events/stream", timeout=10, params={
+                "mode": "poll", "status": "completed", "after_id": self.completed_after_id,
+                "timeout": 0, "limit": COMPLETED_PAGE_SIZE})
+            resp.raise_for_status()
+            events = resp.json()
+            order_ids = sorted({ev["order_id"] for ev in events if ev.get("order_id")})
+            # Checked against the current snapshot: an order that moved on is skipped.
+            for i in range(0, len(order_ids), ORPHAN_BATCH_SIZE):
+                for order in self.fetch_orders(status="completed", order_id=order_ids[i:i + ORPHAN_BATCH_SIZE]):
+                    if self.in_theater(order):
+                        self.verify_integrity(order["order_id"], order, order)
+            self.completed_after_id = int(resp.headers.get("X-Last-Event-Id", self.completed_after_id))
+            if len(events) < COMPLETED_PAGE_SIZE:
+                break
 
     def verify_stall(self, order_id: str, latest_ev: Dict[str, Any], all_evs: List[Dict[str, Any]], payload: Dict[str, Any]):
         # 1. Stall by lack of event progress
@@ -104,7 +117,7 @@ class IronClawMonitor:
     def verify_integrity(self, order_id: str, latest_ev: Dict[str, Any], payload: Dict[str, Any]):
         # Integrity Gate: Check worktree and artifacts
         worktree = payload.get("worktree")
-        if not worktree:
+        if not worktree or worktree == "-":
             return 
 
         wt_path = Path(worktree)
@@ -146,22 +159,19 @@ class IronClawMonitor:
             # Get list of existing worktree dirs
             dirs = [d.name for d in wt_root.iterdir() if d.is_dir()]
             
-            # For each dir, check Ledger for active status
-            for order_id in dirs:
-                # In MVP, we fetch single order snapshot from Ledger
+            # One bulk snapshot lookup per batch of dirs instead of one request per dir
+            for i in range(0, len(dirs), ORPHAN_BATCH_SIZE):
+                batch = dirs[i:i + ORPHAN_BATCH_SIZE]
                 try:
-                    resp = requests.get(f"{self.ledger_url}/orders/{order_id}", timeout=5)
-                    if resp.status_code == 404:
+                    known = {o["order_id"] for o in self.fetch_orders(order_id=batch)}
+                except Exception as e:
+                    print(f"Orphan lookup failed: {e}")
+                    continue
+                for order_id in batch:
+                    if order_id not in known:
                         self.emit_orphan(order_id, str(wt_root / order_id), "Order ID not found in Ledger")
-                    elif resp.status_code == 200:
-                        snapshot = resp.json()
-                        status = snapshot.get("status")
-                        if status in {"completed", "failed"}:
-                            # If it's terminal and old, it's a candidate for cleanup if CO didn't do it
-                            # OR if keep_worktree was true. Observer only alerts.
-                            pass # Or implement ORPHAN_TTL_SECONDS
-                except:
-                    pass
+                    # Terminal orders whose worktree is kept are left alone: CO or
+                    # keep_worktree decides their cleanup, the Observer only alerts.
         except Exception as e:
             print(f"Orphan scan error: {e}")
 
@@ -223,7 +223,8 @@ class WorkerRunner:
                 "latency_ms": latency,
                 "attempt": attempt,
                 "artifact_paths": [f"outputs/model_output.{fingerprint}.json"],
-                "cache_hit": cache_hit
+                "cache_hit": cache_hit,
+                "usage": usage
             }
             self.emit_ledger_event(req_data, "completed", "worker.model_call.completed", completed_payload)
             
@@ -397,7 +398,8 @@ class WorkerRunner:
             completed_payload = {
                 **model_event_payload,
                 "response_hash": response_hash,
-                "latency_ms": latency
+                "latency_ms": latency,
+                "usage": usage
             }
             self.emit_ledger_event(req_data, "completed", "worker.model_call.completed", completed_payload)
 
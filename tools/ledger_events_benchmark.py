@@ -0,0 +1,95 @@
+import sys
+import json
+import time
+import tempfile
+import argparse
+from pathlib import Path
+
+# Micro-benchmark for the ledger read path: GET /events returning N rows, in-process via
+# TestClient against a throwaway database. Reports response bytes/sec for the current
+# encoder (orjson when installed, then stdlib) next to the previous dict +
+# jsonable_encoder path for reference.
+LEDGER_DIR = Path(__file__).resolve().parent.parent / "garrison" / "ledger_service"
+sys.path.insert(0, str(LEDGER_DIR))
+
+import database
+import responses
+from fastapi.encoders import jsonable_encoder
+from fastapi.testclient import TestClient
+
+def seed(client, rows: int):
+    batch = []
+    for i in range(rows):
+        batch.append({"event_id": f"bench-{i}", "run_id": f"run_{i % 20}", "order_id": f"order_{i % 500}",
+                      "event_type": "worker.progress",
+                      "payload": {"status": "running", "theater": "demo", "stage": "apply", "attempt": i % 3,
+                                  "message": "applied patch to src/module_%d.py" % (i % 97),
+                                  "files": [f"src/module_{i % 97}.py", "README.md"]}})
+        if len(batch) == 1000:
+            client.post("/events/batch", json={"events": batch}).raise_for_status()
+            batch = []
+    if batch:
+        client.post("/events/batch", json={"events": batch}).raise_for_status()
+
+def measure(fn, repeat: int):
+    best = None
+    size = 0
+    for _ in range(repeat):
+        t = time.perf_counter()
+        size = fn()
+        elapsed = time.perf_counter() - t
+        best = elapsed if best is None else min(best, elapsed)
+    return size, best
+
+def report(label: str, size: int, seconds: float):
+    print(f"{label:<28} {size / 1e6:7.2f} MB  {seconds * 1e3:8.1f} ms  {size / seconds / 1e6:8.1f} MB/s")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark GET /events serialization")
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    tmp = tempfile.TemporaryDirectory()
+    database.DB_PATH = Path(tmp.name) / "ledger.db"
+    import main as ledger
+
+    path = f"/events?after_id=0&limit={args.rows}"
+    try:
+        with TestClient(ledger.app) as client:
+            seed(client, args.rows)
+            print(f"GET {path} ({args.rows} rows, best of {args.repeat})")
+
+            def endpoint():
+                resp = client.get(path)
+                resp.raise_for_status()
+                return len(resp.content)
+
+            encoder = responses.orjson
+            if encoder is not None:
+                report("endpoint (orjson)", *measure(endpoint, args.repeat))
+            responses.orjson = None
+            try:
+                report("endpoint (stdlib json)", *measure(endpoint, args.repeat))
+            finally:
+                responses.orjson = encoder
+
+            # Encoding alone, on already fetched rows
+            with database.read_db() as conn:
+                rows = conn.execute("SELECT * FROM events WHERE id > 0 ORDER BY id ASC LIMIT ?", (args.rows,)).fetchall()
+
+            def spliced():
+                return len(responses.encode_rows(rows))
+
+            def legacy():
+                # What FastAPI did with `return [dict(row) for row in rows]`
+                return len(json.dumps(jsonable_encoder([dict(row) for row in rows])).encode())
+
+            report("encode only (encode_rows)", *measure(spliced, args.repeat))
+            report("encode only (legacy)", *measure(legacy, args.repeat))
+    finally:
+        database.close_db()
+        tmp.cleanup()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+import sys
+import os
+import tempfile
+from pathlib import Path
+
+# Runs the Ledger app in-process against a throwaway database, records every SELECT the
+# endpoints issue and fails if any of them needs a full table scan or a temp sort.
+LEDGER_DIR = Path(__file__).resolve().parent.parent / "garrison" / "ledger_service"
+sys.path.insert(0, str(LEDGER_DIR))
+os.environ["LEDGER_SEARCH"] = "1"
+# Checkpoint every event, so the as_of reads below start from one.
+os.environ["LEDGER_CHECKPOINT_EVENTS"] = "1"
+
+import database
+from fastapi.testclient import TestClient
+
+RUN_ID = "run_plan_test"
+ORDER_ID = "order_plan_test"
+
+# (method, path, json body) for every ledger endpoint that touches the database.
+CALLS = [
+    ("POST", "/events", {"event_id": "plan-1", "run_id": RUN_ID, "order_id": ORDER_ID, "event_type": "ORDER_STARTED",
+                         "payload": {"status": "running", "started_at": "2026-01-01T00:00:00+00:00"}}),
+    ("POST", "/events", {"event_id": "plan-1", "run_id": RUN_ID, "order_id": ORDER_ID, "event_type": "ORDER_STARTED",
+                         "payload": {"status": "running"}}),
+    ("POST", "/events/batch", {"events": [
+        {"event_id": "plan-2", "run_id": RUN_ID, "order_id": ORDER_ID, "event_type": "worker.started", "payload": {"status": "running"}},
+        {"event_id": "plan-3", "run_id": RUN_ID, "order_id": ORDER_ID, "event_type": "ORDER_COMPLETED", "payload": {"status": "completed"}},
+    ]}),
+    ("GET", "/events", None),
+    ("GET", f"/events?run_id={RUN_ID}", None),
+    ("GET", f"/events?order_id={ORDER_ID}", None),
+    ("GET", f"/events?run_id={RUN_ID}&order_id={ORDER_ID}", None),
+    ("GET", "/events?after_id=0&limit=2", None),
+    ("GET", "/events?before_id=100&limit=2", None),
+    ("GET", f"/events?run_id={RUN_ID}&after_id=1", None),
+    ("GET", f"/events?order_id={ORDER_ID}&before_id=100", None),
+    ("GET", "/events/stream?mode=poll&after_id=0", None),
+    ("GET", f"/events/stream?mode=poll&after_id=0&run_id={RUN_ID}&event_type=ORDER_COMPLETED", None),
+    ("GET", f"/events/stream?mode=poll&after_id=0&order_id={ORDER_ID}", None),
+    ("GET", "/events/stream?mode=poll&after_id=0&event_type=ORDER_COMPLETED", None),
+    ("GET", "/events/stream?mode=poll&after_id=0&theater=demo&timeout=0", None),
+    ("GET", "/events/stream?mode=poll&after_id=0&status=completed", None),
+    ("GET", "/runs", None),
+    ("GET", "/runs?status=running&status=completed", None),
+    ("GET", "/runs?theater=demo", None),
+    ("GET", f"/runs?run_id={RUN_ID}&run_id=other", None),
+    ("GET", "/runs?updated_since=2026-01-01T00:00:00", None),
+    ("GET", "/orders", None),
+    ("GET", "/orders?status=running", None),
+    ("GET", "/orders?theater=demo&status=completed", None),
+    ("GET", f"/orders?run_id={RUN_ID}", None),
+    ("GET", f"/orders?order_id={ORDER_ID}&order_id=other", None),
+    ("GET", "/orders?updated_since=2026-01-01T00:00:00", None),
+    ("GET", f"/runs/{RUN_ID}", None),
+    ("GET", f"/orders/{ORDER_ID}", None),
+    ("GET", f"/runs/{RUN_ID}?as_of=2", None),
+    ("GET", f"/orders/{ORDER_ID}?as_of=2100-01-01T00:00:00Z", None),
+    ("GET", "/events/search?q=running", None),
+    ("GET", f"/events/search?q=stage:apply&run_id={RUN_ID}&before_id=100&since=2026-01-01T00:00:00", None),
+    ("GET", "/metrics/rollups", None),
+    ("GET", "/metrics/rollups?granularity=minute&since=2026-01-01T00:00:00Z&combine=true", None),
+    ("POST", "/rebuild", None),
+]
+
+def bad_plan(sql: str, detail: str) -> bool:
+    # "SCAN t" is a full table scan; "SCAN t USING [COVERING] INDEX ..." walks an index in
+    # order (bounded by LIMIT on the listing endpoints) and is fine, as is an FTS5 lookup
+    # ("SCAN t VIRTUAL TABLE INDEX ...") and the single row of a SELECT without FROM
+    # ("SCAN CONSTANT ROW").
+    if (detail.startswith("SCAN ") and " USING " not in detail and " VIRTUAL TABLE INDEX " not in detail
+            and detail != "SCAN CONSTANT ROW"):
+        return True
+    # Sorting an index-filtered snapshot listing is fine; sorting events never is
+    # (the log is unbounded).
+    return "USE TEMP B-TREE" in detail and " FROM events" in sql
+
+def test_query_plans():
+    tmp = tempfile.TemporaryDirectory()
+    database.DB_PATH = Path(tmp.name) / "ledger.db"
+
+    statements = []
+    connect = database._connect
+    def traced_connect(*args, **kwargs):
+        conn = connect(*args, **kwargs)
+        conn.set_trace_callback(statements.append)
+        return conn
+    database._connect = traced_connect
+
+    failures = []
+    try:
+        import main
+        with TestClient(main.app) as client:
+            for method, path, body in CALLS:
+                resp = client.request(method, path, json=body)
+                assert resp.status_code < 400, f"{method} {path} returned {resp.status_code}: {resp.text}"
+
+        # FTS5 reads its own shadow tables ('main'.'events_fts_*') internally; those are not ours.
+        selects = sorted({s.strip() for s in statements
+                          if s.lstrip().upper().startswith("SELECT") and "'events_fts_" not in s})
+        print(f"Checking {len(selects)} distinct SELECT statements...")
+
+        conn = connect()
+        try:
+            for sql in selects:
+                plan = [row["detail"] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}")]
+                bad = [d for d in plan if bad_plan(sql, d)]
+                if bad:
+                    failures.append(f"TABLE SCAN: {' '.join(sql.split())}\n    {bad}")
+        finally:
+            conn.close()
+    finally:
+        database._connect = connect
+        database.close_db()
+        tmp.cleanup()
+
+    assert not failures, f"{len(failures)} statements scan a table:\n" + "\n".join(failures)
+    print("\nQUERY PLAN TEST SUCCESS")
+
+if __name__ == "__main__":
+    try:
+        test_query_plans()
+    except AssertionError as e:
+        print(f"\nQUERY PLAN TEST FAILED: {e}")
+        sys.exit(1)
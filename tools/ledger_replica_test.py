@@ -0,0 +1,94 @@
+import sys
+import os
+import time
+import socket
+import tempfile
+import subprocess
+from pathlib import Path
+
+import requests
+
+# Starts a primary ledger and a follower (LEDGER_FOLLOW_URL) as two local uvicorn processes
+# on throwaway databases, writes to the primary and checks that the follower catches up,
+# serves the same reads, reports its lag and refuses writes.
+LEDGER_DIR = Path(__file__).resolve().parent.parent / "garrison" / "ledger_service"
+EVENTS = 2000
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def start(db_path: Path, port: int, **env) -> subprocess.Popen:
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=LEDGER_DIR, env={**os.environ, "LEDGER_DB_PATH": str(db_path), **env},
+        stdout=subprocess.DEVNULL)
+    url = f"http://127.0.0.1:{port}"
+    for _ in range(100):
+        try:
+            if requests.get(f"{url}/health", timeout=1).ok:
+                return proc
+        except requests.ConnectionError:
+            time.sleep(0.1)
+    raise RuntimeError(f"ledger on port {port} did not start")
+
+def wait_for(follower: str, applied_id: int, timeout: float = 30) -> float:
+    t = time.perf_counter()
+    while time.perf_counter() - t < timeout:
+        if requests.get(f"{follower}/replication", timeout=5).json()["applied_id"] >= applied_id:
+            return time.perf_counter() - t
+        time.sleep(0.05)
+    raise RuntimeError(f"follower did not reach event {applied_id}")
+
+def test_replica():
+    tmp = tempfile.TemporaryDirectory()
+    primary_port, follower_port = free_port(), free_port()
+    primary = f"http://127.0.0.1:{primary_port}"
+    follower = f"http://127.0.0.1:{follower_port}"
+    procs = []
+    try:
+        procs.append(start(Path(tmp.name) / "primary.db", primary_port))
+        # Some history before the follower exists, some after.
+        batch = [{"event_id": f"rep-{i}", "run_id": f"run_{i % 7}", "order_id": f"order_{i % 40}",
+                  "event_type": "worker.progress",
+                  "payload": {"status": "completed" if i % 5 == 0 else "running", "theater": "demo", "attempt": i,
+                              "answer": "x" * (5000 if i % 100 == 0 else 10)}}
+                 for i in range(EVENTS)]
+        requests.post(f"{primary}/events/batch", json={"events": batch[:EVENTS // 2]}).raise_for_status()
+        procs.append(start(Path(tmp.name) / "follower.db", follower_port, LEDGER_FOLLOW_URL=primary))
+        for i in range(EVENTS // 2, EVENTS, 100):
+            requests.post(f"{primary}/events/batch", json={"events": batch[i:i + 100]}).raise_for_status()
+
+        last_id = requests.get(f"{primary}/events?before_id=999999999&limit=1").json()[0]["id"]
+        print(f"Follower caught up with {EVENTS} events in {wait_for(follower, last_id):.2f}s")
+
+        for path in ["/runs", "/orders", "/orders/order_0?expand=answer", "/events?after_id=0&limit=5000",
+                     "/events?run_id=run_3&limit=5000", "/events?order_id=order_0&expand=*"]:
+            assert requests.get(f"{primary}{path}").json() == requests.get(f"{follower}{path}").json(), \
+                f"follower differs from primary on GET {path}"
+
+        # Live tailing: one more write shows up on the follower.
+        requests.post(f"{primary}/events", json={"event_id": "rep-live", "run_id": "run_0", "event_type": "X",
+                                                 "payload": {"status": "failed"}}).raise_for_status()
+        print(f"Live event replicated in {wait_for(follower, last_id + 1) * 1e3:.0f}ms")
+        resp = requests.get(f"{follower}/runs/run_0")
+        assert resp.json()["status"] == "failed" and "X-Replication-Lag" in resp.headers, \
+            f"unexpected follower read: {resp.json()} {dict(resp.headers)}"
+        print(f"Replication status: {requests.get(f'{follower}/replication').json()}")
+
+        assert requests.post(f"{follower}/events", json={"event_type": "X", "payload": {}}).status_code == 403, \
+            "follower accepted a write"
+    finally:
+        for proc in procs:
+            proc.terminate()
+            proc.wait()
+        tmp.cleanup()
+
+if __name__ == "__main__":
+    try:
+        test_replica()
+    except AssertionError as e:
+        print(f"\nREPLICA TEST FAILED: {e}")
+        sys.exit(1)
+    print("\nREPLICA TEST SUCCESS")
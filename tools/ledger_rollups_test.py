@@ -0,0 +1,46 @@
+import sys
+import tempfile
+from pathlib import Path
+
+# Runs the Ledger app in-process against a throwaway database and checks the latency
+# percentiles of GET /metrics/rollups (rollups.py), including a heavy tail that lands in
+# the histogram's overflow bucket.
+LEDGER_DIR = Path(__file__).resolve().parent.parent / "garrison" / "ledger_service"
+sys.path.insert(0, str(LEDGER_DIR))
+
+from fastapi.testclient import TestClient
+
+def model_call(i: int, latency_ms: float) -> dict:
+    return {"event_id": f"call-{i}", "run_id": "r1", "order_id": "o1", "event_type": "worker.model_call.completed",
+            "ts": "2026-01-01T00:00:30+00:00",
+            "payload": {"theater": "demo", "model_id": "m", "profile_name": "p", "latency_ms": latency_ms}}
+
+def test_percentiles_saturate():
+    import database
+    tmp = tempfile.TemporaryDirectory()
+    database.DB_PATH = Path(tmp.name) / "ledger.db"
+    import main
+    from rollups import LATENCY_BUCKETS_MS, percentile
+    assert percentile([0] * (len(LATENCY_BUCKETS_MS) + 1), 0.99) == (None, False)
+    # 95 calls at 80 ms, 5 above the largest bound.
+    events = [model_call(i, 80) for i in range(95)] + [model_call(95 + i, LATENCY_BUCKETS_MS[-1] * 2) for i in range(5)]
+    try:
+        with TestClient(main.app) as client:
+            client.post("/events/batch", json={"events": events}).raise_for_status()
+            rollups = client.get("/metrics/rollups?granularity=hour").json()["rollups"]
+            assert len(rollups) == 1, rollups
+            r = rollups[0]
+            assert (r["latency_p50_ms"], r["latency_p95_ms"]) == (100, 100), r
+            assert r["latency_p99_ms"] == LATENCY_BUCKETS_MS[-1], r
+            assert r["latency_saturated"] == ["p99"], r
+    finally:
+        database.close_db()
+        tmp.cleanup()
+    print("\nROLLUPS TEST SUCCESS")
+
+if __name__ == "__main__":
+    try:
+        test_percentiles_saturate()
+    except AssertionError as e:
+        print(f"\nROLLUPS TEST FAILED: {e}")
+        sys.exit(1)
@@ -0,0 +1,105 @@
+import sys
+import time
+import asyncio
+import argparse
+import tempfile
+from pathlib import Path
+
+# Write-path benchmark for the storage engines (storage.py): concurrent clients submit
+# batches through the group committer, as POST /events/batch does, against a throwaway
+# ledger per engine. Reports acknowledged events/sec and per-request latency, how long the
+# log engine's index takes to catch up, and checks that both engines end up with the same
+# events and snapshots.
+LEDGER_DIR = Path(__file__).resolve().parent.parent / "garrison" / "ledger_service"
+sys.path.insert(0, str(LEDGER_DIR))
+
+import database
+import storage
+from database import init_db, recover_projection, read_db
+from writer import GroupCommitter
+
+def make_rows(client: int, requests: int, batch: int) -> list:
+    # Each client owns its runs, so per-run event order doesn't depend on scheduling.
+    out = []
+    for r in range(requests):
+        rows = []
+        for i in range(batch):
+            n = r * batch + i
+            payload = ('{"status": "%s", "theater": "demo", "stage": "apply", "attempt": %d, '
+                       '"message": "applied patch to src/module_%d.py"}' % ("completed" if n % 9 == 0 else "running", n, n % 97))
+            rows.append((None, f"bench-{client}-{n}", f"2026-01-01T00:{n // 60 % 60:02d}:{n % 60:02d}+00:00",
+                         f"run_{client}_{n % 5}", f"order_{client}_{n % 50}", "worker.progress", payload))
+        out.append(rows)
+    return out
+
+async def drive(committer: GroupCommitter, work: list) -> list:
+    latencies = []
+    async def client(requests):
+        for rows in requests:
+            t = time.perf_counter()
+            await committer.submit(rows)
+            latencies.append(time.perf_counter() - t)
+    await asyncio.gather(*(client(requests) for requests in work))
+    return latencies
+
+def percentile(values: list, q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+async def run_engine(name: str, path: Path, work: list) -> dict:
+    storage.STORAGE = name
+    init_db(path)
+    recover_projection(background=False, path=path)
+    engine = storage.engine(path)
+    committer = GroupCommitter(str(path), engine)
+    committer.start(lambda last_id: None)
+    events = sum(len(rows) for requests in work for rows in requests)
+    t = time.perf_counter()
+    latencies = await drive(committer, work)
+    acked = time.perf_counter() - t
+    await engine.wait_indexed(600)
+    indexed = time.perf_counter() - t
+    stats = committer.stats()
+    await committer.stop()
+    return {"engine": name, "events": events, "ack_seconds": acked, "indexed_seconds": indexed,
+            "p50_ms": percentile(latencies, 0.5) * 1e3, "p99_ms": percentile(latencies, 0.99) * 1e3,
+            "commits": stats["commits"], "largest_group": stats["largest_group"]}
+
+def contents(path: Path) -> tuple:
+    with read_db(path) as conn:
+        events = conn.execute("SELECT event_id, ts, run_id, order_id, event_type, payload FROM events WHERE id > 0 ORDER BY event_id").fetchall()
+        runs = conn.execute("SELECT * FROM runs_snapshot WHERE run_id > '' ORDER BY run_id").fetchall()
+        orders = conn.execute("SELECT * FROM orders_snapshot WHERE order_id > '' ORDER BY order_id").fetchall()
+    return [tuple(r) for r in events], [tuple(r) for r in runs], [tuple(r) for r in orders]
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the ledger storage engines")
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=200, help="Requests per client")
+    parser.add_argument("--batch", type=int, default=10, help="Events per request")
+    args = parser.parse_args()
+
+    tmp = tempfile.TemporaryDirectory()
+    work = [make_rows(c, args.requests, args.batch) for c in range(args.clients)]
+    print(f"{args.clients} clients x {args.requests} requests x {args.batch} events, "
+          f"LEDGER_DURABILITY={database.DURABILITY}")
+    print(f"{'engine':<8} {'acked/s':>10} {'ack s':>8} {'indexed s':>10} {'p50 ms':>8} {'p99 ms':>8} {'commits':>8}")
+    results = {}
+    try:
+        for name in ("sqlite", "log"):
+            path = Path(tmp.name) / f"{name}.db"
+            r = asyncio.run(run_engine(name, path, work))
+            results[name] = contents(path)
+            print(f"{name:<8} {r['events'] / r['ack_seconds']:10.0f} {r['ack_seconds']:8.2f} {r['indexed_seconds']:10.2f} "
+                  f"{r['p50_ms']:8.1f} {r['p99_ms']:8.1f} {r['commits']:8d}")
+    finally:
+        database.close_db()
+        tmp.cleanup()
+
+    if results["sqlite"] != results["log"]:
+        print("\nERROR: engines disagree on events or snapshots")
+        sys.exit(1)
+    print("\nEngines agree on events and snapshots.")
+
+if __name__ == "__main__":
+    main()